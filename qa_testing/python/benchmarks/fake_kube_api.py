@@ -0,0 +1,384 @@
+###########################################################
+#
+# A local fake Kubernetes API server for qa_libraries.
+# kube_api and the checks built on it.
+#
+# Serves a fixed set of objects over keep-alive HTTP/1.1
+# with the read-only parts of the API the checks use:
+#
+#   GET /api/v1/[namespaces/<ns>/]<resource>[/<name>]
+#   GET /apis/<group>/<version>/[namespaces/<ns>/]<resource>[/<name>]
+#   GET /api/v1/namespaces/<ns>/pods/<name>/log
+#
+# with label selectors (=, ==, !=, in, notin, exists),
+# field selectors (=, ==, != on any dotted field) and
+# 'limit'/'continue' pagination; a continue token expires
+# (410) when the objects changed since the first page. It
+# counts connections and requests, and can add a delay to
+# every new connection (a TLS handshake) and to every
+# request (the network round trip). Run it on its own to
+# try the checks without a cluster:
+#
+#   python3 benchmarks/fake_kube_api.py --pods 500 --kubeconfig /tmp/fake.kubeconfig
+#   KUBECONFIG=/tmp/fake.kubeconfig python3 kube_checks.py coredns
+#
+
+import argparse
+import base64
+import copy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import urllib.parse
+
+FAKE_TOKEN = "fake-kube-api-token"
+
+# <resource>, <namespace>, <name>, <subresource> of an API path
+_PATH_PATTERN = re.compile(r'^/(?:api/v1|apis/[^/]+/[^/]+)(?:/namespaces/([^/]+))?/([^/]+)(?:/([^/]+))?(?:/([^/]+))?$')
+_LABEL_TERM_PATTERN = re.compile(r'\s*(!?)([\w./-]+)\s*'
+                                 r'(?:(==|=|!=)\s*([\w./-]*)|\s+(in|notin)\s*\(([^)]*)\))?\s*(?:,|$)')
+
+
+def _field(obj: Dict, path: str) -> str:
+    value = obj
+    for key in path.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return "" if value is None else str(value)
+
+
+def match_label_selector(labels: Dict[str, str], selector: str) -> bool:
+    """
+    :param labels: The labels of an object.
+    :param selector: A label selector.
+    :return: Whether the labels match the selector.
+    """
+    position = 0
+    while position < len(selector):
+        term = _LABEL_TERM_PATTERN.match(selector, position)
+        if not term or term.end() == position:
+            raise ValueError(f"invalid label selector '{selector}'")
+        position = term.end()
+        negated, key, operator, value, set_operator, values = term.groups()
+        if operator in ("=", "=="):
+            matched = labels.get(key) == value
+        elif operator == "!=":
+            matched = labels.get(key) != value
+        elif set_operator:
+            members = {member.strip() for member in values.split(",")}
+            matched = (labels.get(key) in members) if set_operator == "in" else (labels.get(key) not in members)
+        else:
+            matched = (key in labels) != bool(negated)
+        if not matched:
+            return False
+    return True
+
+
+def match_field_selector(obj: Dict, selector: str) -> bool:
+    """
+    :param obj: An API object.
+    :param selector: A field selector.
+    :return: Whether the object matches the selector.
+    """
+    for term in filter(None, (term.strip() for term in selector.split(","))):
+        field, operator, value = re.match(r'^([\w.]+)\s*(==|=|!=)\s*(.*)$', term).groups()
+        if (_field(obj, field) == value) != (operator != "!="):
+            return False
+    return True
+
+
+class FakeKubeApi:
+    """
+    The objects served by the fake API server and its counters.
+    """
+
+    def __init__(self, objects: Dict[str, List[Dict]], logs: Optional[Dict[Tuple[str, str], str]] = None,
+                 token: Optional[str] = FAKE_TOKEN, connect_delay: float = 0.0, request_delay: float = 0.0):
+        """
+        :param objects: The objects of each resource, e.g. {'pods': [...], 'services': [...]}.
+        :param logs: The log of each (namespace, pod).
+        :param token: The bearer token clients must send (None: no authentication).
+        :param connect_delay: Seconds added to every new connection.
+        :param request_delay: Seconds added to every request.
+        """
+        self.objects = objects
+        self.logs = logs or {}
+        self.token = token
+        self.connect_delay = connect_delay
+        self.request_delay = request_delay
+        self.resource_version = 1
+        self.connections = 0
+        self.requests: List[str] = []
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def update(self, resource: str, objects: List[Dict]) -> None:
+        """
+        Replace the objects of a resource, which expires the continue tokens handed out so far.
+        :param resource: The plural resource.
+        :param objects: Its new objects.
+        :return: None
+        """
+        with self._lock:
+            self.objects[resource] = objects
+            self.resource_version += 1
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.connections = 0
+            self.requests = []
+
+    def list(self, resource: str, namespace: Optional[str], query: Dict[str, str]) -> Tuple[int, Dict]:
+        """
+        :return: The status and body of a list request.
+        """
+        with self._lock:
+            resource_version = self.resource_version
+            objects = [obj for obj in self.objects.get(resource, [])
+                       if not namespace or obj["metadata"].get("namespace") == namespace]
+        try:
+            if query.get("labelSelector"):
+                objects = [obj for obj in objects
+                           if match_label_selector(obj["metadata"].get("labels") or {}, query["labelSelector"])]
+            if query.get("fieldSelector"):
+                objects = [obj for obj in objects if match_field_selector(obj, query["fieldSelector"])]
+        except (ValueError, AttributeError) as e:
+            return 400, _status(400, "BadRequest", str(e))
+        objects.sort(key=lambda obj: (obj["metadata"].get("namespace", ""), obj["metadata"]["name"]))
+
+        offset = 0
+        if query.get("continue"):
+            token = json.loads(base64.b64decode(query["continue"]))
+            if token["rv"] != resource_version:
+                return 410, _status(410, "Expired", "The provided continue parameter is too old to display a "
+                                                     "consistent list result.")
+            offset = token["offset"]
+        limit = int(query.get("limit") or 0)
+        page = objects[offset:offset + limit] if limit > 0 else objects[offset:]
+        metadata = {"resourceVersion": str(resource_version)}
+        if limit > 0 and offset + limit < len(objects):
+            metadata["continue"] = base64.b64encode(
+                json.dumps({"rv": resource_version, "offset": offset + limit}).encode()).decode()
+            metadata["remainingItemCount"] = len(objects) - offset - limit
+        return 200, {"kind": "List", "apiVersion": "v1", "metadata": metadata, "items": copy.deepcopy(page)}
+
+    def get(self, resource: str, namespace: Optional[str], name: str) -> Tuple[int, Dict]:
+        """
+        :return: The status and body of a get request.
+        """
+        with self._lock:
+            for obj in self.objects.get(resource, []):
+                if obj["metadata"]["name"] == name and (obj["metadata"].get("namespace") or None) == namespace:
+                    return 200, copy.deepcopy(obj)
+        return 404, _status(404, "NotFound", f'{resource} "{name}" not found')
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Serve in a background thread.
+        :return: The server URL.
+        """
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def write_kubeconfig(self, path: str, context: str = "fake") -> str:
+        """
+        Write a kubeconfig pointing at the running server.
+        :return: The path of the kubeconfig.
+        """
+        user = f"    token: {self.token}\n" if self.token else "    {}\n"
+        with open(path, 'w') as file:
+            file.write(f"apiVersion: v1\nkind: Config\ncurrent-context: {context}\n"
+                       f"clusters:\n- name: {context}\n  cluster:\n    server: {self.url}\n"
+                       f"contexts:\n- name: {context}\n  context:\n    cluster: {context}\n    user: {context}\n"
+                       f"users:\n- name: {context}\n  user:\n{user}")
+        return path
+
+
+def _status(code: int, reason: str, message: str) -> Dict:
+    return {"kind": "Status", "apiVersion": "v1", "status": "Failure", "message": message, "reason": reason,
+            "code": code}
+
+
+def _make_handler(api: FakeKubeApi):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Like the API server (Go sets TCP_NODELAY), so headers and body are not held back by Nagle's algorithm
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            with api._lock:
+                api.connections += 1
+            time.sleep(api.connect_delay)
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, code: int, body: bytes, content_type: str = "application/json") -> None:
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            time.sleep(api.request_delay)
+            with api._lock:
+                api.requests.append(self.path)
+            if api.token and self.headers.get("Authorization") != f"Bearer {api.token}":
+                self._send(401, json.dumps(_status(401, "Unauthorized", "Unauthorized")).encode())
+                return
+
+            parsed = urllib.parse.urlsplit(self.path)
+            query = dict(urllib.parse.parse_qsl(parsed.query))
+            match = _PATH_PATTERN.match(parsed.path)
+            if not match:
+                self._send(404, json.dumps(_status(404, "NotFound", "the server could not find the requested "
+                                                                    "resource")).encode())
+                return
+            namespace, resource, name, subresource = match.groups()
+            if subresource == "log" and resource == "pods":
+                if (namespace, name) not in api.logs:
+                    code, body = api.get(resource, namespace, name)
+                    if code != 200:
+                        self._send(code, json.dumps(body).encode())
+                        return
+                lines = api.logs.get((namespace, name), "").splitlines(keepends=True)
+                tail = int(query.get("tailLines") or 0)
+                self._send(200, "".join(lines[-tail:] if tail > 0 else lines).encode(), "text/plain")
+                return
+            if subresource:
+                self._send(404, json.dumps(_status(404, "NotFound", f"unknown subresource '{subresource}'")).encode())
+                return
+            code, body = api.get(resource, namespace, name) if name else api.list(resource, namespace, query)
+            self._send(code, json.dumps(body).encode())
+
+    return Handler
+
+
+def make_pod(namespace: str, name: str, labels: Optional[Dict[str, str]] = None, phase: str = "Running",
+             image: str = "registry.example/app:1.0.0") -> Dict:
+    """
+    :return: A pod object with one container.
+    """
+    ready = phase == "Running"
+    return {
+        "apiVersion": "v1", "kind": "Pod",
+        "metadata": {"name": name, "namespace": namespace, "labels": labels or {}},
+        "spec": {"nodeName": "node-1", "containers": [{"name": "main", "image": image}]},
+        "status": {"phase": phase,
+                   "conditions": [{"type": "Ready", "status": "True" if ready else "False"}],
+                   "containerStatuses": [{"name": "main", "image": image, "ready": ready, "restartCount": 0,
+                                          "state": {"running": {}} if ready else {"waiting": {"reason": "Pending"}}}]},
+    }
+
+
+def _workload(kind: str, api_version: str, namespace: str, name: str, spec: Dict, status: Dict) -> Dict:
+    return {"apiVersion": api_version, "kind": kind, "metadata": {"name": name, "namespace": namespace},
+            "spec": spec, "status": status}
+
+
+def synthetic_cluster(pods: int = 100, namespaces: int = 4, not_running: int = 0, nodes: int = 3,
+                      unhealthy: int = 0) -> Tuple[Dict[str, List[Dict]], Dict[Tuple[str, str], str]]:
+    """
+    Generate the objects of a small cluster: CoreDNS with its service and endpoints, workload pods, and per
+    workload namespace a deployment, statefulset, daemonset, job and HPA.
+    :param pods: The number of workload pods, spread over the namespaces.
+    :param namespaces: The number of workload namespaces.
+    :param not_running: How many of the workload pods are Pending.
+    :param nodes: The number of nodes.
+    :param unhealthy: How many of the nodes, and of the workloads of each kind, are unhealthy.
+    :return: The objects of each resource and the logs of each pod.
+    """
+    objects: Dict[str, List[Dict]] = {"pods": [], "services": [], "endpoints": [], "namespaces": [], "nodes": [],
+                                      "deployments": [], "statefulsets": [], "daemonsets": [], "jobs": [],
+                                      "horizontalpodautoscalers": []}
+    logs: Dict[Tuple[str, str], str] = {}
+    for index in range(2):
+        pod = make_pod("kube-system", f"coredns-5d78c9869d-{index:05d}", {"k8s-app": "kube-dns"},
+                       image="coredns/coredns:v1.11.1")
+        objects["pods"].append(pod)
+        logs[("kube-system", pod["metadata"]["name"])] = ".:53\nCoreDNS-1.11.1\nlinux/amd64, go1.21\n"
+    objects["services"].append({"apiVersion": "v1", "kind": "Service",
+                                "metadata": {"name": "kube-dns", "namespace": "kube-system"},
+                                "spec": {"clusterIP": "172.20.0.10"}})
+    objects["endpoints"].append({"apiVersion": "v1", "kind": "Endpoints",
+                                 "metadata": {"name": "kube-dns", "namespace": "kube-system"},
+                                 "subsets": [{"addresses": [{"ip": "10.0.1.10"}, {"ip": "10.0.2.10"}]}]})
+
+    names = ["kube-system"] + [f"workload-{index}" for index in range(namespaces)]
+    objects["namespaces"] = [{"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": name},
+                              "status": {"phase": "Active"}} for name in names]
+    objects["nodes"] = [{"apiVersion": "v1", "kind": "Node", "metadata": {"name": f"ip-10-0-{index}-1.ec2.internal"},
+                         "status": {"conditions": [
+                             {"type": "MemoryPressure", "status": "False"},
+                             {"type": "Ready", "status": "Unknown" if index < unhealthy else "True"}]}}
+                        for index in range(nodes)]
+    for index in range(pods):
+        namespace = f"workload-{index % max(1, namespaces)}"
+        phase = "Pending" if index < not_running else "Running"
+        pod = make_pod(namespace, f"app-{index:05d}", {"app": f"app-{index % 10}"}, phase)
+        objects["pods"].append(pod)
+        logs[(namespace, pod["metadata"]["name"])] = f"started app-{index:05d}\n"
+
+    for index, namespace in enumerate(names[1:]):
+        ready = 1 if index < unhealthy else 2
+        objects["deployments"].append(_workload("Deployment", "apps/v1", namespace, "web", {"replicas": 2},
+                                                {"replicas": 2, "availableReplicas": ready}))
+        objects["statefulsets"].append(_workload("StatefulSet", "apps/v1", namespace, "db", {"replicas": 2},
+                                                 {"replicas": 2, "readyReplicas": ready}))
+        objects["daemonsets"].append(_workload("DaemonSet", "apps/v1", namespace, "agent", {},
+                                               {"desiredNumberScheduled": nodes,
+                                                "numberAvailable": nodes - 1 if index < unhealthy else nodes}))
+        objects["jobs"].append(_workload("Job", "batch/v1", namespace, "migrate", {"completions": 1},
+                                         {} if index < unhealthy else {"succeeded": 1}))
+        objects["horizontalpodautoscalers"].append(
+            _workload("HorizontalPodAutoscaler", "autoscaling/v2", namespace, "web", {"maxReplicas": 4},
+                      {"currentReplicas": ready, "desiredReplicas": 2}))
+    return objects, logs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a synthetic cluster as a fake Kubernetes API server")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on (default: any free port)")
+    parser.add_argument("--pods", type=int, default=100, help="Number of workload pods")
+    parser.add_argument("--namespaces", type=int, default=4, help="Number of workload namespaces")
+    parser.add_argument("--not-running", type=int, default=0, help="Number of workload pods left Pending")
+    parser.add_argument("--nodes", type=int, default=3, help="Number of nodes")
+    parser.add_argument("--unhealthy", type=int, default=0,
+                        help="Number of unhealthy nodes, and of unhealthy workloads of each kind")
+    parser.add_argument("--connect-ms", type=float, default=0.0, help="Delay added to every new connection")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay added to every request")
+    parser.add_argument("--kubeconfig", default=os.path.join(os.getcwd(), "fake-kube-api.kubeconfig"),
+                        help="Kubeconfig written for the server")
+    args = parser.parse_args()
+
+    cluster_objects, pod_logs = synthetic_cluster(args.pods, args.namespaces, args.not_running, args.nodes,
+                                                  args.unhealthy)
+    fake_api = FakeKubeApi(cluster_objects, pod_logs, connect_delay=args.connect_ms / 1000,
+                           request_delay=args.latency_ms / 1000)
+    fake_api.start(args.host, args.port)
+    print(f"Serving {fake_api.url}; kubeconfig: {fake_api.write_kubeconfig(args.kubeconfig)}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake_api.stop()
+        sys.exit(0)
@@ -0,0 +1,154 @@
+###########################################################
+#
+# Import-time benchmark of the QA CLI entry points.
+#
+# Every entry point module is imported in a fresh
+# interpreter with '-X importtime', several times, and the
+# median cumulative import time is reported together with
+# its heaviest imports. Every run is compared against the
+# committed baseline, benchmarks/import_time_baseline.json,
+# and fails on a startup regression; after an intended
+# change, record a new one:
+#
+#   python3 benchmarks/import_time.py
+#   python3 benchmarks/import_time.py --save-baseline benchmarks/import_time_baseline.json
+#
+# A run also fails when an entry point imports one of the
+# modules that must stay lazy (GitPython, pkg_resources).
+#
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+QA_PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, QA_PYTHON_DIR)
+
+from qa_libraries.logger import log  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import_time_baseline.json")
+
+ENTRY_POINTS = ("bringup_cluster", "bringdown_cluster", "run_smoketests", "scan_pod_logs", "tfstate_snapshots",
+                "utils")
+
+# Modules the entry points must only import when they are actually used
+LAZY_MODULES = ("git", "pkg_resources")
+
+DEFAULT_REPEAT = 5
+DEFAULT_MAX_REGRESSION = 0.25
+
+# Differences below this many milliseconds are noise, whatever the relative change
+NOISE_FLOOR_MS = 10.0
+
+_IMPORT_TIME_PATTERN = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$')
+
+
+def measure_import(module: str) -> Tuple[float, List[Tuple[str, float]], List[str]]:
+    """
+    Import a module in a fresh interpreter.
+    :param module: The module to import.
+    :return: The cumulative import time (ms), its direct imports with their times (ms), and every imported module.
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=QA_PYTHON_DIR,
+                               env={**os.environ, "PYTHONPATH": QA_PYTHON_DIR}, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, stdin=subprocess.DEVNULL)
+    if completed.returncode != 0:
+        log.error(f"Importing '{module}' failed: {completed.stderr.decode(errors='replace').strip()[-500:]}")
+        raise RuntimeError(f"Importing '{module}' failed.")
+
+    total, children, imported = 0.0, [], []
+    for line in completed.stderr.decode(errors='replace').splitlines():
+        match = _IMPORT_TIME_PATTERN.match(line)
+        if not match:
+            continue
+        cumulative_ms, depth, name = int(match.group(2)) / 1000, len(match.group(3)) // 2, match.group(4)
+        imported.append(name)
+        if depth == 0 and name == module:
+            total = cumulative_ms
+        elif depth == 1:
+            children.append((name, cumulative_ms))
+    return total, children, imported
+
+
+def benchmark(modules: List[str], repeat: int) -> Dict[str, Dict]:
+    """
+    Measure the import time of each module.
+    :param modules: The modules to measure.
+    :param repeat: The number of fresh imports per module.
+    :return: Per module: the median import time (ms), its heaviest imports and the lazy modules it imported.
+    """
+    results = {}
+    for module in modules:
+        runs = [measure_import(module) for _ in range(repeat)]
+        median_run = sorted(runs, key=lambda run: run[0])[len(runs) // 2]
+        results[module] = {
+            "median_ms": round(statistics.median(run[0] for run in runs), 1),
+            "min_ms": round(min(run[0] for run in runs), 1),
+            "heaviest": [[name, round(ms, 1)] for name, ms in sorted(median_run[1], key=lambda c: -c[1])[:5]],
+            "eager_lazy_modules": sorted(set(median_run[2]) & set(LAZY_MODULES)),
+        }
+    return results
+
+
+def compare_to_baseline(results: Dict[str, Dict], baseline: Dict[str, Dict], max_regression: float) -> List[str]:
+    """
+    Find the modules whose import time regressed compared to a baseline.
+    :param results: The current results.
+    :param baseline: The baseline results.
+    :param max_regression: The allowed relative increase, e.g. 0.25 for 25%.
+    :return: A description of each regression.
+    """
+    regressions = []
+    for module, result in results.items():
+        if module not in baseline:
+            continue
+        before, after = baseline[module]["median_ms"], result["median_ms"]
+        if after > before * (1 + max_regression) and after - before > NOISE_FLOOR_MS:
+            regressions.append(f"{module}: {before:.1f} ms -> {after:.1f} ms (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the import time of the QA CLI entry points")
+    parser.add_argument("-m", "--module", action="append",
+                        help=f"Module to measure (repeatable, default: {', '.join(ENTRY_POINTS)})")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"Fresh imports per module (default: {DEFAULT_REPEAT})")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="Baseline JSON to compare against (default: the committed benchmarks/"
+                             "import_time_baseline.json)")
+    parser.add_argument("--no-baseline", dest="baseline", action="store_const", const=None,
+                        help="Do not compare against a baseline")
+    parser.add_argument("--save-baseline", help="Save the results as a baseline JSON")
+    parser.add_argument("--max-regression", type=float, default=DEFAULT_MAX_REGRESSION,
+                        help=f"Allowed relative slowdown against the baseline (default: {DEFAULT_MAX_REGRESSION})")
+
+    args = parser.parse_args()
+    results = benchmark(args.module or list(ENTRY_POINTS), max(1, args.repeat))
+
+    width = max(len(module) for module in results)
+    log.info(f"{'Module':<{width}}  {'Median':>9}  {'Min':>9}  Heaviest imports")
+    for module, result in results.items():
+        heaviest = ", ".join(f"{name} {ms:.0f}ms" for name, ms in result["heaviest"][:3])
+        log.info(f"{module:<{width}}  {result['median_ms']:>7.1f}ms  {result['min_ms']:>7.1f}ms  {heaviest}")
+
+    failures = [f"{module} imports {', '.join(result['eager_lazy_modules'])} at startup"
+                for module, result in results.items() if result["eager_lazy_modules"]]
+    if args.baseline:
+        log.info(f"Comparing against the baseline: {args.baseline}")
+        with open(args.baseline, 'r') as file:
+            failures += compare_to_baseline(results, json.load(file)["modules"], args.max_regression)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump({"python": sys.version.split()[0], "repeat": args.repeat, "modules": results}, file, indent=2)
+        log.info(f"Baseline saved to: {args.save_baseline}")
+
+    for failure in failures:
+        log.error(f"Startup regression: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,110 @@
+###########################################################
+#
+# Offline benchmark of qa_libraries.kube_api.
+#
+# Reads the status of every pod of a namespace from the
+# fake API server of benchmarks/fake_kube_api.py, which adds
+# QA_BENCH_CONNECT_MS to each new connection (the TCP and
+# TLS handshakes kubectl pays on every call) and
+# QA_BENCH_LATENCY_MS to each request:
+#
+#   per_pod_fresh   one GET per pod on a new connection,
+#                   like the per-pod 'Get Pod Status in
+#                   Namespace' loop of a Robot test
+#   per_pod_pooled  the same GETs, sent concurrently over
+#                   the keep-alive connection pool
+#   list            one paginated list of the namespace
+#
+#   python3 benchmarks/kube_api.py --pods 200
+#
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+QA_PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, QA_PYTHON_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_kube_api import FakeKubeApi, synthetic_cluster  # noqa: E402
+from qa_libraries.kube_api import KubeClient, api_path, load_kubeconfig  # noqa: E402
+from qa_libraries.kube_checks import get_pod_phases  # noqa: E402
+from qa_libraries.logger import log  # noqa: E402
+
+BENCH_NAMESPACE = "workload-0"
+
+DEFAULT_REPEAT = 3
+DEFAULT_PODS = 200
+DEFAULT_CONNECT_MS = float(os.getenv('QA_BENCH_CONNECT_MS', '20'))
+DEFAULT_LATENCY_MS = float(os.getenv('QA_BENCH_LATENCY_MS', '2'))
+
+
+def _pod_paths(client: KubeClient) -> List[str]:
+    return [api_path("pods", BENCH_NAMESPACE, pod["metadata"]["name"])
+            for pod in client.list_items(api_path("pods", BENCH_NAMESPACE))]
+
+
+def bench_per_pod_fresh(client: KubeClient) -> Dict[str, str]:
+    phases = {}
+    for path in _pod_paths(client):
+        pod = client.get(path)
+        phases[pod["metadata"]["name"]] = pod["status"]["phase"]
+        client.pool.close()
+    return phases
+
+
+def bench_per_pod_pooled(client: KubeClient) -> Dict[str, str]:
+    return {pod["metadata"]["name"]: pod["status"]["phase"] for pod in client.get_many(_pod_paths(client))}
+
+
+def bench_list(client: KubeClient) -> Dict[str, str]:
+    return get_pod_phases(client, BENCH_NAMESPACE)
+
+
+CASES: Dict[str, Callable[[KubeClient], Dict[str, str]]] = {
+    "per_pod_fresh": bench_per_pod_fresh,
+    "per_pod_pooled": bench_per_pod_pooled,
+    "list": bench_list,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Kubernetes API client against a fake API server")
+    parser.add_argument("-c", "--case", action="append", choices=list(CASES),
+                        help="Case to run (default: all); may be repeated")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT, help="Runs per case")
+    parser.add_argument("--pods", type=int, default=DEFAULT_PODS, help="Pods in the benchmarked namespace")
+    parser.add_argument("--connect-ms", type=float, default=DEFAULT_CONNECT_MS, help="Delay of a new connection")
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_LATENCY_MS, help="Delay of a request")
+    args = parser.parse_args()
+
+    objects, logs = synthetic_cluster(pods=args.pods, namespaces=1)
+    fake_api = FakeKubeApi(objects, logs, connect_delay=args.connect_ms / 1000, request_delay=args.latency_ms / 1000)
+    fake_api.start()
+    kubeconfig = fake_api.write_kubeconfig(os.path.join(tempfile.gettempdir(), f"qa-bench-{os.getpid()}.kubeconfig"))
+    try:
+        expected = None
+        log.info(f"{args.pods} pods, {args.connect_ms:.0f}ms per connection, {args.latency_ms:.0f}ms per request")
+        log.info(f"{'Case':<16} {'Median':>9} {'Min':>9} {'Connections':>12} {'Requests':>9}")
+        for case in args.case or list(CASES):
+            timings = []
+            for _ in range(args.repeat):
+                with KubeClient(load_kubeconfig([kubeconfig])) as client:
+                    fake_api.reset_counters()
+                    start = time.monotonic()
+                    phases = CASES[case](client)
+                    timings.append(time.monotonic() - start)
+                if expected is None:
+                    expected = phases
+                elif phases != expected:
+                    log.error(f"Case '{case}' returned different pod phases than the other cases.")
+                    sys.exit(1)
+            log.info(f"{case:<16} {statistics.median(timings) * 1000:>7.0f}ms {min(timings) * 1000:>7.0f}ms "
+                     f"{fake_api.connections:>12} {len(fake_api.requests):>9}")
+    finally:
+        fake_api.stop()
+        os.remove(kubeconfig)
@@ -0,0 +1,454 @@
+###########################################################
+#
+# Offline benchmark of the QA orchestration code.
+#
+# Times the Python code around terraform/aws/kubectl, with
+# the stand-ins of benchmarks/stub_cli.py first on the PATH
+# (no AWS account or cluster is needed):
+#
+#   run_command       drain and log QA_BENCH_OUTPUT_LINES lines
+#                     of 'terraform plan' output
+#   state_parse       stream-parse a synthetic multi-MB state
+#   state_backup      snapshot the state into an empty store
+#   state_restore     restore the state from the store
+#   bringup           a workspace bringup with a forced apply
+#   bringup_unchanged a bringup skipped by the drift check
+#   bringdown         a workspace bringdown
+#
+# Every case runs in a fresh interpreter with its caches,
+# logs and state under a throwaway directory. The bringup/
+# bringdown cases also report their overhead: the time not
+# spent waiting for a command. Every run is compared against
+# the committed baseline, benchmarks/orchestration_baseline.
+# json, and fails on a regression; after an intended change,
+# record a new one:
+#
+#   python3 benchmarks/orchestration.py
+#   python3 benchmarks/orchestration.py --save-baseline benchmarks/orchestration_baseline.json
+#
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+QA_PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, QA_PYTHON_DIR)
+
+from qa_libraries.logger import log  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "orchestration_baseline.json")
+STUB_CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_cli.py")
+STUB_TOOLS = ("terraform", "aws", "kubectl")
+EXAMPLE_MAIN_TF = os.path.join(os.path.dirname(os.path.dirname(QA_PYTHON_DIR)), "example", "main.tf")
+
+BENCH_CLUSTER = "qa-bench"
+
+DEFAULT_REPEAT = 5
+DEFAULT_OUTPUT_LINES = 100000
+DEFAULT_STATE_MB = 8.0
+DEFAULT_MAX_REGRESSION = 0.25
+
+# Differences below this many milliseconds are noise, whatever the relative change
+NOISE_FLOOR_MS = 20.0
+
+# Metrics compared against the baseline
+COMPARED_METRICS = ("median_s", "overhead_median_s")
+
+RESOURCE_TYPES = ("aws_iam_role_policy_attachment", "aws_security_group_rule", "helm_release", "kubernetes_manifest",
+                  "aws_route53_record", "aws_iam_policy")
+
+
+def write_synthetic_state(path: str, cluster_name: str, size_mb: float, serial: int = 1) -> int:
+    """
+    Write a Terraform state file of about the requested size, shaped like the state of an EKS cluster.
+    :param path: The state file to write.
+    :param cluster_name: The cluster name recorded by its aws_eks_cluster resource.
+    :param size_mb: The approximate size of the file in MB.
+    :param serial: The state serial.
+    :return: The size of the file in bytes.
+    """
+    resources = [{
+        "module": "module.main-eks", "mode": "managed", "type": "aws_eks_cluster", "name": "main",
+        "provider": "provider[\"registry.terraform.io/hashicorp/aws\"]",
+        "instances": [{"schema_version": 0, "attributes": {
+            "name": cluster_name, "version": "1.30",
+            "arn": f"arn:aws:eks:us-east-1:000000000000:cluster/{cluster_name}"}}],
+    }]
+    size, target_size = 0, size_mb * 1024 * 1024
+    while size < target_size:
+        i = len(resources)
+        resource = {
+            "module": f"module.main-eks.module.addon[\"addon-{i % 40}\"]", "mode": "managed",
+            "type": RESOURCE_TYPES[i % len(RESOURCE_TYPES)], "name": f"resource_{i}",
+            "provider": "provider[\"registry.terraform.io/hashicorp/aws\"]",
+            "instances": [{"index_key": key, "schema_version": 0, "attributes": {
+                "id": f"{cluster_name}-{i}-{key}",
+                "arn": f"arn:aws:iam::000000000000:policy/{cluster_name}-{i}-{key}",
+                "tags": {"Creator": "Terraform", "cluster": cluster_name, "index": str(i)},
+                "policy": json.dumps({"Version": "2012-10-17", "Statement": [
+                    {"Effect": "Allow", "Action": [f"eks:Describe{n}" for n in range(8)], "Resource": "*"}]}),
+            }, "dependencies": ["module.main-eks.aws_eks_cluster.main", f"module.main-eks.resource_{i - 1}"]}
+                for key in range(3)],
+        }
+        size += len(json.dumps(resource, indent=2))
+        resources.append(resource)
+
+    with open(path, 'w') as file:
+        json.dump({"version": 4, "terraform_version": "1.5.7", "serial": serial, "lineage": "qa-bench",
+                   "outputs": {}, "resources": resources}, file, indent=2)
+    return os.path.getsize(path)
+
+
+def write_stub_tools(bin_dir: str) -> None:
+    """
+    Write the terraform/aws/kubectl wrappers running benchmarks/stub_cli.py.
+    :param bin_dir: The directory to write them to, put first on the PATH of the cases.
+    """
+    os.makedirs(bin_dir, exist_ok=True)
+    for tool in STUB_TOOLS:
+        path = os.path.join(bin_dir, tool)
+        with open(path, 'w') as file:
+            file.write(f"#!/bin/sh\nexec \"{sys.executable}\" \"{STUB_CLI}\" {tool} \"$@\"\n")
+        os.chmod(path, 0o755)
+
+
+def _command_seconds(since: int) -> float:
+    """
+    :param since: The number of spans recorded before the measured run.
+    :return: The wall time covered by the command spans recorded since then (overlapping commands count once).
+    """
+    from qa_libraries.instrumentation import get_spans
+
+    intervals = sorted((recorded.start, recorded.end) for recorded in get_spans()[since:]
+                       if recorded.category == "command" and recorded.end is not None)
+    covered, current_start, current_end = 0.0, None, None
+    for start, end in intervals:
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                covered += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        covered += current_end - current_start
+    return covered
+
+
+def _measure(repeat: int, run: Callable[[], Optional[Dict[str, float]]],
+             setup: Optional[Callable[[], None]] = None, overhead: bool = False) -> List[Dict[str, float]]:
+    """
+    Time a run several times.
+    :param repeat: The number of timed runs.
+    :param run: The measured code; may return extra metrics of the run.
+    :param setup: Called (untimed) before each run.
+    :param overhead: Also report the time of each run not spent waiting for a command.
+    :return: The metrics of each run.
+    """
+    from qa_libraries.instrumentation import get_spans
+
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        spans_before = len(get_spans())
+        start_time = time.perf_counter()
+        extra = run() or {}
+        seconds = time.perf_counter() - start_time
+        metrics = {"seconds": seconds, **extra}
+        if overhead:
+            metrics["overhead_s"] = max(0.0, seconds - _command_seconds(spans_before))
+        runs.append(metrics)
+    return runs
+
+
+def bench_run_command(work_dir: str, repeat: int) -> List[Dict[str, float]]:
+    from qa_libraries.async_engine import Step, run_step_sync
+
+    def run():
+        # run_command is a thin wrapper returning the tails of this result
+        result = run_step_sync(Step("plan", "terraform plan -no-color", cwd=work_dir))
+        if result.returncode != 0:
+            raise RuntimeError(f"terraform plan failed: {result.stderr_tail}")
+        return {"bytes": result.stdout_bytes}
+
+    runs = _measure(repeat, run)
+    for metrics in runs:
+        metrics["mb_per_s"] = metrics["bytes"] / metrics["seconds"] / 1e6
+    return runs
+
+
+def bench_state_parse(work_dir: str, repeat: int) -> List[Dict[str, float]]:
+    from qa_libraries.tfstate_index import build_state_index
+
+    state_file = os.environ['QA_BENCH_STATE_FILE']
+    size = os.path.getsize(state_file)
+    return [{**metrics, "mb_per_s": size / metrics["seconds"] / 1e6}
+            for metrics in _measure(repeat, lambda: build_state_index(state_file) and None)]
+
+
+def bench_state_backup(work_dir: str, repeat: int) -> List[Dict[str, float]]:
+    from qa_libraries.tf_cluster_commands import backup_tfstate_files
+
+    state_dir, store_dir = os.path.join(work_dir, "cluster"), os.path.join(work_dir, "store")
+    os.makedirs(state_dir, exist_ok=True)
+    shutil.copyfile(os.environ['QA_BENCH_STATE_FILE'], os.path.join(state_dir, "terraform.tfstate"))
+
+    def setup():
+        # An empty store, so every run compresses and writes the state
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+    return _measure(repeat, lambda: backup_tfstate_files(state_dir, store_dir) and None, setup=setup)
+
+
+def bench_state_restore(work_dir: str, repeat: int) -> List[Dict[str, float]]:
+    from qa_libraries.tf_cluster_commands import backup_tfstate_files, restore_tfstate_files
+
+    source_dir, target_dir = os.path.join(work_dir, "source"), os.path.join(work_dir, "target")
+    store_dir = os.path.join(work_dir, "store")
+    os.makedirs(source_dir, exist_ok=True)
+    shutil.copyfile(os.environ['QA_BENCH_STATE_FILE'], os.path.join(source_dir, "terraform.tfstate"))
+    backup_tfstate_files(source_dir, store_dir)
+
+    def setup():
+        shutil.rmtree(target_dir, ignore_errors=True)
+        os.makedirs(target_dir)
+
+    return _measure(repeat, lambda: restore_tfstate_files(BENCH_CLUSTER, target_dir, store_dir=store_dir) and None,
+                    setup=setup)
+
+
+def _prepare_cluster_dir(work_dir: str) -> str:
+    cluster_dir = os.path.join(work_dir, "example")
+    os.makedirs(cluster_dir, exist_ok=True)
+    shutil.copyfile(EXAMPLE_MAIN_TF, os.path.join(cluster_dir, "main.tf"))
+    return cluster_dir
+
+
+def _cluster_action(action: str, cluster_dir: str, drift_check: bool = False) -> None:
+    from qa_libraries.cluster_orchestrator import run_cluster_action
+    from qa_libraries.tf_plan import ApplyOptions
+
+    extra = {"apply_options": ApplyOptions(drift_check=drift_check)} if action == "bringup" else {}
+    result = run_cluster_action(action, BENCH_CLUSTER, cluster_dir, **extra)
+    if not result.succeeded:
+        raise RuntimeError(f"{action} failed: {result.error}")
+
+
+def bench_bringup(work_dir: str, repeat: int) -> List[Dict[str, float]]:
+    cluster_dir = _prepare_cluster_dir(work_dir)
+    return _measure(repeat, lambda: _cluster_action("bringup", cluster_dir), overhead=True)
+
+
+def bench_bringup_unchanged(work_dir: str, repeat: int) -> List[Dict[str, float]]:
+    cluster_dir = _prepare_cluster_dir(work_dir)
+    _cluster_action("bringup", cluster_dir)
+    return _measure(repeat, lambda: _cluster_action("bringup", cluster_dir, drift_check=True), overhead=True)
+
+
+def bench_bringdown(work_dir: str, repeat: int) -> List[Dict[str, float]]:
+    cluster_dir = _prepare_cluster_dir(work_dir)
+    return _measure(repeat, lambda: _cluster_action("bringdown", cluster_dir),
+                    setup=lambda: _cluster_action("bringup", cluster_dir), overhead=True)
+
+
+CASES: Dict[str, Callable[[str, int], List[Dict[str, float]]]] = {
+    "run_command": bench_run_command,
+    "state_parse": bench_state_parse,
+    "state_backup": bench_state_backup,
+    "state_restore": bench_state_restore,
+    "bringup": bench_bringup,
+    "bringup_unchanged": bench_bringup_unchanged,
+    "bringdown": bench_bringdown,
+}
+
+
+def get_case_environment(bench_root: str, output_lines: int) -> Dict[str, str]:
+    """
+    :param bench_root: The throwaway directory of the benchmark run.
+    :param output_lines: The lines of output of the stub terraform plan/apply/destroy.
+    :return: The environment of a case: the stubs first on the PATH, every cache and log under bench_root.
+    """
+    return {
+        **os.environ,
+        "PATH": f"{os.path.join(bench_root, 'bin')}{os.pathsep}{os.environ.get('PATH', '')}",
+        "PYTHONPATH": QA_PYTHON_DIR,
+        "AWS_PROFILE": "qa-bench",
+        "AWS_REGION": "us-east-1",
+        "KUBECONFIG": os.path.join(bench_root, "kubeconfig"),
+        "QA_COMMAND_LOG_FILE": os.path.join(bench_root, "logs", "qa_commands.log"),
+        "QA_LOG_JSON_FILE": os.path.join(bench_root, "logs", "qa_run.jsonl"),
+        "QA_TIMING_REPORT": "0",
+        "QA_STEP_RETRIES": "0",
+        "QA_READ_CACHE_DIR": os.path.join(bench_root, "cache", "reads"),
+        "QA_TERRAFORM_CACHE_DIR": os.path.join(bench_root, "cache", "terraform"),
+        "QA_TFSTATE_INDEX_DIR": os.path.join(bench_root, "cache", "tfstate_index"),
+        "QA_DRIFT_FINGERPRINT_DIR": os.path.join(bench_root, "cache", "apply_fingerprints"),
+        "QA_RUN_JOURNAL_DIR": os.path.join(bench_root, "cache", "run_journals"),
+        "QA_FLEET_INDEX_DIR": os.path.join(bench_root, "cache", "fleet_inventory"),
+        "QA_KUBECONFIG_DIR": os.path.join(bench_root, "cache", "kubeconfigs"),
+        "QA_EKS_TOKEN_DIR": os.path.join(bench_root, "cache", "eks_tokens"),
+        "QA_BENCH_CLUSTERS": BENCH_CLUSTER,
+        "QA_BENCH_OUTPUT_LINES": str(output_lines),
+        "QA_BENCH_STATE_FILE": os.path.join(bench_root, "terraform.tfstate"),
+    }
+
+
+def run_case(case: str, repeat: int, bench_root: str, output_lines: int, verbose: bool) -> List[Dict[str, float]]:
+    """
+    Run a case in a fresh interpreter, in its own directory under the benchmark directory.
+    :return: The metrics of each timed run.
+    """
+    work_dir = os.path.join(bench_root, case)
+    os.makedirs(work_dir)
+    result_file = os.path.join(work_dir, "result.json")
+    case_log = os.path.join(work_dir, "case.log")
+    with open(case_log, 'w') as output:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", case, "--repeat", str(repeat),
+                                    "--work-dir", work_dir, "--result-file", result_file],
+                                   cwd=work_dir, env=get_case_environment(bench_root, output_lines),
+                                   stdin=subprocess.DEVNULL, stdout=None if verbose else output,
+                                   stderr=None if verbose else subprocess.STDOUT)
+    if completed.returncode != 0:
+        with open(case_log, 'r', errors='replace') as output:
+            tail = output.read()[-2000:]
+        log.error(f"Benchmark case '{case}' failed:\n{tail}")
+        raise RuntimeError(f"Benchmark case '{case}' failed.")
+    with open(result_file, 'r') as file:
+        return json.load(file)
+
+
+def summarize(runs: List[Dict[str, float]]) -> Dict[str, float]:
+    """
+    :param runs: The metrics of each run of a case.
+    :return: The median/min time, and the median of the other metrics.
+    """
+    seconds = [metrics["seconds"] for metrics in runs]
+    summary = {"median_s": round(statistics.median(seconds), 4), "min_s": round(min(seconds), 4)}
+    for key in runs[0]:
+        if key != "seconds":
+            name = "overhead_median_s" if key == "overhead_s" else key
+            summary[name] = round(statistics.median(metrics[key] for metrics in runs), 4)
+    return summary
+
+
+def compare_to_baseline(results: Dict[str, Dict], baseline: Dict[str, Dict], max_regression: float) -> List[str]:
+    """
+    Find the cases that regressed compared to a baseline.
+    :param results: The current results.
+    :param baseline: The baseline results.
+    :param max_regression: The allowed relative increase, e.g. 0.25 for 25%.
+    :return: A description of each regression.
+    """
+    regressions = []
+    for case, result in results.items():
+        for metric in COMPARED_METRICS:
+            if metric not in result or metric not in baseline.get(case, {}):
+                continue
+            before, after = baseline[case][metric], result[metric]
+            if after > before * (1 + max_regression) and (after - before) * 1000 > NOISE_FLOOR_MS:
+                regressions.append(f"{case} {metric}: {before * 1000:.0f} ms -> {after * 1000:.0f} ms "
+                                   f"(+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def _format_details(result: Dict[str, float]) -> str:
+    details = []
+    if "mb_per_s" in result:
+        details.append(f"{result['mb_per_s']:.1f} MB/s")
+    if "overhead_median_s" in result:
+        details.append(f"overhead {result['overhead_median_s'] * 1000:.0f}ms")
+    return ", ".join(details)
+
+
+def _run_case_in_this_process(case: str, repeat: int, work_dir: str, result_file: str) -> None:
+    runs = CASES[case](work_dir, repeat)
+    with open(result_file, 'w') as file:
+        json.dump(runs, file)
+
+
+def _parse_args() -> Tuple[argparse.ArgumentParser, argparse.Namespace]:
+    parser = argparse.ArgumentParser(description="Benchmark the QA orchestration code against stub "
+                                                 "terraform/aws/kubectl executables")
+    parser.add_argument("-c", "--case", action="append", choices=list(CASES),
+                        help="Case to run (repeatable, default: all)")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"Timed runs per case (default: {DEFAULT_REPEAT})")
+    parser.add_argument("--output-lines", type=int, default=DEFAULT_OUTPUT_LINES,
+                        help=f"Lines of output of the stub terraform plan/apply/destroy "
+                             f"(default: {DEFAULT_OUTPUT_LINES})")
+    parser.add_argument("--state-mb", type=float, default=DEFAULT_STATE_MB,
+                        help=f"Size of the synthetic state file in MB (default: {DEFAULT_STATE_MB})")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="Baseline JSON to compare against (default: the committed benchmarks/"
+                             "orchestration_baseline.json)")
+    parser.add_argument("--no-baseline", dest="baseline", action="store_const", const=None,
+                        help="Do not compare against a baseline")
+    parser.add_argument("--save-baseline", help="Save the results as a baseline JSON")
+    parser.add_argument("--max-regression", type=float, default=DEFAULT_MAX_REGRESSION,
+                        help=f"Allowed relative slowdown against the baseline (default: {DEFAULT_MAX_REGRESSION})")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark directory (logs, state, caches)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the log output of the cases")
+    # Set when a case runs in its own interpreter
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    return parser, parser.parse_args()
+
+
+if __name__ == "__main__":
+    parser, args = _parse_args()
+    if args.result_file:
+        _run_case_in_this_process(args.case[0], args.repeat, args.work_dir, args.result_file)
+        sys.exit(0)
+
+    config = {"output_lines": args.output_lines, "state_mb": args.state_mb}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        if baseline.get("config") != config:
+            log.error(f"The baseline was recorded with {baseline.get('config')}, not {config}; "
+                      f"run with the same --output-lines/--state-mb, or pass --no-baseline.")
+            sys.exit(1)
+        log.info(f"Comparing against the baseline: {args.baseline}")
+
+    bench_root = tempfile.mkdtemp(prefix="qa-bench-")
+    try:
+        write_stub_tools(os.path.join(bench_root, "bin"))
+        state_size = write_synthetic_state(os.path.join(bench_root, "terraform.tfstate"), BENCH_CLUSTER, args.state_mb)
+        log.info(f"Benchmark directory: {bench_root} (state: {state_size / 1e6:.1f} MB, "
+                 f"{args.output_lines} output lines per terraform command)")
+
+        results = {}
+        for case in args.case or list(CASES):
+            results[case] = summarize(run_case(case, max(1, args.repeat), bench_root, args.output_lines,
+                                               args.verbose))
+    finally:
+        if args.keep:
+            log.info(f"Benchmark directory kept: {bench_root}")
+        else:
+            shutil.rmtree(bench_root, ignore_errors=True)
+
+    width = max(len(case) for case in results)
+    log.info(f"{'Case':<{width}}  {'Median':>9}  {'Min':>9}  Details")
+    for case, result in results.items():
+        log.info(f"{case:<{width}}  {result['median_s'] * 1000:>7.0f}ms  {result['min_s'] * 1000:>7.0f}ms  "
+                 f"{_format_details(result)}")
+
+    failures = compare_to_baseline(results, baseline["cases"], args.max_regression) if baseline else []
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump({"python": sys.version.split()[0], "repeat": args.repeat, "config": config, "cases": results},
+                      file, indent=2)
+        log.info(f"Baseline saved to: {args.save_baseline}")
+
+    for failure in failures:
+        log.error(f"Performance regression: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,130 @@
+###########################################################
+#
+# Offline stand-ins for 'terraform', 'aws' and 'kubectl'.
+#
+# Used by benchmarks/orchestration.py, which puts wrapper
+# scripts for them first on the PATH. They never touch AWS
+# or a cluster but emit output of a realistic shape and
+# volume, so the orchestration code around them can be
+# timed:
+#
+#   terraform init           a few lines, and the
+#                            .terraform/providers and
+#                            modules.json init installs
+#   terraform plan           QA_BENCH_OUTPUT_LINES lines of
+#                            'Refreshing state...' output
+#   terraform apply          QA_BENCH_OUTPUT_LINES lines of
+#                            'Still creating...' output, then
+#                            copies QA_BENCH_STATE_FILE to
+#                            ./terraform.tfstate
+#   terraform destroy        the same, then writes a state
+#                            without resources
+#   aws eks list-clusters    the clusters in QA_BENCH_CLUSTERS
+#   aws eks describe-cluster / update-kubeconfig /
+#       sts get-caller-identity
+#   kubectl get <type> -A -o json
+#                            QA_BENCH_KUBE_ITEMS items
+#
+# Usage: stub_cli.py <terraform|aws|kubectl> [arguments...]
+#
+
+import json
+import os
+import shutil
+import sys
+from typing import List
+
+OUTPUT_LINES = int(os.getenv('QA_BENCH_OUTPUT_LINES', '2000'))
+KUBE_ITEMS = int(os.getenv('QA_BENCH_KUBE_ITEMS', '200'))
+CLUSTERS = os.getenv('QA_BENCH_CLUSTERS', '').split()
+
+# Lines are written in chunks of this many lines, like terraform flushing its progress output
+WRITE_CHUNK_LINES = 1000
+
+
+def write_lines(lines, stream=sys.stdout) -> None:
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= WRITE_CHUNK_LINES:
+            stream.write("\n".join(chunk) + "\n")
+            chunk = []
+    if chunk:
+        stream.write("\n".join(chunk) + "\n")
+    stream.flush()
+
+
+def resource_address(i: int) -> str:
+    return f'module.main-eks.module.eks_managed_node_group["ng-{i % 7}"].aws_eks_node_group.this[{i % 50}]'
+
+
+def progress_lines(verb: str, count: int):
+    return (f"{resource_address(i)}: {verb}... [{(i % 600) + 10}s elapsed]" for i in range(count))
+
+
+def terraform(args: List[str]) -> int:
+    command = args[0] if args else ""
+    if command == "init":
+        # What tf_init_cache checks for before it skips the next init
+        os.makedirs(os.path.join(".terraform", "providers"), exist_ok=True)
+        os.makedirs(os.path.join(".terraform", "modules"), exist_ok=True)
+        with open(os.path.join(".terraform", "modules", "modules.json"), 'w') as file:
+            file.write('{"Modules": []}')
+        write_lines(["Initializing the backend...", "Initializing modules...", "Initializing provider plugins...",
+                     "Terraform has been successfully initialized!"])
+    elif command == "plan":
+        write_lines(f"{resource_address(i)}: Refreshing state... [id=qa-bench-{i}]" for i in range(OUTPUT_LINES))
+        write_lines(["No changes. Your infrastructure matches the configuration."])
+    elif command == "apply":
+        write_lines(progress_lines("Still creating", OUTPUT_LINES))
+        shutil.copyfile(os.environ['QA_BENCH_STATE_FILE'], "terraform.tfstate")
+        write_lines([f"Apply complete! Resources: {OUTPUT_LINES // 10} added, 0 changed, 0 destroyed."])
+    elif command == "destroy":
+        write_lines(progress_lines("Still destroying", OUTPUT_LINES))
+        with open("terraform.tfstate", 'r') as file:
+            serial = json.load(file).get("serial", 0)
+        with open("terraform.tfstate", 'w') as file:
+            json.dump({"version": 4, "terraform_version": "1.5.7", "serial": serial + 1, "lineage": "qa-bench",
+                       "outputs": {}, "resources": []}, file)
+        write_lines([f"Destroy complete! Resources: {OUTPUT_LINES // 10} destroyed."])
+    elif command == "version":
+        write_lines(["Terraform v1.5.7"])
+    return 0
+
+
+def aws(args: List[str]) -> int:
+    if args[:2] == ["eks", "list-clusters"]:
+        write_lines([" ".join(CLUSTERS) if "text" in args else json.dumps(CLUSTERS)])
+    elif args[:2] == ["eks", "update-kubeconfig"]:
+        name = args[args.index("--name") + 1] if "--name" in args else "cluster"
+        write_lines([f"Updated context arn:aws:eks:us-east-1:000000000000:cluster/{name}"])
+    elif args[:2] == ["eks", "describe-cluster"]:
+        name = args[args.index("--name") + 1] if "--name" in args else "cluster"
+        if any(arg.startswith("cluster.{") for arg in args):
+            # The query of eks_auth.write_kubeconfig
+            write_lines([json.dumps({"arn": f"arn:aws:eks:us-east-1:000000000000:cluster/{name}",
+                                     "endpoint": "https://127.0.0.1:6443", "ca": "cWEtYmVuY2g="})])
+        else:
+            write_lines(["1.30"])
+    elif args[:2] == ["sts", "get-caller-identity"]:
+        write_lines(["000000000000"])
+    else:
+        write_lines([f"aws {' '.join(args)}"])
+    return 0
+
+
+def kubectl(args: List[str]) -> int:
+    if args and args[0] == "get":
+        resource_type = args[1] if len(args) > 1 else "pods"
+        items = [{"kind": resource_type, "metadata": {"name": f"{resource_type}-{i}", "namespace": f"ns-{i % 20}"},
+                  "status": {"phase": "Running"}} for i in range(KUBE_ITEMS)]
+        write_lines([json.dumps({"apiVersion": "v1", "kind": "List", "items": items})])
+    return 0
+
+
+if __name__ == "__main__":
+    tools = {"terraform": terraform, "aws": aws, "kubectl": kubectl}
+    if len(sys.argv) < 2 or sys.argv[1] not in tools:
+        sys.stderr.write(f"Usage: {sys.argv[0]} <{'|'.join(tools)}> [arguments...]\n")
+        sys.exit(2)
+    sys.exit(tools[sys.argv[1]](sys.argv[2:]))
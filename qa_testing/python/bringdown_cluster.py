@@ -1,25 +1,59 @@
 import argparse
 import os
+import sys
+from qa_libraries.instrumentation import run_report
+from qa_libraries.cluster_orchestrator import log_cluster_results, run_clusters
 from qa_libraries.tf_cluster_commands import bringdown_cluster, get_repo_root, read_config_value
-from qa_libraries.logger import log
+from qa_libraries.logger import log, log_context
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Bring down an EKS cluster")
-    parser.add_argument("-t", "--target", help="Target cluster name")
+    parser.add_argument("-t", "--target", action="append",
+                        help="Target cluster name (repeat to run several clusters concurrently)")
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+                        help="Maximum number of clusters processed at the same time (default: 4)")
+    parser.add_argument("--upgrade", action="store_true",
+                        help="Run 'terraform init -upgrade' to update the providers and modules")
+    parser.add_argument("--snapshot",
+                        help="State snapshot id (or unique prefix) to start from, defaults to the newest one "
+                             "(single target only, see tfstate_snapshots.py)")
+    parser.add_argument("--shared-dir", action="store_true",
+                        help="Switch the shared target-cluster directory to the cluster in place instead of "
+                             "using a per-cluster workspace (single target only)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the previous bringdown of the cluster from its first stage that did not "
+                             "complete, if it failed and the configuration is unchanged")
 
     args = parser.parse_args()
+    if args.target and len(args.target) > 1 and (args.shared_dir or args.snapshot):
+        parser.error("--shared-dir and --snapshot require a single target cluster")
 
-    if args.target:
-        target_cluster_name = args.target
-    else:
-        try:
-            repo_root = get_repo_root()
-            config_path = os.path.join(repo_root, "qa_testing", "python", "configs", "setup.cfg")
-            target_cluster_name = read_config_value(config_path, "Target_Cluster_Name")
-            log.info(f"No target cluster specified, defaulting to the setup.cfg value: {target_cluster_name}")
-        except KeyError as e:
-            log.error(f"Error: {e}. No target cluster specified and no default found in setup.cfg.")
-            parser.print_help()
-            raise ValueError("A target cluster name must be specified or present in setup.cfg.")
+    with run_report("bringdown_cluster"):
+        if args.target and len(args.target) > 1:
+            results = run_clusters("bringdown", args.target, args.jobs, upgrade=args.upgrade,
+                                   resume=args.resume)
+            log_cluster_results(results)
+            sys.exit(0 if all(result.succeeded for result in results) else 1)
 
-    bringdown_cluster(target_cluster_name)
+        if args.target:
+            target_cluster_name = args.target[0]
+        else:
+            try:
+                repo_root = get_repo_root()
+                config_path = os.path.join(repo_root, "qa_testing", "python", "configs", "setup.cfg")
+                target_cluster_name = read_config_value(config_path, "Target_Cluster_Name")
+                log.info(f"No target cluster specified, defaulting to the setup.cfg value: {target_cluster_name}")
+            except KeyError as e:
+                log.error(f"Error: {e}. No target cluster specified and no default found in setup.cfg.")
+                parser.print_help()
+                raise ValueError("A target cluster name must be specified or present in setup.cfg.")
+
+        if args.shared_dir:
+            with log_context(cluster=target_cluster_name, action="bringdown"):
+                succeeded = bringdown_cluster(target_cluster_name, upgrade=args.upgrade, snapshot_id=args.snapshot,
+                                              resume=args.resume)
+        else:
+            succeeded = run_clusters("bringdown", [target_cluster_name], 1, upgrade=args.upgrade,
+                                     snapshot_id=args.snapshot, resume=args.resume)[0].succeeded
+        if not succeeded:
+            sys.exit(1)
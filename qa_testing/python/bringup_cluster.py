@@ -1,25 +1,77 @@
 import argparse
 import os
+import sys
+from qa_libraries.instrumentation import run_report
+from qa_libraries.cluster_orchestrator import log_cluster_results, run_clusters
+from qa_libraries.smoketest_runner import list_smoketests
 from qa_libraries.tf_cluster_commands import bringup_cluster, get_repo_root, read_config_value
-from qa_libraries.logger import log
+from qa_libraries.tf_plan import ApplyOptions
+from qa_libraries.logger import log, log_context
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Bring up an EKS cluster")
-    parser.add_argument("-t", "--target", help="Target cluster name")
+    parser.add_argument("-t", "--target", action="append",
+                        help="Target cluster name (repeat to run several clusters concurrently)")
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+                        help="Maximum number of clusters processed at the same time (default: 4)")
+    parser.add_argument("--upgrade", action="store_true",
+                        help="Run 'terraform init -upgrade' to update the providers and modules")
+    parser.add_argument("--snapshot",
+                        help="State snapshot id (or unique prefix) to start from, defaults to the newest one "
+                             "(single target only, see tfstate_snapshots.py)")
+    parser.add_argument("--shared-dir", action="store_true",
+                        help="Switch the shared target-cluster directory to the cluster in place instead of "
+                             "using a per-cluster workspace (single target only)")
+
+    parser.add_argument("--plan", action="store_true",
+                        help="Plan first (without refreshing) and only apply the modules/resources with pending "
+                             "changes; nothing is applied when the plan has no changes")
+    parser.add_argument("--no-refresh", action="store_true",
+                        help="Pass -refresh=false to terraform apply (skip refreshing the existing resources)")
+    parser.add_argument("--parallelism", type=int,
+                        help="Pass -parallelism=N to terraform plan/apply (Terraform's default: 10)")
+    parser.add_argument("--force-apply", action="store_true",
+                        help="Run terraform init/apply even when nothing changed since the last successful apply")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the previous bringup of the cluster from its first stage that did not "
+                             "complete, if it failed and the configuration is unchanged")
+    parser.add_argument("--smoketests", action="store_true",
+                        help="Run all the smoketests once the cluster is up, as the last stage of the bringup")
 
     args = parser.parse_args()
+    apply_options = ApplyOptions(plan_first=args.plan, refresh=not args.no_refresh, parallelism=args.parallelism,
+                                 drift_check=not args.force_apply)
+    if args.target and len(args.target) > 1 and (args.shared_dir or args.snapshot):
+        parser.error("--shared-dir and --snapshot require a single target cluster")
+    smoketests = list_smoketests() if args.smoketests else None
+
+    with run_report("bringup_cluster"):
+        if args.target and len(args.target) > 1:
+            results = run_clusters("bringup", args.target, args.jobs, upgrade=args.upgrade,
+                                   apply_options=apply_options, resume=args.resume, smoketests=smoketests)
+            log_cluster_results(results)
+            sys.exit(0 if all(result.succeeded for result in results) else 1)
 
-    if args.target:
-        target_cluster_name = args.target
-    else:
-        try:
-            repo_root = get_repo_root()
-            config_path = os.path.join(repo_root, "qa_testing", "python", "configs", "setup.cfg")
-            target_cluster_name = read_config_value(config_path, "Target_Cluster_Name")
-            log.info(f"No target cluster specified, defaulting to the setup.cfg value: {target_cluster_name}")
-        except KeyError as e:
-            log.error(f"Error: {e}. No target cluster specified and no default found in setup.cfg.")
-            parser.print_help()
-            raise ValueError("A target cluster name must be specified or present in setup.cfg.")
+        if args.target:
+            target_cluster_name = args.target[0]
+        else:
+            try:
+                repo_root = get_repo_root()
+                config_path = os.path.join(repo_root, "qa_testing", "python", "configs", "setup.cfg")
+                target_cluster_name = read_config_value(config_path, "Target_Cluster_Name")
+                log.info(f"No target cluster specified, defaulting to the setup.cfg value: {target_cluster_name}")
+            except KeyError as e:
+                log.error(f"Error: {e}. No target cluster specified and no default found in setup.cfg.")
+                parser.print_help()
+                raise ValueError("A target cluster name must be specified or present in setup.cfg.")
 
-    bringup_cluster(target_cluster_name)
\ No newline at end of file
+        if args.shared_dir:
+            with log_context(cluster=target_cluster_name, action="bringup"):
+                succeeded = bringup_cluster(target_cluster_name, upgrade=args.upgrade, snapshot_id=args.snapshot,
+                                            apply_options=apply_options, resume=args.resume, smoketests=smoketests)
+        else:
+            succeeded = run_clusters("bringup", [target_cluster_name], 1, upgrade=args.upgrade,
+                                     snapshot_id=args.snapshot, apply_options=apply_options, resume=args.resume,
+                                     smoketests=smoketests)[0].succeeded
+        if not succeeded:
+            sys.exit(1)
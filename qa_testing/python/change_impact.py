@@ -0,0 +1,43 @@
+import argparse
+import json
+import sys
+from qa_libraries.change_impact import DEFAULT_BASE_REF, MAPPED_KINDS, ImpactMap, analyze_changes
+from qa_libraries.smoketest_runner import list_smoketests
+from qa_libraries.logger import log
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show which smoketests the changes since a base ref impact")
+    parser.add_argument("-b", "--base", default=DEFAULT_BASE_REF,
+                        help=f"The ref to compare the working tree with (default: {DEFAULT_BASE_REF})")
+    parser.add_argument("-m", "--impact-map", help="The impact map (default: qa_testing/configs/smoketest_impact.cfg)")
+    parser.add_argument("--json", action="store_true", help="Print the impact report as JSON")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Also show the variables, locals, data sources and outputs the changes impact")
+
+    args = parser.parse_args()
+
+    try:
+        impact_map = ImpactMap(args.impact_map) if args.impact_map else ImpactMap()
+        report = analyze_changes(args.base, impact_map)
+    except (FileNotFoundError, ValueError) as e:
+        log.error(f"Unable to analyze the impact of the changes: {e}")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(report.to_dict(), indent=2))
+        sys.exit(0)
+
+    log.info(f"{len(report.changed_files)} files changed since {args.base} ({report.base[:12]}).")
+    for symbol in report.impacted:
+        if args.verbose or symbol.kind in MAPPED_KINDS:
+            log.info(f"Impacted: {report.explain(symbol)}")
+    for reason in report.ignored:
+        log.info(f"Ignored: {reason}")
+    for name, reasons in sorted(report.smoketests.items()):
+        log.info(f"{name}: {'; '.join(reasons)}")
+    for reason in report.run_all:
+        log.warning(f"All smoketests: {reason}")
+
+    selected = report.selected(list_smoketests())
+    log.info(f"Smoketests to run: {'all' if report.run_all else ', '.join(selected) or 'none'}")
@@ -0,0 +1,29 @@
+import argparse
+import sys
+from qa_libraries.eks_auth import kubeconfig_path, remove_cluster_credentials, write_kubeconfig
+from qa_libraries.tf_cluster_commands import AWS_REGION
+from qa_libraries.logger import log
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a cluster's own kubeconfig and print its path, "
+                                                 "e.g. export KUBECONFIG=$(python eks_kubeconfig.py -t <cluster>)")
+    parser.add_argument("-t", "--target", required=True, help="Target cluster name")
+    parser.add_argument("--region", default=AWS_REGION, help=f"The AWS region of the cluster (default: {AWS_REGION})")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Rewrite the kubeconfig from a live 'aws eks describe-cluster' even if it exists")
+    parser.add_argument("--remove", action="store_true",
+                        help="Remove the cluster's kubeconfig and cached tokens instead")
+
+    args = parser.parse_args()
+
+    if args.remove:
+        remove_cluster_credentials(args.target)
+        log.info(f"Removed the kubeconfig and cached tokens of cluster '{args.target}'.")
+        sys.exit(0)
+
+    try:
+        write_kubeconfig(args.target, args.region, refresh=args.refresh)
+    except RuntimeError:
+        sys.exit(1)
+    print(kubeconfig_path(args.target))
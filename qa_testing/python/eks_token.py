@@ -0,0 +1,19 @@
+import argparse
+import json
+import sys
+from qa_libraries.eks_auth import exec_credential, get_token
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the cached EKS token of a cluster as a kubectl ExecCredential")
+    parser.add_argument("--cluster-name", required=True, help="The EKS cluster name")
+    parser.add_argument("--region", required=True, help="The AWS region of the cluster")
+    parser.add_argument("--refresh", action="store_true", help="Sign a new token even if the cached one is valid")
+
+    args = parser.parse_args()
+
+    try:
+        token, expiration = get_token(args.cluster_name, args.region, refresh=args.refresh)
+    except RuntimeError:
+        sys.exit(1)
+    print(json.dumps(exec_credential(token, expiration)))
@@ -0,0 +1,66 @@
+import argparse
+import json
+import sys
+from qa_libraries.fleet_inventory import STATUSES, build_inventory
+from qa_libraries.tf_cluster_commands import get_target_cluster_dir
+from qa_libraries.logger import log
+
+
+def format_size(size: int) -> str:
+    """
+    :param size: A size in bytes.
+    :return: The size in a human-readable unit.
+    """
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List which clusters are running and which have saved Terraform state")
+    parser.add_argument("-s", "--status", action="append", choices=STATUSES,
+                        help="Only show clusters with this status (repeatable)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="List the clusters live instead of reusing a recent listing")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Re-read every state file instead of only the changed ones")
+    parser.add_argument("--json", action="store_true", help="Print the inventory as JSON")
+
+    args = parser.parse_args()
+
+    try:
+        inventory = build_inventory(get_target_cluster_dir(), refresh=args.refresh, rebuild=args.rebuild)
+    except ValueError as e:
+        log.error(f"Unable to build the fleet inventory: {e}")
+        sys.exit(1)
+
+    if args.status:
+        inventory = [cluster for cluster in inventory if cluster.status in args.status]
+
+    if args.json:
+        print(json.dumps([cluster.to_dict() for cluster in inventory], indent=2))
+        sys.exit(0)
+
+    if not inventory:
+        log.info("No clusters found.")
+        sys.exit(0)
+
+    width = max(len("Cluster"), *(len(cluster.cluster_name) for cluster in inventory))
+    log.info(f"{'Cluster':<{width}}  {'Status':<11}  {'Serial':>6}  {'Resources':>9}  {'Size':>8}  "
+             f"{'Modified (UTC)':<16}  Sources")
+    for cluster in inventory:
+        newest = cluster.newest_state
+        sources = ", ".join(f"{state.source}({state.snapshot_count})" if state.snapshot_count is not None
+                            else state.source for state in cluster.states) or "-"
+        if newest:
+            log.info(f"{cluster.cluster_name:<{width}}  {cluster.status:<11}  {newest.serial or 0:>6}  "
+                     f"{newest.resource_count:>9}  {format_size(newest.size):>8}  "
+                     f"{newest.modified.strftime('%Y-%m-%d %H:%M'):<16}  {sources}")
+        else:
+            log.info(f"{cluster.cluster_name:<{width}}  {cluster.status:<11}  {'-':>6}  {'-':>9}  {'-':>8}  "
+                     f"{'-':<16}  {sources}")
+
+    counts = {status: sum(cluster.status == status for cluster in inventory) for status in STATUSES}
+    log.info(", ".join(f"{count} {status}" for status, count in counts.items()))
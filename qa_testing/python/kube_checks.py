@@ -0,0 +1,44 @@
+import argparse
+import sys
+from qa_libraries.instrumentation import run_report
+from qa_libraries.kube_api import KUBE_API_PAGE_SIZE, KubeApiError, close_clients, get_client
+from qa_libraries.kube_checks import check_cluster_health, check_coredns, check_pods_running
+from qa_libraries.logger import log
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the current cluster over the Kubernetes API, without kubectl")
+    parser.add_argument("--kubeconfig", help="Kubeconfig file(s) (default: those kubectl would use)")
+    parser.add_argument("--context", help="Kubeconfig context (default: the current context)")
+    subparsers = parser.add_subparsers(dest="check", required=True)
+
+    health_parser = subparsers.add_parser("health", help="The checks of check_cluster_health.sh, streamed page by page")
+    health_parser.add_argument("--page-size", type=int, default=KUBE_API_PAGE_SIZE,
+                               help=f"Objects per list page (default: {KUBE_API_PAGE_SIZE})")
+
+    subparsers.add_parser("coredns", help="The checks of check_coredns.sh")
+
+    pods_parser = subparsers.add_parser("pods", help="Pods exist and are all Running")
+    pods_parser.add_argument("-n", "--namespace", required=True, help="Namespace of the pods")
+    pods_parser.add_argument("-p", "--pattern", help="Regular expression the pod names match (default: all)")
+    pods_parser.add_argument("-l", "--selector", help="Label selector of the pods, e.g. 'app=web'")
+
+    args = parser.parse_args()
+
+    with run_report("kube_checks"):
+        try:
+            client = get_client(args.kubeconfig, args.context)
+            if args.check == "health":
+                report = check_cluster_health(client, page_size=args.page_size)
+            elif args.check == "coredns":
+                report = check_coredns(client)
+            else:
+                report = check_pods_running(client, args.namespace, args.pattern, args.selector)
+        except KubeApiError as e:
+            log.error(f"The '{args.check}' check could not run: {e}")
+            sys.exit(2)
+        finally:
+            close_clients()
+
+        print("\n".join(report.lines))
+        log.info(f"{client.pool.requests_sent} API request(s) over {client.pool.connections_opened} connection(s).")
+        sys.exit(0 if report.passed else 1)
@@ -0,0 +1,253 @@
+###########################################################
+#
+# asyncio-based command engine for the cluster lifecycle.
+#
+# Commands are described as Steps and run as coroutines:
+#   - executables are resolved on PATH and run without a
+#     shell (so local stub 'terraform'/'aws' executables on
+#     PATH can stand in for the real tools),
+#   - each step has its own timeout, after which the process
+#     is killed,
+#   - steps only wait for the steps listed in 'after', so
+#     independent steps run concurrently,
+#   - a step failing with a transient AWS error (throttling,
+#     'Rate exceeded', ...) in its stderr is retried with
+#     exponential backoff, up to its number of retries,
+#   - a failing step (or Ctrl-C) cancels the remaining steps
+#     and kills their processes.
+#
+
+import asyncio
+from dataclasses import dataclass, field
+import logging
+import os
+import re
+import shlex
+from typing import Callable, Dict, List, Optional, Sequence
+
+from qa_libraries.command_runner import (
+    COMMAND_LOG_FILE,
+    DEFAULT_TAIL_LINES,
+    CommandResult,
+    OutputSink,
+    get_command_log,
+)
+from qa_libraries.instrumentation import record_command_result, span
+from qa_libraries.logger import log
+from qa_libraries.waiting import Backoff
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Return codes used for steps that never produced one of their own
+RETURNCODE_NOT_FOUND = 127
+RETURNCODE_TIMED_OUT = 124
+
+# Retries of a step failing with a transient error, and the backoff between them
+DEFAULT_RETRIES = int(os.getenv('QA_STEP_RETRIES', '3'))
+RETRY_BACKOFF = Backoff(initial=float(os.getenv('QA_STEP_RETRY_DELAY', '10')), factor=2.0, maximum=120.0)
+
+# Errors in stderr that are worth retrying: AWS API throttling and transient network failures
+TRANSIENT_ERROR_PATTERN = re.compile(
+    r'Throttling|ThrottlingException|Rate exceeded|TooManyRequestsException|RequestLimitExceeded|SlowDown|'
+    r'PriorRequestNotComplete|ServiceUnavailable|connection reset by peer|TLS handshake timeout|i/o timeout')
+
+
+@dataclass
+class Step:
+    name: str
+    command: str
+    timeout: Optional[float] = None
+    after: Sequence[str] = ()
+    cwd: Optional[str] = None
+    env: Dict[str, str] = field(default_factory=dict)
+    label: Optional[str] = None
+    # Called (in the event loop thread) once the step has succeeded
+    on_success: Optional[Callable[[], None]] = None
+    # Retries when the step fails with a transient error (see TRANSIENT_ERROR_PATTERN)
+    retries: int = DEFAULT_RETRIES
+
+
+class StepFailedError(Exception):
+    def __init__(self, step: Step, result: CommandResult):
+        self.step = step
+        self.result = result
+        status = "timed out" if result.timed_out else f"failed with return code {result.returncode}"
+        super().__init__(f"Step '{step.name}' ({step.command}) {status}")
+
+
+async def _pump(stream: asyncio.StreamReader, sink: OutputSink) -> None:
+    while True:
+        data = await stream.read(READ_CHUNK_SIZE)
+        if not data:
+            break
+        sink.feed(data)
+    sink.close()
+
+
+async def _kill(process: asyncio.subprocess.Process) -> None:
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+
+
+async def run_step(step: Step, tail_lines: int = DEFAULT_TAIL_LINES) -> CommandResult:
+    """
+    Run a single step, draining its stdout and stderr concurrently. The step is recorded as a timing span.
+    :param step: The step to run.
+    :param tail_lines: Number of output lines per stream kept in memory for the result.
+    :return: The command result. A step that exceeds its timeout is killed and marked as timed out.
+    """
+    with span(step.name, "command", step.label, command=step.command) as step_span:
+        step_result = await _run_step(step, tail_lines)
+        record_command_result(step_span, step_result)
+        return step_result
+
+
+async def _run_step(step: Step, tail_lines: int) -> CommandResult:
+    label = step.label
+    stdout_sink = OutputSink("stdout", tail_lines, label, logging.INFO)
+    stderr_sink = OutputSink("stderr", tail_lines, label, logging.ERROR)  # Using ERROR to log stderr messages
+
+    def result(returncode: int, timed_out: bool = False) -> CommandResult:
+        get_command_log().info(f"{label or '-'}\texit\t{returncode} ({step.command})")
+        return CommandResult(
+            command=step.command,
+            returncode=returncode,
+            stdout_tail=stdout_sink.text(),
+            stderr_tail=stderr_sink.text(),
+            stdout_bytes=stdout_sink.bytes,
+            stderr_bytes=stderr_sink.bytes,
+            log_file=COMMAND_LOG_FILE,
+            timed_out=timed_out,
+        )
+
+    get_command_log().info(f"{label or '-'}\tcommand\t{step.command} (cwd: {step.cwd or os.getcwd()})")
+    env = {**os.environ, **step.env} if step.env else None
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *shlex.split(step.command), cwd=step.cwd, env=env, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    except (FileNotFoundError, PermissionError) as e:
+        stderr_sink.feed(f"{e}\n".encode())
+        return result(RETURNCODE_NOT_FOUND)
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(_pump(process.stdout, stdout_sink), _pump(process.stderr, stderr_sink), process.wait()),
+            timeout=step.timeout)
+    except asyncio.TimeoutError:
+        await _kill(process)
+        log.error(f"{stderr_sink.prefix}Step '{step.name}' timed out after {step.timeout}s: {step.command}")
+        return result(RETURNCODE_TIMED_OUT, timed_out=True)
+    except asyncio.CancelledError:
+        await _kill(process)
+        log.warning(f"{stderr_sink.prefix}Step '{step.name}' cancelled: {step.command}")
+        raise
+
+    return result(process.returncode)
+
+
+async def run_steps(steps: List[Step], tail_lines: int = DEFAULT_TAIL_LINES) -> Dict[str, CommandResult]:
+    """
+    Run a set of steps, each one as soon as the steps it comes 'after' have succeeded.
+    :param steps: The steps to run.
+    :param tail_lines: Number of output lines per stream kept in memory for each result.
+    :return: The results of all the steps, keyed by step name.
+    :raises StepFailedError: If a step fails or times out; the steps still running are cancelled.
+    """
+    names = [step.name for step in steps]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Step names must be unique: {names}")
+    for step in steps:
+        unknown = set(step.after) - set(names)
+        if unknown:
+            raise ValueError(f"Step '{step.name}' runs after unknown steps: {', '.join(sorted(unknown))}")
+
+    results: Dict[str, CommandResult] = {}
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run_after_dependencies(step: Step) -> None:
+        # The dependencies are awaited (not gathered) so a failure surfaces from the failing step only
+        for dependency in step.after:
+            await asyncio.shield(tasks[dependency])
+        step_result = await run_step_with_retries(step, tail_lines)
+        results[step.name] = step_result
+        if step_result.returncode != 0:
+            raise StepFailedError(step, step_result)
+        if step.on_success:
+            step.on_success()
+
+    # Create the tasks in dependency order so every dependency task exists before it is awaited
+    pending = list(steps)
+    while pending:
+        ready = [step for step in pending if all(dependency in tasks for dependency in step.after)]
+        if not ready:
+            raise ValueError(f"Steps have circular dependencies: {', '.join(step.name for step in pending)}")
+        for step in ready:
+            tasks[step.name] = asyncio.ensure_future(run_after_dependencies(step))
+            pending.remove(step)
+
+    try:
+        done, _ = await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception():
+                raise task.exception()
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    return results
+
+
+def run_steps_sync(steps: List[Step], tail_lines: int = DEFAULT_TAIL_LINES) -> Dict[str, CommandResult]:
+    """
+    Run a set of steps from synchronous code (see run_steps).
+    :param steps: The steps to run.
+    :param tail_lines: Number of output lines per stream kept in memory for each result.
+    :return: The results of all the steps, keyed by step name.
+    :raises StepFailedError: If a step fails or times out.
+    """
+    return asyncio.run(run_steps(steps, tail_lines))
+
+
+def is_transient_failure(result: CommandResult) -> bool:
+    """
+    :param result: The result of a failed step.
+    :return: True if the step failed with a transient error worth retrying (a timeout never is).
+    """
+    return not result.timed_out and bool(TRANSIENT_ERROR_PATTERN.search(result.stderr_tail))
+
+
+async def run_step_with_retries(step: Step, tail_lines: int = DEFAULT_TAIL_LINES) -> CommandResult:
+    """
+    Run a single step, retrying it with backoff while it fails with a transient error.
+    :param step: The step to run.
+    :param tail_lines: Number of output lines per stream kept in memory for the result.
+    :return: The result of the last attempt.
+    """
+    delays = RETRY_BACKOFF.delays()
+    attempt = 0
+    while True:
+        step_result = await run_step(step, tail_lines)
+        if step_result.returncode == 0 or attempt >= step.retries or not is_transient_failure(step_result):
+            return step_result
+        attempt += 1
+        delay = next(delays)
+        prefix = f"[{step.label}] " if step.label else ""
+        log.warning(f"{prefix}Step '{step.name}' failed with a transient error; retrying in {delay:.0f}s "
+                    f"(retry {attempt}/{step.retries}).")
+        await asyncio.sleep(delay)
+
+
+def run_step_sync(step: Step, tail_lines: int = DEFAULT_TAIL_LINES) -> CommandResult:
+    """
+    Run a single step from synchronous code, returning its result whether it succeeded or not.
+    :param step: The step to run.
+    :param tail_lines: Number of output lines per stream kept in memory for the result.
+    :return: The command result.
+    """
+    return asyncio.run(run_step(step, tail_lines))
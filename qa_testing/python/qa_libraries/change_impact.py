@@ -0,0 +1,575 @@
+###########################################################
+#
+# Change-impact selection of the smoketests.
+#
+# Maps the files changed since a base ref (the committed,
+# staged and unstaged changes, and untracked files) to the
+# Terraform resources they impact, and those to the
+# smoketests that cover them, so a change is validated with
+# only the affected smoketests instead of all of them:
+#
+#   1. A changed file matching a [paths] pattern of the impact
+#      map (qa_testing/configs/smoketest_impact.cfg) maps
+#      directly to its smoketests (e.g. docs to none).
+#   2. The changed lines of a *.tf file of the root module or
+#      of a local module ('source = "./addons"') impact the
+#      blocks they fall in: a resource, a data source, a
+#      variable, an output, a single local value or a single
+#      input of a module call.
+#   3. Another changed file (a chart, a values template, a
+#      script) impacts the blocks that reference its path,
+#      e.g. addons/charts/gp3 -> helm_release.gp3_storage_class.
+#   4. The impact is followed through the references of the
+#      configuration (var.*, local.*, data.*, resources,
+#      module inputs and outputs), but not through
+#      depends_on, which only orders the blocks.
+#   5. Each impacted resource or module maps to the smoketests
+#      of the first matching [addresses] pattern.
+#
+# Anything that cannot be mapped (a file or an impacted
+# resource no pattern matches) selects all the smoketests.
+#
+
+import configparser
+from dataclasses import dataclass, field
+import fnmatch
+import os
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, Union
+
+from qa_libraries.lazy_imports import lazy_import
+from qa_libraries.logger import log
+from qa_libraries.qa_paths import QA_DIR
+from qa_libraries.smoketest_runner import list_smoketests
+
+git = lazy_import("git")
+
+IMPACT_MAP = os.getenv('QA_SMOKETEST_IMPACT_MAP', os.path.join(QA_DIR, "configs", "smoketest_impact.cfg"))
+DEFAULT_BASE_REF = os.getenv('QA_IMPACT_BASE_REF', "origin/main")
+
+ALL = "all"
+NONE = "none"
+
+# Top-level block types whose address is matched against the [addresses] patterns; the others
+# (variables, locals, data sources, outputs) only carry the impact to the blocks referencing them
+MAPPED_KINDS = ("resource", "module", "provider", "terraform")
+
+_BLOCK_PATTERN = re.compile(r'^([A-Za-z_][\w-]*)((?:\s+(?:"[^"]*"|[A-Za-z_][\w-]*))*)\s*\{')
+_LABEL_PATTERN = re.compile(r'"([^"]*)"|([A-Za-z_][\w-]*)')
+_ATTRIBUTE_PATTERN = re.compile(r'^\s*([A-Za-z_][\w-]*)\s*(?:=(?!=)|(?:"[^"]*"\s*)*\{)')
+_HEREDOC_PATTERN = re.compile(r'<<-?\s*"?([A-Za-z_]\w*)"?\s*$')
+_HUNK_PATTERN = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+_SOURCE_PATTERN = re.compile(r'=\s*"(\.{1,2}/[^"]*)"')
+_BLANK_BRACKETS = str.maketrans("{}[]()", "      ")
+
+
+@dataclass
+class _Attribute:
+    name: str
+    start: int
+    end: int
+    text: str
+
+
+@dataclass
+class _Block:
+    kind: str
+    labels: List[str]
+    start: int
+    end: int
+    attributes: List[_Attribute] = field(default_factory=list)
+
+    @property
+    def address(self) -> str:
+        if self.kind == "resource":
+            return ".".join(self.labels[:2])
+        if self.kind == "data":
+            return "data." + ".".join(self.labels[:2])
+        if self.kind == "variable":
+            return f"var.{self.labels[0]}"
+        if self.kind in ("module", "output", "provider"):
+            return f"{self.kind}.{self.labels[0]}"
+        return self.kind
+
+    def attribute(self, name: str) -> Optional[_Attribute]:
+        return next((attribute for attribute in self.attributes if attribute.name == name), None)
+
+
+def _code_lines(content: str) -> List[str]:
+    """
+    :return: The lines of an HCL file with the comments removed and the brackets of string literals
+             and heredocs blanked out, so only the structural brackets remain.
+    """
+    lines, heredoc, in_comment = [], None, False
+    for line in content.splitlines():
+        if heredoc:
+            lines.append(line.translate(_BLANK_BRACKETS) if line.strip() != heredoc else "")
+            if line.strip() == heredoc:
+                heredoc = None
+            continue
+        code, in_string, i = [], False, 0
+        while i < len(line):
+            char, pair = line[i], line[i:i + 2]
+            if in_comment:
+                if pair == "*/":
+                    in_comment = False
+                    i += 1
+            elif in_string:
+                # Quotes nested in template interpolations pair up, so they need no special case
+                if char == "\\":
+                    code.append(pair.translate(_BLANK_BRACKETS))
+                    i += 1
+                else:
+                    in_string = char != '"'
+                    code.append(char.translate(_BLANK_BRACKETS))
+            elif pair == "/*":
+                in_comment = True
+                i += 1
+            elif char == "#" or pair == "//":
+                break
+            else:
+                in_string = char == '"'
+                code.append(char)
+            i += 1
+        code_line = "".join(code)
+        match = _HEREDOC_PATTERN.search(code_line) if not in_string else None
+        if match:
+            heredoc = match.group(1)
+        lines.append(code_line)
+    return lines
+
+
+def parse_blocks(content: str) -> List[_Block]:
+    """
+    Parse the top-level blocks of a Terraform file and the attributes (and nested blocks) of each.
+    :param content: The content of the *.tf file.
+    :return: The blocks, with 1-based inclusive line ranges.
+    """
+    blocks, block, depth = [], None, 0
+    for number, line in enumerate(_code_lines(content), start=1):
+        if block is None:
+            match = _BLOCK_PATTERN.match(line.strip())
+            if match:
+                labels = [quoted or bare for quoted, bare in _LABEL_PATTERN.findall(match.group(2))]
+                block, depth = _Block(match.group(1), labels, number, number), 0
+        elif depth == 1:
+            match = _ATTRIBUTE_PATTERN.match(line)
+            if match:
+                block.attributes.append(_Attribute(match.group(1), number, number, ""))
+        if block is None:
+            continue
+
+        if block.attributes and number > block.start:
+            attribute = block.attributes[-1]
+            attribute.end, attribute.text = number, attribute.text + line + "\n"
+        depth += sum(line.count(bracket) for bracket in "{[(") - sum(line.count(bracket) for bracket in "}])")
+        if depth <= 0:
+            block.end = number
+            if block.attributes and block.attributes[-1].end == number and line.strip() == "}":
+                # The closing brace of the block is not part of its last attribute
+                block.attributes[-1].end = number - 1
+            blocks.append(block)
+            block = None
+    return blocks
+
+
+class Symbol(NamedTuple):
+    """
+    Something a change impacts: a block (or a single local value, module input or module output)
+    of a module of the configuration.
+    """
+    prefix: str  # The address of the module instance it belongs to, e.g. '' or 'module.eks_addons.'
+    name: str  # As referenced inside that module, e.g. 'local.gp3_values' or 'helm_release.argocd'
+    kind: str  # The kind of block that defines it
+
+    @property
+    def address(self) -> str:
+        return self.prefix + self.name
+
+
+@dataclass
+class _Module:
+    path: str  # Relative to the repository root, '' for the root module
+    prefixes: List[str]
+    files: Dict[str, List[_Block]] = field(default_factory=dict)
+
+    @property
+    def blocks(self) -> Iterable[_Block]:
+        for blocks in self.files.values():
+            yield from blocks
+
+    def variables(self) -> Set[str]:
+        return {block.labels[0] for block in self.blocks if block.kind == "variable" and block.labels}
+
+
+def _read(repo_root: str, path: str) -> Optional[str]:
+    try:
+        with open(os.path.join(repo_root, path), 'r', errors='replace') as file:
+            return file.read()
+    except (FileNotFoundError, IsADirectoryError):
+        return None
+
+
+def load_modules(repo_root: str) -> Dict[str, _Module]:
+    """
+    Parse the root module of the repository and the local modules it calls.
+    :param repo_root: The repository root, which holds the root module.
+    :return: The modules by path relative to the repository root.
+    """
+    modules: Dict[str, _Module] = {}
+    pending = [("", "")]
+    while pending:
+        path, prefix = pending.pop(0)
+        if path in modules:
+            modules[path].prefixes.append(prefix)
+            continue
+        module = modules[path] = _Module(path, [prefix])
+        directory = os.path.join(repo_root, path)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".tf"):
+                module.files[os.path.join(path, name)] = parse_blocks(_read(repo_root, os.path.join(path, name)))
+        for block in module.blocks:
+            source = block.attribute("source") if block.kind == "module" else None
+            match = _SOURCE_PATTERN.search(source.text) if source else None
+            if match:
+                child = os.path.normpath(os.path.join(path, match.group(1)))
+                if not child.startswith("..") and os.path.isdir(os.path.join(repo_root, child)):
+                    pending.append(("" if child == "." else child, f"{prefix}module.{block.labels[0]}."))
+    return modules
+
+
+@dataclass
+class _ChangedFile:
+    path: str
+    old_lines: Set[int] = field(default_factory=set)
+    new_lines: Set[int] = field(default_factory=set)
+    deleted: bool = False
+
+
+def get_changed_files(repo, base_commit: str) -> Dict[str, _ChangedFile]:
+    """
+    :param repo: The git repository.
+    :param base_commit: The commit to compare the working tree with.
+    :return: The changed files (relative to the repository root), with the changed line numbers
+             of the base and of the working-tree version of each.
+    """
+    changes: Dict[str, _ChangedFile] = {}
+    current, in_header = None, False
+    diff = repo.git.diff(base_commit, "--unified=0", "--no-renames", "--no-color", "--no-ext-diff")
+    for line in diff.splitlines():
+        if line.startswith("diff --git "):
+            current, in_header = None, True
+        elif in_header and line.startswith("--- a/"):
+            current = changes.setdefault(line[6:], _ChangedFile(line[6:]))
+        elif in_header and line.startswith("+++ "):
+            if line == "+++ /dev/null":
+                current.deleted = True
+            else:
+                current = changes.setdefault(line[6:], _ChangedFile(line[6:]))
+        elif in_header and line.startswith("Binary files ") and line.endswith(" differ"):
+            old, new = line[len("Binary files "):-len(" differ")].split(" and ")
+            path = (new if new != "/dev/null" else old)[2:]
+            changes.setdefault(path, _ChangedFile(path, deleted=new == "/dev/null"))
+        elif line.startswith("@@") and current is not None:
+            in_header = False
+            old_start, old_count, new_start, new_count = _HUNK_PATTERN.match(line).groups()
+            old_count = 1 if old_count is None else int(old_count)
+            new_count = 1 if new_count is None else int(new_count)
+            current.old_lines.update(range(int(old_start), int(old_start) + old_count))
+            # A pure deletion is reported after the line preceding it, so both neighbours are impacted
+            current.new_lines.update(range(int(new_start), int(new_start) + new_count) if new_count
+                                     else (int(new_start), int(new_start) + 1))
+    for path in repo.untracked_files:
+        changes.setdefault(path, _ChangedFile(path))
+    return changes
+
+
+class ImpactMap:
+    """
+    The declared mapping of changed paths and impacted Terraform addresses to the smoketests.
+    """
+
+    def __init__(self, path: str = IMPACT_MAP, smoketests: Optional[List[str]] = None):
+        self.path = path
+        self.smoketests = smoketests if smoketests is not None else list_smoketests()
+        config = configparser.ConfigParser(interpolation=None)
+        config.optionxform = str
+        if not config.read(path):
+            log.error(f"Unable to read the smoketest impact map: {path}")
+            raise FileNotFoundError(f"Unable to read the smoketest impact map: {path}")
+        self.groups = {name: value.split() for name, value in config.items("groups")} \
+            if config.has_section("groups") else {}
+        self.paths = list(config.items("paths")) if config.has_section("paths") else []
+        self.addresses = list(config.items("addresses")) if config.has_section("addresses") else []
+        for pattern, value in self.paths + self.addresses:
+            self._expand(value, pattern)
+
+    def _expand(self, value: str, pattern: str, name: str = "") -> List[str]:
+        selected = []
+        for item in value.split():
+            if item in (ALL, NONE):
+                selected.append(item)
+            elif item.startswith("@") and item[1:] in self.groups:
+                selected += self._expand(" ".join(self.groups[item[1:]]), pattern, name)
+            elif item == "{name}":
+                selected += [name] if name in self.smoketests else []
+            elif item in self.smoketests:
+                selected.append(item)
+            else:
+                log.error(f"Unknown smoketest '{item}' for '{pattern}' in the impact map {self.path}")
+                raise ValueError(f"Unknown smoketest '{item}' for '{pattern}' in the impact map {self.path}")
+        return selected
+
+    def _match(self, rules: List[Tuple[str, str]], value: str) -> Optional[Tuple[str, List[str]]]:
+        for pattern, smoketests in rules:
+            if fnmatch.fnmatchcase(value, pattern):
+                return pattern, self._expand(smoketests, pattern, os.path.basename(value))
+        return None
+
+    def match_path(self, path: str) -> Optional[Tuple[str, List[str]]]:
+        """
+        :param path: A changed file, relative to the repository root.
+        :return: The first matching [paths] pattern and its smoketests, or None.
+        """
+        return self._match(self.paths, path)
+
+    def match_address(self, address: str) -> Optional[Tuple[str, List[str]]]:
+        """
+        :param address: An impacted resource or module, e.g. 'aws_eks_addon.coredns'.
+        :return: The first matching [addresses] pattern and its smoketests, or None.
+        """
+        return self._match(self.addresses, address)
+
+
+@dataclass
+class ImpactReport:
+    """
+    The impact of the changes since a base commit.
+    """
+    base: str
+    changed_files: List[str]
+    # Why each symbol is impacted: a changed file, or the impacted symbol it references
+    impacted: Dict[Symbol, Union[str, Symbol]] = field(default_factory=dict)
+    # Why each smoketest is selected
+    smoketests: Dict[str, List[str]] = field(default_factory=dict)
+    # Why all the smoketests must run; empty if the subset is enough
+    run_all: List[str] = field(default_factory=list)
+    # What selects no smoketest (e.g. documentation)
+    ignored: List[str] = field(default_factory=list)
+
+    def explain(self, symbol: Symbol) -> str:
+        """
+        :return: The chain of references from a changed file to an impacted symbol.
+        """
+        chain, seen = [symbol.address], {symbol}
+        cause = self.impacted[symbol]
+        while isinstance(cause, Symbol) and cause not in seen:
+            chain.append(cause.address)
+            seen.add(cause)
+            cause = self.impacted[cause]
+        return " <- ".join(chain + [cause])
+
+    def to_dict(self) -> Dict:
+        return {
+            "base": self.base,
+            "changed_files": self.changed_files,
+            "impacted": {symbol.address: self.explain(symbol) for symbol in self.impacted},
+            "smoketests": self.smoketests,
+            "run_all": self.run_all,
+            "ignored": self.ignored,
+        }
+
+    def selected(self, available: List[str]) -> List[str]:
+        """
+        :param available: All the smoketests, in run order.
+        :return: The smoketests to run, in run order.
+        """
+        return list(available) if self.run_all else [name for name in available if name in self.smoketests]
+
+
+def _reference_pattern(name: str) -> re.Pattern:
+    return re.compile(r'(?<![\w.-])' + re.escape(name) + r'(?![\w-])')
+
+
+def _path_pattern(path: str) -> re.Pattern:
+    return re.compile(r'(?<![\w.-])' + re.escape(path) + r'(?![\w.-])')
+
+
+class _Analysis:
+    def __init__(self, repo_root: str, modules: Dict[str, _Module]):
+        self.repo_root = repo_root
+        self.modules = modules
+        self.by_prefix = {prefix: module for module in modules.values() for prefix in module.prefixes}
+        self.impacted: Dict[Symbol, Union[str, Symbol]] = {}
+        self.pending: List[Symbol] = []
+
+    def impact(self, symbol: Symbol, cause) -> None:
+        if symbol not in self.impacted:
+            self.impacted[symbol] = cause
+            self.pending.append(symbol)
+
+    def _child(self, prefix: str, block: _Block) -> Optional[_Module]:
+        return self.by_prefix.get(f"{prefix}module.{block.labels[0]}.")
+
+    def impact_block(self, prefix: str, block: _Block, attributes: List[_Attribute], cause) -> None:
+        """
+        Impact a block, or only the given local values or module inputs of a locals or module block.
+        """
+        if block.kind == "locals":
+            for attribute in attributes:
+                self.impact(Symbol(prefix, f"local.{attribute.name}", "locals"), cause)
+            return
+        child = self._child(prefix, block) if block.kind == "module" else None
+        if child is not None:
+            inputs = child.variables()
+            child_prefix = f"{prefix}module.{block.labels[0]}."
+            if all(attribute.name in inputs for attribute in attributes):
+                for attribute in attributes:
+                    self.impact(Symbol(child_prefix, f"var.{attribute.name}", "variable"), cause)
+                return
+        self.impact(Symbol(prefix, block.address, block.kind), cause)
+
+    def impact_lines(self, prefix: str, blocks: List[_Block], lines: Set[int], cause: str) -> None:
+        """
+        Impact the blocks (or their parts) that changed lines fall in.
+        """
+        for block in blocks:
+            touched = [line for line in lines if block.start <= line <= block.end]
+            if not touched:
+                continue
+            attributes = [attribute for attribute in block.attributes
+                          if any(attribute.start <= line <= attribute.end for line in touched)]
+            outside = any(not any(attribute.start <= line <= attribute.end for attribute in block.attributes)
+                          for line in touched)
+            if block.kind == "module" and outside:
+                # A change of the module call itself rather than of its inputs
+                self.impact(Symbol(prefix, block.address, block.kind), cause)
+            else:
+                self.impact_block(prefix, block, attributes, cause)
+
+    def impact_references(self, prefix: str, pattern: re.Pattern, cause) -> bool:
+        """
+        Impact the blocks of a module instance (or their parts) that reference something.
+        :return: True if anything references it.
+        """
+        found = False
+        for block in self.by_prefix[prefix].blocks:
+            attributes = [attribute for attribute in block.attributes
+                          if attribute.name != "depends_on" and pattern.search(attribute.text)]
+            if attributes:
+                found = True
+                self.impact_block(prefix, block, attributes, cause)
+        return found
+
+    def propagate(self) -> None:
+        while self.pending:
+            symbol = self.pending.pop(0)
+            if symbol.prefix not in self.by_prefix:
+                continue
+            self.impact_references(symbol.prefix, _reference_pattern(symbol.name), symbol)
+            if symbol.kind == "output" and symbol.prefix:
+                # An output of a child module is referenced by its parent as module.<name>.<output>
+                parent, _, call = symbol.prefix[:-1].rpartition("module.")
+                if parent in self.by_prefix:
+                    self.impact_references(parent, _reference_pattern(f"module.{call}.{symbol.name[7:]}"), symbol)
+
+
+def _file_module(modules: Dict[str, _Module], path: str) -> Optional[_Module]:
+    return modules.get(os.path.dirname(path)) if path.endswith(".tf") else None
+
+
+def _analyze_terraform_file(analysis: _Analysis, repo, base: str, module: _Module, change: _ChangedFile) -> None:
+    new_content = None if change.deleted else _read(analysis.repo_root, change.path)
+    try:
+        old_content = repo.git.show(f"{base}:{change.path}")
+    except git.GitCommandError:
+        old_content = None
+    # The blocks of both versions: a removed block is impacted as much as an added one
+    for prefix in module.prefixes:
+        if new_content is not None:
+            lines = change.new_lines if old_content is not None else set(range(1, new_content.count("\n") + 2))
+            analysis.impact_lines(prefix, parse_blocks(new_content), lines, change.path)
+        if old_content is not None:
+            lines = change.old_lines if new_content is not None else set(range(1, old_content.count("\n") + 2))
+            analysis.impact_lines(prefix, parse_blocks(old_content), lines,
+                                  change.path if new_content is not None else f"{change.path} (deleted)")
+
+
+def _analyze_referenced_file(analysis: _Analysis, path: str) -> bool:
+    """
+    Impact the blocks referencing a changed file or, if none does, its closest referenced parent directory.
+    :return: True if any block references it.
+    """
+    candidate = path
+    while candidate:
+        found = False
+        for module in analysis.modules.values():
+            if module.path and not candidate.startswith(module.path + "/"):
+                continue
+            relative = candidate[len(module.path) + 1:] if module.path else candidate
+            pattern = _path_pattern(relative)
+            for prefix in module.prefixes:
+                found = analysis.impact_references(prefix, pattern, path) or found
+        if found:
+            return True
+        candidate = os.path.dirname(candidate)
+        if candidate in analysis.modules:
+            # Not past the directory of a (child) module: its source would match everything in it
+            break
+    return False
+
+
+def analyze_changes(base_ref: str = DEFAULT_BASE_REF, impact_map: Optional[ImpactMap] = None,
+                    repo_root: Optional[str] = None) -> ImpactReport:
+    """
+    Select the smoketests impacted by the changes of the working tree since the merge base with a ref.
+    :param base_ref: The ref the changes are compared with, e.g. 'origin/main'.
+    :param impact_map: The impact map, defaults to qa_testing/configs/smoketest_impact.cfg.
+    :param repo_root: The repository, defaults to the one holding the QA Testing directory.
+    :return: The impact report.
+    """
+    impact_map = impact_map or ImpactMap()
+    repo = git.Repo(repo_root or QA_DIR, search_parent_directories=True)
+    repo_root = repo.working_tree_dir
+    try:
+        base = repo.merge_base(base_ref, "HEAD")[0].hexsha
+    except (git.GitCommandError, IndexError) as e:
+        log.error(f"Unable to find the merge base of '{base_ref}' and HEAD.")
+        raise ValueError(f"Unable to find the merge base of '{base_ref}' and HEAD.") from e
+
+    changes = get_changed_files(repo, base)
+    modules = load_modules(repo_root)
+    analysis = _Analysis(repo_root, modules)
+    report = ImpactReport(base, sorted(changes))
+
+    def select(smoketests: List[str], reason: str) -> None:
+        if smoketests == [NONE]:
+            report.ignored.append(reason)
+        if ALL in smoketests:
+            report.run_all.append(reason)
+        for name in smoketests:
+            if name not in (ALL, NONE):
+                report.smoketests.setdefault(name, []).append(reason)
+
+    for path in report.changed_files:
+        rule = impact_map.match_path(path)
+        module = _file_module(modules, path)
+        if rule:
+            pattern, smoketests = rule
+            select(smoketests, f"{path} (matches '{pattern}')")
+        elif module is not None:
+            _analyze_terraform_file(analysis, repo, base, module, changes[path])
+        elif not _analyze_referenced_file(analysis, path):
+            report.run_all.append(f"{path} (not in the impact map)")
+
+    analysis.propagate()
+    report.impacted = analysis.impacted
+    for symbol in analysis.impacted:
+        if symbol.kind not in MAPPED_KINDS:
+            continue
+        rule = impact_map.match_address(symbol.address)
+        if rule is None:
+            report.run_all.append(f"{report.explain(symbol)} (not in the impact map)")
+        else:
+            select(rule[1], f"{report.explain(symbol)} (matches '{rule[0]}')")
+    return report
@@ -0,0 +1,153 @@
+###########################################################
+#
+# Run bringup/bringdown against one or several clusters.
+#
+# Each target cluster runs in its own workspace (see
+# workspaces.py) with its own cluster name override and
+# state files, so runs never touch the shared main.tf or
+# each other's state and can proceed concurrently. The
+# state is restored from and saved to the shared state store.
+#
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextvars
+from dataclasses import dataclass
+import os
+import time
+from typing import Callable, List, Optional
+
+from qa_libraries.logger import log, log_context
+from qa_libraries.state_swap import state_lock
+from qa_libraries.tf_cluster_commands import bringdown_cluster, bringup_cluster, get_target_cluster_dir
+from qa_libraries.tf_plan import ApplyOptions
+from qa_libraries.workspaces import (
+    gc_workspaces,
+    get_workspace_dir,
+    materialize_workspace,
+    save_workspace_state,
+)
+
+ACTIONS = {
+    "bringup": bringup_cluster,
+    "bringdown": bringdown_cluster,
+}
+
+
+@dataclass
+class ClusterRunResult:
+    cluster: str
+    action: str
+    succeeded: bool
+    duration: float
+    error: str = ""
+
+
+def run_cluster_action(action: str, target_cluster_name: str, cluster_dir: str, upgrade: bool = False,
+                       snapshot_id: Optional[str] = None, apply_options: Optional[ApplyOptions] = None,
+                       resume: bool = False, smoketests: Optional[List[str]] = None) -> ClusterRunResult:
+    """
+    Run a bringup/bringdown for one cluster in its own workspace.
+    :param action: Either 'bringup' or 'bringdown'.
+    :param target_cluster_name: The name of the cluster to act on.
+    :param cluster_dir: The shared target-cluster directory.
+    :param upgrade: Run 'terraform init -upgrade' to update the providers and modules.
+    :param snapshot_id: The state snapshot to start from, defaults to the cluster's newest snapshot.
+    :param apply_options: Plan-first mode and apply tuning of a bringup (see tf_plan).
+    :param resume: Skip the stages completed by the cluster's previous run of the action if it failed
+                   (see run_journal).
+    :param smoketests: The smoketest scripts run as the last stage of a bringup.
+    :return: The result of the run.
+    """
+    action_func: Callable[..., bool] = ACTIONS[action]
+    start_time = time.monotonic()
+    try:
+        workspace_dir = get_workspace_dir(target_cluster_name, cluster_dir)
+        os.makedirs(workspace_dir, exist_ok=True)
+        with log_context(cluster=target_cluster_name, action=action), state_lock(workspace_dir):
+            materialize_workspace(target_cluster_name, cluster_dir, snapshot_id=snapshot_id)
+            try:
+                extra = {"apply_options": apply_options} if apply_options else {}
+                if smoketests:
+                    extra["smoketests"] = smoketests
+                succeeded = action_func(target_cluster_name, workdir=workspace_dir, upgrade=upgrade, resume=resume,
+                                        **extra)
+            finally:
+                save_workspace_state(target_cluster_name, cluster_dir)
+        error = "" if succeeded else "see log output for the failing command"
+    except Exception as e:
+        log.error(f"[{target_cluster_name}] An error occurred: {e}")
+        succeeded, error = False, str(e)
+
+    return ClusterRunResult(target_cluster_name, action, succeeded, time.monotonic() - start_time, error)
+
+
+def run_clusters(action: str, target_cluster_names: List[str], jobs: int, cluster_dir: Optional[str] = None,
+                 upgrade: bool = False, snapshot_id: Optional[str] = None,
+                 apply_options: Optional[ApplyOptions] = None, resume: bool = False,
+                 smoketests: Optional[List[str]] = None) -> List[ClusterRunResult]:
+    """
+    Run a bringup/bringdown for several clusters concurrently with a bounded worker pool.
+    :param action: Either 'bringup' or 'bringdown'.
+    :param target_cluster_names: The names of the clusters to act on.
+    :param jobs: The maximum number of clusters processed at the same time.
+    :param cluster_dir: The shared target-cluster directory, defaults to the one configured in setup.cfg.
+    :param upgrade: Run 'terraform init -upgrade' to update the providers and modules.
+    :param snapshot_id: The state snapshot to start from (single cluster only), defaults to the newest one.
+    :param apply_options: Plan-first mode and apply tuning of a bringup (see tf_plan).
+    :param resume: Skip the stages completed by each cluster's previous run of the action if it failed.
+    :param smoketests: The smoketest scripts run as the last stage of a bringup.
+    :return: The per-cluster results, in the order the clusters were requested.
+    """
+    if action not in ACTIONS:
+        log.error(f"Unknown action '{action}'.")
+        raise ValueError(f"Unknown action '{action}', expected one of: {', '.join(ACTIONS)}")
+
+    # Preserve the requested order while dropping duplicate cluster names
+    target_cluster_names = list(dict.fromkeys(target_cluster_names))
+    if snapshot_id and len(target_cluster_names) > 1:
+        log.error("A snapshot can only be selected for a single cluster.")
+        raise ValueError("A snapshot can only be selected for a single cluster.")
+    cluster_dir = cluster_dir or get_target_cluster_dir()
+    gc_workspaces(cluster_dir, exclude=target_cluster_names)
+    jobs = max(1, min(jobs, len(target_cluster_names)))
+
+    log.info(f"Running {action} for {len(target_cluster_names)} clusters with {jobs} workers: "
+             f"{', '.join(target_cluster_names)}")
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix=f"qa-{action}") as executor:
+        futures = {
+            # Each worker runs in a copy of the current context so its timing spans nest under the run
+            executor.submit(contextvars.copy_context().run, run_cluster_action, action, name, cluster_dir, upgrade,
+                            snapshot_id, apply_options, resume, smoketests): name
+            for name in target_cluster_names
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.cluster] = result
+            status = "succeeded" if result.succeeded else "FAILED"
+            log.info(f"[{result.cluster}] {action} {status} after {result.duration:.0f}s")
+
+    return [results[name] for name in target_cluster_names]
+
+
+def log_cluster_results(results: List[ClusterRunResult]) -> None:
+    """
+    Log a combined per-cluster summary of a multi-cluster run.
+    :param results: The per-cluster results to summarize.
+    :return: None
+    """
+    width = max([len("Cluster")] + [len(result.cluster) for result in results])
+    log.info("Multi-cluster run summary:")
+    log.info(f"  {'Cluster':<{width}}  {'Action':<10} {'Status':<8} {'Duration':>9}  Error")
+    for result in results:
+        status = "PASSED" if result.succeeded else "FAILED"
+        minutes, seconds = divmod(int(result.duration), 60)
+        log.info(f"  {result.cluster:<{width}}  {result.action:<10} {status:<8} {minutes:>5}m{seconds:02d}s  "
+                 f"{result.error}")
+
+    failed = [result.cluster for result in results if not result.succeeded]
+    if failed:
+        log.error(f"{len(failed)} of {len(results)} clusters failed: {', '.join(failed)}")
+    else:
+        log.info(f"All {len(results)} clusters completed successfully.")
@@ -0,0 +1,133 @@
+###########################################################
+#
+# Bounded-memory handling of command output.
+#
+# Every output line of a command is written to a rotating
+# on-disk command log and only the last N lines of each
+# stream are kept in memory for error reports. A line longer
+# than QA_COMMAND_MAX_LINE_BYTES (e.g. 'terraform show -json'
+# or a progress bar redrawn with '\r') is emitted in pieces,
+# so memory stays bounded without newlines too. The commands
+# themselves are run by qa_libraries.async_engine, which
+# drains stdout and stderr concurrently into OutputSinks.
+#
+
+from collections import deque
+from dataclasses import dataclass
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+import threading
+from typing import Deque, List, Optional
+
+from qa_libraries.logger import log, make_async
+from qa_libraries.qa_paths import QA_LOG_DIR
+
+# Number of output lines per stream kept in memory for error reports
+DEFAULT_TAIL_LINES = int(os.getenv('QA_COMMAND_TAIL_LINES', '200'))
+
+# Longest run of output without a newline held in memory; longer runs are emitted in pieces of this size
+COMMAND_MAX_LINE_BYTES = int(os.getenv('QA_COMMAND_MAX_LINE_BYTES', str(64 * 1024)))
+
+# Rotating command log settings
+COMMAND_LOG_FILE = os.getenv('QA_COMMAND_LOG_FILE', os.path.join(QA_LOG_DIR, "qa_commands.log"))
+COMMAND_LOG_MAX_BYTES = int(os.getenv('QA_COMMAND_LOG_MAX_BYTES', str(20 * 1024 * 1024)))
+COMMAND_LOG_BACKUP_COUNT = int(os.getenv('QA_COMMAND_LOG_BACKUP_COUNT', '5'))
+
+_command_log: Optional[logging.Logger] = None
+_command_log_lock = threading.Lock()
+
+
+@dataclass
+class CommandResult:
+    command: str
+    returncode: int
+    stdout_tail: str
+    stderr_tail: str
+    stdout_bytes: int
+    stderr_bytes: int
+    log_file: str
+    timed_out: bool = False
+
+
+def get_command_log() -> logging.Logger:
+    """
+    Get the logger writing full command output to the rotating command log file.
+    :return: The command output logger.
+    """
+    global _command_log
+    with _command_log_lock:
+        if _command_log is None:
+            os.makedirs(os.path.dirname(COMMAND_LOG_FILE), exist_ok=True)
+            handler = RotatingFileHandler(COMMAND_LOG_FILE, maxBytes=COMMAND_LOG_MAX_BYTES,
+                                          backupCount=COMMAND_LOG_BACKUP_COUNT, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(asctime)s\t%(message)s'))
+            _command_log = logging.getLogger('qa_commands')
+            _command_log.setLevel(logging.INFO)
+            make_async(_command_log, handler)
+            # Keep the full command output out of the console handlers on the root logger
+            _command_log.propagate = False
+    return _command_log
+
+
+class OutputSink:
+    """
+    Receives the output lines of one stream of a command: logs them to the console
+    and the command log, counts the bytes and keeps the last lines in memory.
+    """
+
+    def __init__(self, stream_name: str, tail_lines: int, label: Optional[str] = None, console_level: int = logging.INFO):
+        self.stream_name = stream_name
+        self.prefix = f"[{label}] " if label else ""
+        self.extra = {"command_output": stream_name, "label": label}
+        self.console_level = console_level
+        self.tail: Deque[str] = deque(maxlen=tail_lines)
+        self.bytes = 0
+        # Chunks of the current unterminated line, joined only once it is emitted
+        self._partial: List[bytes] = []
+        self._partial_bytes = 0
+
+    def feed(self, data: bytes) -> None:
+        """
+        Add a chunk of raw output, emitting every complete line it contains.
+        :param data: The raw bytes read from the stream.
+        """
+        self.bytes += len(data)
+        *lines, rest = data.split(b"\n")
+        if lines:
+            self._partial.append(lines[0])
+            self.emit(b"".join(self._partial))
+            self._partial, self._partial_bytes = [], 0
+            for line in lines[1:]:
+                self.emit(line)
+        if rest:
+            self._partial.append(rest)
+            self._partial_bytes += len(rest)
+            if self._partial_bytes >= COMMAND_MAX_LINE_BYTES:
+                # No newline in sight: emit what we have rather than buffer the whole line
+                partial = b"".join(self._partial)
+                for start in range(0, len(partial) - COMMAND_MAX_LINE_BYTES + 1, COMMAND_MAX_LINE_BYTES):
+                    self.emit(partial[start:start + COMMAND_MAX_LINE_BYTES])
+                rest = partial[len(partial) - len(partial) % COMMAND_MAX_LINE_BYTES:]
+                self._partial, self._partial_bytes = ([rest], len(rest)) if rest else ([], 0)
+
+    def close(self) -> None:
+        """
+        Emit any trailing output that was not terminated by a newline.
+        """
+        if self._partial:
+            self.emit(b"".join(self._partial))
+            self._partial, self._partial_bytes = [], 0
+
+    def emit(self, raw_line: bytes) -> None:
+        line = raw_line.decode('utf-8', errors='replace').rstrip("\r")
+        self.tail.append(line)
+        get_command_log().info(f"{self.prefix}{self.stream_name}\t{line}")
+        if line.strip():
+            log.log(self.console_level, f"{self.prefix}{line.strip()}", extra=self.extra)
+
+    def text(self) -> str:
+        """
+        :return: The retained tail of the stream, one line per entry.
+        """
+        return "".join(f"{line}\n" for line in self.tail)
@@ -0,0 +1,312 @@
+###########################################################
+#
+# Pre-flight drift check of a cluster bringup.
+#
+# After a successful apply, a fingerprint of everything the
+# apply depended on is recorded:
+#
+#   - the settings of every block of the *.tf files (e.g.
+#     cluster_custom_name and the module source/version of
+#     main.tf, the variables of variables.tf) and *.tfvars
+#   - the files of local modules ('source = "../"')
+#   - the init inputs (lock file, module sources, backend)
+#   - the TF_VAR_* variables and the AWS profile/region
+#   - the resulting terraform.tfstate (serial, lineage, hash)
+#
+# Before the next bringup of the same cluster in the same
+# directory the fingerprint is computed again. When nothing
+# changed, init and apply are skipped; otherwise the changed
+# entries are reported as a short diff.
+#
+# Changes made outside Terraform (in the AWS console) are not
+# visible to the check, so a fingerprint is only trusted for
+# QA_DRIFT_MAX_AGE_HOURS after the apply that recorded it.
+#
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Optional, Set
+
+from qa_libraries.logger import log
+from qa_libraries.qa_paths import QA_CACHE_DIR
+from qa_libraries.read_cache import aws_scope
+from qa_libraries.tf_init_cache import compute_init_fingerprint
+from qa_libraries.tfstate_index import StateParseError, get_state_index
+
+FINGERPRINT_DIR = os.getenv('QA_DRIFT_FINGERPRINT_DIR', os.path.join(QA_CACHE_DIR, "apply_fingerprints"))
+FINGERPRINT_FORMAT_VERSION = 1
+
+MAX_AGE_HOURS = float(os.getenv('QA_DRIFT_MAX_AGE_HOURS', '24'))
+
+# Values longer than this are recorded as a hash
+MAX_VALUE_LENGTH = 120
+
+HASH_PREFIX = "sha256:"
+
+_BLOCK_START_PATTERN = re.compile(r'^([A-Za-z_]+(?:\s+"[^"]*")*)\s*\{')
+_SETTING_PATTERN = re.compile(r'^\s*([A-Za-z0-9_-]+)\s*=\s*(.+?)\s*$')
+_LOCAL_SOURCE_PATTERN = re.compile(r'^\s*source\s*=\s*"(\.\.?/[^"]*)"')
+_PATH_MODULE_PATTERN = re.compile(r'\$\{path\.module\}/([^/"}]+)')
+_COMMENT_PATTERN = re.compile(r'^\s*(#|//)')
+
+
+@dataclass
+class DriftResult:
+    changed: bool
+    reason: str
+    # One line per changed fingerprint entry
+    changes: List[str] = field(default_factory=list)
+    applied_at: Optional[datetime] = None
+
+
+def _digest(data: bytes) -> str:
+    return HASH_PREFIX + hashlib.sha256(data).hexdigest()[:16]
+
+
+def _value(value: str) -> str:
+    return value if len(value) <= MAX_VALUE_LENGTH else _digest(value.encode())
+
+
+def _read_block_settings(path: str) -> Dict[str, str]:
+    """
+    Read the top-level blocks of a Terraform file: the single-line settings of each block
+    are recorded as is, everything else in the block as one hash.
+    """
+    file_name = os.path.basename(path)
+    inputs, occurrences = {}, {}
+    block, depth, body = None, 0, []
+    with open(path, 'r') as file:
+        for line in file:
+            if _COMMENT_PATTERN.match(line):
+                continue
+            if block is None:
+                match = _BLOCK_START_PATTERN.match(line.strip())
+                if not match:
+                    continue
+                block, depth, body = " ".join(match.group(1).split()), 0, []
+                # Blocks that may repeat (e.g. 'locals') are numbered from their second occurrence
+                occurrences[block] = occurrences.get(block, 0) + 1
+                if occurrences[block] > 1:
+                    block = f"{block} #{occurrences[block]}"
+
+            depth += line.count("{") - line.count("}")
+            setting = _SETTING_PATTERN.match(line) if depth == 1 and line.count("{") == line.count("}") else None
+            if setting:
+                inputs[f"{file_name}: {block}: {setting.group(1)}"] = _value(setting.group(2))
+            elif line.strip():
+                body.append(line.strip())
+            if depth <= 0:
+                inputs[f"{file_name}: {block}"] = _digest("\n".join(body).encode())
+                block = None
+    return inputs
+
+
+def _hash_tree(path: str, hasher) -> None:
+    if os.path.isfile(path):
+        with open(path, 'rb') as file:
+            hasher.update(hashlib.sha256(file.read()).digest())
+        return
+    for root, dirs, file_names in os.walk(path):
+        dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+        for file_name in sorted(file_names):
+            file_path = os.path.join(root, file_name)
+            hasher.update(os.path.relpath(file_path, path).encode())
+            with open(file_path, 'rb') as file:
+                hasher.update(hashlib.sha256(file.read()).digest())
+
+
+def _local_module_sources(tf_files: List[str]) -> Set[str]:
+    sources = set()
+    for tf_file in tf_files:
+        module_dir = os.path.dirname(os.path.realpath(tf_file))
+        with open(tf_file, 'r') as file:
+            for line in file:
+                match = _LOCAL_SOURCE_PATTERN.match(line)
+                if match:
+                    sources.add(os.path.normpath(os.path.join(module_dir, match.group(1))))
+    return sources
+
+
+def _hash_local_module(module_dir: str, seen: Set[str]) -> str:
+    """
+    Hash a local module: its Terraform files, the files it reads through ${path.module}
+    and its own local modules.
+    """
+    seen.add(module_dir)
+    hasher = hashlib.sha256()
+    tf_files = sorted(os.path.join(module_dir, name) for name in os.listdir(module_dir)
+                      if name.endswith((".tf", ".tf.json")))
+    referenced = set()
+    for tf_file in tf_files:
+        hasher.update(os.path.basename(tf_file).encode())
+        with open(tf_file, 'rb') as file:
+            data = file.read()
+        hasher.update(hashlib.sha256(data).digest())
+        referenced.update(_PATH_MODULE_PATTERN.findall(data.decode(errors='replace')))
+
+    for name in sorted(referenced):
+        if os.path.exists(os.path.join(module_dir, name)):
+            hasher.update(name.encode())
+            _hash_tree(os.path.join(module_dir, name), hasher)
+
+    for source in sorted(_local_module_sources(tf_files)):
+        if source not in seen and os.path.isdir(source):
+            hasher.update(_hash_local_module(source, seen).encode())
+    return HASH_PREFIX + hasher.hexdigest()[:16]
+
+
+def _describe_state(workdir: str) -> str:
+    state_file = os.path.join(workdir, "terraform.tfstate")
+    if not os.path.exists(state_file):
+        return "none"
+    try:
+        state_index = get_state_index(state_file)
+    except StateParseError:
+        with open(state_file, 'rb') as file:
+            return _digest(file.read())
+    return f"serial {state_index.serial}, lineage {state_index.lineage}, {HASH_PREFIX}{state_index.sha256[:16]}"
+
+
+def compute_apply_fingerprint(target_cluster_name: str, workdir: str) -> Dict[str, str]:
+    """
+    Compute the fingerprint of everything an apply of a directory depends on.
+    :param target_cluster_name: The name of the cluster.
+    :param workdir: The Terraform working directory.
+    :return: The fingerprint entries, keyed by what they describe.
+    """
+    fingerprint = {"cluster": target_cluster_name}
+    tf_files = []
+    for file_name in sorted(os.listdir(workdir)):
+        path = os.path.join(workdir, file_name)
+        if not os.path.isfile(path):
+            continue
+        if file_name.endswith(".tf"):
+            tf_files.append(path)
+            fingerprint.update(_read_block_settings(path))
+        elif file_name.endswith((".tf.json", ".tfvars", ".tfvars.json")):
+            with open(path, 'rb') as file:
+                fingerprint[file_name] = _digest(file.read())
+
+    seen: Set[str] = set()
+    for source in sorted(_local_module_sources(tf_files)):
+        if os.path.isdir(source):
+            fingerprint[f"local module {os.path.relpath(source, workdir)}"] = _hash_local_module(source, seen)
+
+    for key, value in compute_init_fingerprint(workdir).items():
+        fingerprint[f"init: {key}"] = HASH_PREFIX + value[:16]
+    modules_json = os.path.join(workdir, ".terraform", "modules", "modules.json")
+    if os.path.exists(modules_json):
+        with open(modules_json, 'rb') as file:
+            fingerprint["init: installed modules"] = _digest(file.read())
+
+    tf_vars = sorted(f"{name}={value}" for name, value in os.environ.items() if name.startswith("TF_VAR_"))
+    fingerprint["environment: TF_VAR_*"] = _digest("\n".join(tf_vars).encode())
+    fingerprint["aws scope"] = _digest(aws_scope().encode())
+    fingerprint["state"] = _describe_state(workdir)
+    return fingerprint
+
+
+def _fingerprint_path(target_cluster_name: str, workdir: str) -> str:
+    workdir_key = hashlib.sha1(os.path.realpath(workdir).encode()).hexdigest()[:12]
+    return os.path.join(FINGERPRINT_DIR, f"{target_cluster_name}-{workdir_key}.json")
+
+
+def record_successful_apply(target_cluster_name: str, workdir: str) -> None:
+    """
+    Record the fingerprint of a directory right after a successful apply.
+    :param target_cluster_name: The name of the cluster.
+    :param workdir: The Terraform working directory.
+    :return: None
+    """
+    path = _fingerprint_path(target_cluster_name, workdir)
+    try:
+        os.makedirs(FINGERPRINT_DIR, exist_ok=True)
+        temp_path = f"{path}.tmp-{os.getpid()}"
+        with open(temp_path, 'w') as file:
+            json.dump({"format_version": FINGERPRINT_FORMAT_VERSION,
+                       "applied_at": datetime.now(timezone.utc).isoformat(),
+                       "fingerprint": compute_apply_fingerprint(target_cluster_name, workdir)}, file, indent=2)
+        os.replace(temp_path, path)
+    except OSError as e:
+        log.warning(f"[{target_cluster_name}] Unable to record the apply fingerprint: {e}")
+
+
+def forget_apply(target_cluster_name: str, workdir: str) -> None:
+    """
+    Drop the recorded fingerprint, e.g. before an apply that may fail halfway.
+    :param target_cluster_name: The name of the cluster.
+    :param workdir: The Terraform working directory.
+    :return: None
+    """
+    try:
+        os.remove(_fingerprint_path(target_cluster_name, workdir))
+    except FileNotFoundError:
+        pass
+
+
+def diff_fingerprints(recorded: Dict[str, str], current: Dict[str, str]) -> List[str]:
+    """
+    :param recorded: The fingerprint of the last successful apply.
+    :param current: The current fingerprint.
+    :return: One line per changed entry, with the old and new value unless they are hashes.
+    """
+    changes = []
+    for key in sorted(set(recorded) | set(current)):
+        before, after = recorded.get(key), current.get(key)
+        if before == after:
+            continue
+        if before is None:
+            changes.append(f"+ {key}" + ("" if after.startswith(HASH_PREFIX) else f" = {after}"))
+        elif after is None:
+            changes.append(f"- {key}")
+        elif before.startswith(HASH_PREFIX) or after.startswith(HASH_PREFIX):
+            changes.append(f"~ {key}: changed")
+        else:
+            changes.append(f"~ {key}: {before} -> {after}")
+    return changes
+
+
+def check_drift(target_cluster_name: str, workdir: str, max_age_hours: float = MAX_AGE_HOURS) -> DriftResult:
+    """
+    Compare a directory with the fingerprint of its last successful apply.
+    :param target_cluster_name: The name of the cluster.
+    :param workdir: The Terraform working directory.
+    :param max_age_hours: Fingerprints older than this are not trusted.
+    :return: Whether anything changed, why, and the changed entries.
+    """
+    try:
+        with open(_fingerprint_path(target_cluster_name, workdir), 'r') as file:
+            recorded = json.load(file)
+        if recorded.get("format_version") != FINGERPRINT_FORMAT_VERSION:
+            return DriftResult(True, "no successful apply recorded")
+        applied_at = datetime.fromisoformat(recorded["applied_at"])
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, ValueError):
+        return DriftResult(True, "no successful apply recorded")
+
+    age_hours = (datetime.now(timezone.utc) - applied_at).total_seconds() / 3600
+    if age_hours > max_age_hours:
+        return DriftResult(True, f"the last successful apply is {age_hours:.0f}h old (limit: {max_age_hours:g}h)",
+                           applied_at=applied_at)
+
+    changes = diff_fingerprints(recorded["fingerprint"], compute_apply_fingerprint(target_cluster_name, workdir))
+    if changes:
+        return DriftResult(True, f"{len(changes)} of the apply inputs changed since the last successful apply", changes,
+                           applied_at)
+    return DriftResult(False, "nothing changed since the last successful apply", applied_at=applied_at)
+
+
+def log_drift(result: DriftResult, label: Optional[str] = None) -> None:
+    """
+    Log the result of a drift check with its changed entries.
+    :param result: The result of the drift check.
+    :param label: Optional prefix, normally the cluster name.
+    :return: None
+    """
+    prefix = f"[{label}] " if label else ""
+    log.info(f"{prefix}Drift check: {result.reason}.")
+    for change in result.changes:
+        log.info(f"{prefix}  {change}")
@@ -0,0 +1,322 @@
+###########################################################
+#
+# EKS authentication of the QA tools.
+#
+# Instead of 'aws eks update-kubeconfig', which rewrites the
+# shared ~/.kube/config and makes every kubectl call fork
+# 'aws eks get-token', each cluster gets its own kubeconfig,
+# '<repo-root>/qa_testing/.cache/kubeconfigs/<cluster>.
+# kubeconfig', reused for as long as the cluster's ARN,
+# endpoint and CA still match a (cached) 'aws eks
+# describe-cluster', and rewritten when the cluster was
+# re-created under the same name. Its credential
+# helper (python/eks_token.py) hands kubectl the cluster's
+# token from a cache, '<repo-root>/qa_testing/.cache/
+# eks_tokens/', and only signs a new one shortly before the
+# cached one expires:
+#
+#   token     a presigned STS GetCallerIdentity URL, as
+#             'aws eks get-token' makes it; signed with
+#             botocore when it is installed, otherwise with
+#             'aws eks get-token' itself
+#   lifetime  EKS accepts a token for 15 minutes; it is
+#             cached for TOKEN_LIFETIME seconds minus
+#             QA_EKS_TOKEN_REFRESH_MARGIN
+#
+# The token cache is keyed by the AWS credentials in use
+# (see read_cache.aws_scope), so switching profiles never
+# reuses another identity's token. Set
+# QA_PER_CLUSTER_KUBECONFIG=0 to go back to
+# 'aws eks update-kubeconfig'.
+#
+
+import base64
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import fcntl
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from typing import Dict, Iterator, Tuple
+
+from qa_libraries.lazy_imports import lazy_import
+from qa_libraries.logger import log
+from qa_libraries.qa_paths import QA_CACHE_DIR, QA_PYTHON_DIR
+from qa_libraries.read_cache import AWS_READ_TTL, aws_scope, cached_read
+
+botocore_session = lazy_import("botocore.session")
+botocore_signers = lazy_import("botocore.signers")
+
+PER_CLUSTER_KUBECONFIG = os.getenv('QA_PER_CLUSTER_KUBECONFIG', '1') != '0'
+KUBECONFIG_DIR = os.getenv('QA_KUBECONFIG_DIR', os.path.join(QA_CACHE_DIR, "kubeconfigs"))
+TOKEN_CACHE_DIR = os.getenv('QA_EKS_TOKEN_DIR', os.path.join(QA_CACHE_DIR, "eks_tokens"))
+
+# Seconds a token is valid for, as reported by 'aws eks get-token' (EKS itself accepts 15 minutes)
+TOKEN_LIFETIME = 14 * 60
+TOKEN_REFRESH_MARGIN = float(os.getenv('QA_EKS_TOKEN_REFRESH_MARGIN', '120'))
+TOKEN_TIMEOUT = float(os.getenv('QA_EKS_TOKEN_TIMEOUT', '60'))
+
+TOKEN_PREFIX = "k8s-aws-v1."
+EXEC_API_VERSION = "client.authentication.k8s.io/v1beta1"
+EKS_TOKEN_SCRIPT = os.path.join(QA_PYTHON_DIR, "eks_token.py")
+EKS_KUBECONFIG_SCRIPT = os.path.join(QA_PYTHON_DIR, "eks_kubeconfig.py")
+
+# First line of a kubeconfig written by write_kubeconfig, with the cluster it was written for
+KUBECONFIG_IDENTITY_PREFIX = "# qa-eks-cluster: "
+
+KUBECONFIG_TEMPLATE = """{identity_line}
+apiVersion: v1
+kind: Config
+preferences: {{}}
+current-context: {arn}
+clusters:
+- name: {arn}
+  cluster:
+    server: {endpoint}
+    certificate-authority-data: {ca}
+contexts:
+- name: {arn}
+  context:
+    cluster: {arn}
+    user: {arn}
+users:
+- name: {arn}
+  user:
+    exec:
+      apiVersion: {api_version}
+      command: {command}
+      args:
+{args}{env}      interactiveMode: Never
+      provideClusterInfo: false
+"""
+
+
+def _private_dir(path: str) -> None:
+    os.makedirs(path, mode=0o700, exist_ok=True)
+
+
+def _write_private(path: str, content: str) -> None:
+    temp_path = f"{path}.tmp-{os.getpid()}"
+    descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'w') as file:
+        file.write(content)
+    os.replace(temp_path, path)
+
+
+def _token_path(cluster_name: str, region: str) -> str:
+    identity = hashlib.sha256(f"{aws_scope()}\n{region}".encode()).hexdigest()[:16]
+    return os.path.join(TOKEN_CACHE_DIR, f"{cluster_name}-{identity}.json")
+
+
+def _sign_with_botocore(cluster_name: str, region: str) -> Tuple[str, float]:
+    session = botocore_session.get_session()
+    credentials = session.get_credentials()
+    if credentials is None:
+        raise RuntimeError("No AWS credentials found.")
+    client = session.create_client("sts", region_name=region)
+    signer = botocore_signers.RequestSigner(client.meta.service_model.service_id, region, "sts", "v4",
+                                            credentials, session.get_component("event_emitter"))
+    url = signer.generate_presigned_url({
+        "method": "GET",
+        "url": f"https://sts.{region}.amazonaws.com/?Action=GetCallerIdentity&Version=2011-06-15",
+        "body": {},
+        "headers": {"x-k8s-aws-id": cluster_name},
+        "context": {},
+    }, region_name=region, expires_in=60, operation_name="")
+    token = TOKEN_PREFIX + base64.urlsafe_b64encode(url.encode()).decode().rstrip("=")
+    return token, time.time() + TOKEN_LIFETIME
+
+
+def _sign_with_aws_cli(cluster_name: str, region: str) -> Tuple[str, float]:
+    command = ["aws", "eks", "get-token", "--cluster-name", cluster_name, "--region", region, "--output", "json"]
+    try:
+        completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL,
+                                   timeout=TOKEN_TIMEOUT)
+    except (FileNotFoundError, subprocess.TimeoutExpired) as e:
+        raise RuntimeError(str(e)) from e
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.decode(errors='replace').strip())
+    status = json.loads(completed.stdout)["status"]
+    expiration = datetime.strptime(status["expirationTimestamp"], "%Y-%m-%dT%H:%M:%SZ")
+    return status["token"], expiration.replace(tzinfo=timezone.utc).timestamp()
+
+
+def sign_token(cluster_name: str, region: str) -> Tuple[str, float]:
+    """
+    Sign a new EKS token with the current AWS credentials.
+    :param cluster_name: The cluster the token is for.
+    :param region: The AWS region of the cluster.
+    :return: The token and its expiration time (seconds since the epoch).
+    """
+    try:
+        if importlib.util.find_spec("botocore") is not None:
+            return _sign_with_botocore(cluster_name, region)
+        return _sign_with_aws_cli(cluster_name, region)
+    except (RuntimeError, KeyError, ValueError) as e:
+        log.error(f"Unable to get an EKS token for cluster '{cluster_name}': {e}")
+        raise RuntimeError(f"Unable to get an EKS token for cluster '{cluster_name}': {e}") from e
+
+
+def _read_token(path: str) -> Tuple[str, float]:
+    try:
+        with open(path, 'r') as file:
+            cached = json.load(file)
+        return cached["token"], float(cached["expiration"])
+    except (OSError, ValueError, KeyError):
+        return "", 0.0
+
+
+@contextmanager
+def _locked(path: str) -> Iterator[None]:
+    with open(f"{path}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_token(cluster_name: str, region: str, refresh: bool = False) -> Tuple[str, float]:
+    """
+    Get the cached EKS token of a cluster, signing a new one when it is about to expire.
+
+    Concurrent callers (e.g. the kubectl calls of parallel smoketests) wait for a single signing.
+
+    :param cluster_name: The cluster the token is for.
+    :param region: The AWS region of the cluster.
+    :param refresh: Sign a new token even if the cached one is still valid.
+    :return: The token and its expiration time (seconds since the epoch).
+    """
+    path = _token_path(cluster_name, region)
+    token, expiration = _read_token(path)
+    if token and not refresh and expiration - TOKEN_REFRESH_MARGIN > time.time():
+        return token, expiration
+
+    _private_dir(TOKEN_CACHE_DIR)
+    with _locked(path):
+        token, expiration = _read_token(path)
+        if token and not refresh and expiration - TOKEN_REFRESH_MARGIN > time.time():
+            return token, expiration
+        token, expiration = sign_token(cluster_name, region)
+        try:
+            _write_private(path, json.dumps({"cluster": cluster_name, "region": region, "token": token,
+                                             "expiration": expiration}))
+        except OSError as e:
+            log.warning(f"Unable to cache the EKS token of cluster '{cluster_name}': {e}")
+    return token, expiration
+
+
+def exec_credential(token: str, expiration: float) -> Dict:
+    """
+    :param token: An EKS token.
+    :param expiration: Its expiration time (seconds since the epoch).
+    :return: The ExecCredential a kubectl credential plugin prints.
+    """
+    expires = datetime.fromtimestamp(expiration, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return {"kind": "ExecCredential", "apiVersion": EXEC_API_VERSION, "spec": {},
+            "status": {"expirationTimestamp": expires, "token": token}}
+
+
+def kubeconfig_path(cluster_name: str) -> str:
+    """
+    :param cluster_name: The name of the cluster.
+    :return: The path of the cluster's own kubeconfig.
+    """
+    return os.path.join(KUBECONFIG_DIR, f"{cluster_name}.kubeconfig")
+
+
+def _cluster_identity(arn: str, endpoint: str, ca: str) -> str:
+    return json.dumps({"arn": arn, "endpoint": endpoint, "ca": hashlib.sha256(ca.encode()).hexdigest()[:16]},
+                      sort_keys=True)
+
+
+def _read_kubeconfig_identity(path: str) -> str:
+    try:
+        with open(path, 'r') as file:
+            first_line = file.readline().rstrip("\n")
+    except OSError:
+        return ""
+    return first_line[len(KUBECONFIG_IDENTITY_PREFIX):] if first_line.startswith(KUBECONFIG_IDENTITY_PREFIX) else ""
+
+
+def write_kubeconfig(cluster_name: str, region: str, refresh: bool = False) -> str:
+    """
+    Write the cluster's own kubeconfig, unless it already exists for the same cluster.
+
+    The existing kubeconfig is compared with the ARN, endpoint and CA of a cached 'aws eks describe-cluster',
+    and rewritten when they differ (e.g. the cluster was destroyed and created again outside of the bringup).
+
+    :param cluster_name: The name of the cluster.
+    :param region: The AWS region of the cluster.
+    :param refresh: Rewrite it from a live 'aws eks describe-cluster' (e.g. after the cluster was created).
+    :return: The path of the kubeconfig.
+    """
+    path = kubeconfig_path(cluster_name)
+    exists = os.path.exists(path)
+
+    described = cached_read(f"aws eks describe-cluster --name {cluster_name} --region {region} "
+                            f"--query cluster.{{arn:arn,endpoint:endpoint,ca:certificateAuthority.data}} "
+                            f"--output json", aws_scope(), AWS_READ_TTL, refresh=refresh)
+    try:
+        if described.returncode != 0:
+            raise ValueError(described.stderr.strip())
+        cluster = json.loads(described.stdout)
+        arn, endpoint, ca = cluster["arn"], cluster["endpoint"], cluster["ca"]
+    except (ValueError, KeyError, TypeError) as e:
+        if exists and not refresh:
+            log.warning(f"Unable to describe cluster '{cluster_name}', reusing its kubeconfig '{path}': {e}")
+            return path
+        log.error(f"Unable to describe cluster '{cluster_name}' for its kubeconfig: {e}")
+        raise RuntimeError(f"Unable to describe cluster '{cluster_name}' for its kubeconfig: {e}") from e
+
+    identity = _cluster_identity(arn, endpoint, ca)
+    if exists and not refresh:
+        if _read_kubeconfig_identity(path) == identity:
+            return path
+        log.info(f"[{cluster_name}] The cluster changed since its kubeconfig was written, rewriting it.")
+
+    args = [EKS_TOKEN_SCRIPT, "--cluster-name", cluster_name, "--region", region]
+    profile = os.getenv('AWS_PROFILE')
+    content = KUBECONFIG_TEMPLATE.format(
+        identity_line=KUBECONFIG_IDENTITY_PREFIX + identity,
+        arn=json.dumps(arn), endpoint=json.dumps(endpoint), ca=json.dumps(ca),
+        api_version=EXEC_API_VERSION, command=json.dumps(sys.executable),
+        args="".join(f"      - {json.dumps(arg)}\n" for arg in args),
+        env=f"      env:\n      - name: AWS_PROFILE\n        value: {json.dumps(profile)}\n" if profile else "")
+    _private_dir(KUBECONFIG_DIR)
+    _write_private(path, content)
+    log.info(f"[{cluster_name}] Kubeconfig written to '{path}'.")
+    return path
+
+
+def remove_cluster_credentials(cluster_name: str) -> None:
+    """
+    Remove the kubeconfig and the cached tokens of a cluster (e.g. once it is destroyed).
+    :param cluster_name: The name of the cluster.
+    :return: None
+    """
+    tokens = glob.glob(os.path.join(TOKEN_CACHE_DIR, f"{cluster_name}-{'[0-9a-f]' * 16}.json*"))
+    for path in [kubeconfig_path(cluster_name), *tokens]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def get_kubeconfig_command(cluster_name: str, region: str, refresh: bool = True) -> str:
+    """
+    :param cluster_name: The name of the cluster.
+    :param region: The AWS region of the cluster.
+    :param refresh: Rewrite the kubeconfig even if it exists.
+    :return: The command writing the cluster's kubeconfig, as a step of a bringup/bringdown.
+    """
+    if not PER_CLUSTER_KUBECONFIG:
+        return f"aws eks update-kubeconfig --name {cluster_name} --region {region}"
+    return f"{shlex.quote(sys.executable)} {shlex.quote(EKS_KUBECONFIG_SCRIPT)} -t {cluster_name} " \
+           f"--region {region}{' --refresh' if refresh else ''}"
@@ -0,0 +1,298 @@
+###########################################################
+#
+# Fleet inventory: which clusters are running and which
+# have saved Terraform state.
+#
+# Every state file of a target-cluster directory is indexed:
+#
+#   shared     <cluster_dir>/terraform.tfstate
+#   workspace  <cluster_dir>/.qa_workdirs/<cluster>/terraform.tfstate
+#   legacy     <cluster_dir>/tf.state_<cluster>/terraform.tfstate
+#   store      newest snapshot in <cluster_dir>/tf.state_store
+#
+# The index (cluster name, serial, lineage, resource counts,
+# size, last-modified) is kept as JSON under
+# QA_FLEET_INDEX_DIR and only re-reads the files whose mtime
+# or size changed, so an unchanged fleet costs one stat() per
+# file. It is reconciled against one (cached) 'aws eks
+# list-clusters' listing:
+#
+#   running      listed by AWS, with saved state
+#   orphaned     listed by AWS, without any saved state
+#   stale-state  not listed, but its state still holds resources
+#   destroyed    not listed, its state holds no resources
+#
+
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from qa_libraries.logger import log
+from qa_libraries.qa_paths import QA_CACHE_DIR
+from qa_libraries.tf_cluster_commands import list_clusters
+from qa_libraries.tfstate_index import StateIndex, StateParseError, get_state_index, index_state_stream
+from qa_libraries.tfstate_store import (
+    LEGACY_BACKUP_DIR_PREFIX,
+    STATE_FILE_NAMES,
+    STORE_DIR_NAME,
+    get_blob_size,
+    get_state_store_dir,
+    list_snapshots,
+    list_stored_clusters,
+    open_blob,
+)
+from qa_libraries.workspaces import get_workspace_dir, list_workspaces
+
+INVENTORY_INDEX_DIR = os.getenv('QA_FLEET_INDEX_DIR', os.path.join(QA_CACHE_DIR, "fleet_inventory"))
+INVENTORY_FORMAT_VERSION = 1
+
+SOURCE_SHARED = "shared"
+SOURCE_WORKSPACE = "workspace"
+SOURCE_LEGACY = "legacy"
+SOURCE_STORE = "store"
+
+STATUS_RUNNING = "running"
+STATUS_ORPHANED = "orphaned"
+STATUS_STALE_STATE = "stale-state"
+STATUS_DESTROYED = "destroyed"
+STATUSES = (STATUS_RUNNING, STATUS_ORPHANED, STATUS_STALE_STATE, STATUS_DESTROYED)
+
+_index_lock = threading.Lock()
+
+
+@dataclass
+class StateEntry:
+    source: str
+    path: str
+    # mtime/size of the indexed file (the manifest for store entries), to detect changes
+    mtime_ns: int
+    file_size: int
+    # Size of the state itself (compressed for store entries)
+    size: int
+    cluster_name: Optional[str] = None
+    serial: Optional[int] = None
+    lineage: Optional[str] = None
+    resource_count: int = 0
+    resource_type_count: int = 0
+    # Number of snapshots of the cluster (store entries only)
+    snapshot_count: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def modified(self) -> datetime:
+        return datetime.fromtimestamp(self.mtime_ns / 1e9, tz=timezone.utc)
+
+
+@dataclass
+class ClusterInventory:
+    cluster_name: str
+    status: str
+    running: bool
+    states: List[StateEntry] = field(default_factory=list)
+
+    @property
+    def newest_state(self) -> Optional[StateEntry]:
+        """
+        :return: The state with the highest serial (the most recently modified on a tie), if any.
+        """
+        readable = [state for state in self.states if state.error is None]
+        if not readable:
+            return None
+        return max(readable, key=lambda state: (state.serial or -1, state.mtime_ns))
+
+    def to_dict(self) -> Dict:
+        return {"cluster": self.cluster_name, "status": self.status, "running": self.running,
+                "states": [asdict(state) for state in self.states]}
+
+
+def _index_path(cluster_dir: str) -> str:
+    return os.path.join(INVENTORY_INDEX_DIR,
+                        hashlib.sha1(os.path.realpath(cluster_dir).encode()).hexdigest() + ".json")
+
+
+def _load_index(cluster_dir: str) -> Dict[str, StateEntry]:
+    try:
+        with open(_index_path(cluster_dir), 'r') as file:
+            data = json.load(file)
+        if data.get("format_version") != INVENTORY_FORMAT_VERSION:
+            return {}
+        return {entry["path"]: StateEntry(**entry) for entry in data["entries"]}
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError):
+        return {}
+
+
+def _save_index(cluster_dir: str, entries: List[StateEntry]) -> None:
+    index_path = _index_path(cluster_dir)
+    os.makedirs(INVENTORY_INDEX_DIR, exist_ok=True)
+    temp_path = f"{index_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(temp_path, 'w') as file:
+        json.dump({"format_version": INVENTORY_FORMAT_VERSION, "cluster_dir": os.path.realpath(cluster_dir),
+                   "entries": [asdict(entry) for entry in entries]}, file)
+    os.replace(temp_path, index_path)
+
+
+def _first_state_file(state_dir: str) -> Optional[str]:
+    for name in STATE_FILE_NAMES:
+        path = os.path.join(state_dir, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def discover_state_files(cluster_dir: str) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Find every state file of a target-cluster directory.
+    :param cluster_dir: The target-cluster directory.
+    :return: (source, path, cluster name or None if only the state itself tells) of each state file.
+    """
+    found = []
+    shared_state = os.path.join(cluster_dir, "terraform.tfstate")
+    if os.path.isfile(shared_state):
+        found.append((SOURCE_SHARED, shared_state, None))
+
+    for cluster_name in list_workspaces(cluster_dir):
+        state_file = os.path.join(get_workspace_dir(cluster_name, cluster_dir), "terraform.tfstate")
+        if os.path.isfile(state_file):
+            found.append((SOURCE_WORKSPACE, state_file, cluster_name))
+
+    for entry in sorted(os.listdir(cluster_dir)):
+        if not entry.startswith(LEGACY_BACKUP_DIR_PREFIX) or entry == STORE_DIR_NAME:
+            continue
+        state_file = _first_state_file(os.path.join(cluster_dir, entry))
+        if state_file:
+            found.append((SOURCE_LEGACY, state_file, entry[len(LEGACY_BACKUP_DIR_PREFIX):]))
+
+    store_dir = get_state_store_dir(cluster_dir)
+    for cluster_name in list_stored_clusters(store_dir):
+        found.append((SOURCE_STORE, os.path.join(store_dir, "manifests", f"{cluster_name}.json"), cluster_name))
+    return found
+
+
+def _entry_from_index(source: str, path: str, cluster_name: Optional[str], state_index: StateIndex,
+                      mtime_ns: int, size: int) -> StateEntry:
+    return StateEntry(source=source, path=path, mtime_ns=mtime_ns, file_size=size, size=size,
+                      cluster_name=cluster_name or state_index.cluster_name, serial=state_index.serial,
+                      lineage=state_index.lineage, resource_count=state_index.resource_count,
+                      resource_type_count=len(state_index.resources))
+
+
+def _index_store_manifest(path: str, cluster_name: str, cluster_dir: str, stat: os.stat_result) -> StateEntry:
+    """
+    Index the newest snapshot of a cluster, streaming its state straight out of the compressed blob.
+    """
+    store_dir = get_state_store_dir(cluster_dir)
+    snapshots = list_snapshots(cluster_name, store_dir)
+    entry = StateEntry(source=SOURCE_STORE, path=path, mtime_ns=stat.st_mtime_ns, file_size=stat.st_size, size=0,
+                       cluster_name=cluster_name, snapshot_count=len(snapshots))
+    if not snapshots:
+        return entry
+
+    files = snapshots[-1]["files"]
+    digest = files.get("terraform.tfstate") or next(iter(files.values()))
+    state_index = StateIndex(path=path, mtime_ns=stat.st_mtime_ns, size=0, sha256="")
+    with open_blob(store_dir, digest) as blob:
+        index_state_stream(blob, state_index)
+    entry.size = get_blob_size(store_dir, digest)
+    entry.serial, entry.lineage = state_index.serial, state_index.lineage
+    entry.resource_count, entry.resource_type_count = state_index.resource_count, len(state_index.resources)
+    return entry
+
+
+def update_state_index(cluster_dir: str, rebuild: bool = False) -> List[StateEntry]:
+    """
+    Bring the state index of a target-cluster directory up to date.
+
+    Only state files that are new or whose mtime/size changed since the last update are read.
+
+    :param cluster_dir: The target-cluster directory.
+    :param rebuild: Re-read every state file.
+    :return: The index entries of every state file.
+    """
+    with _index_lock:
+        previous = {} if rebuild else _load_index(cluster_dir)
+        entries, reindexed = [], 0
+        for source, path, cluster_name in discover_state_files(cluster_dir):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            cached = previous.get(path)
+            if cached and (cached.mtime_ns, cached.file_size) == (stat.st_mtime_ns, stat.st_size):
+                entries.append(cached)
+                continue
+
+            reindexed += 1
+            try:
+                if source == SOURCE_STORE:
+                    entry = _index_store_manifest(path, cluster_name, cluster_dir, stat)
+                else:
+                    entry = _entry_from_index(source, path, cluster_name, get_state_index(path),
+                                              stat.st_mtime_ns, stat.st_size)
+            except (OSError, StateParseError, ValueError, KeyError) as e:
+                log.warning(f"Unable to index the state file '{path}': {e}")
+                entry = StateEntry(source=source, path=path, mtime_ns=stat.st_mtime_ns, file_size=stat.st_size,
+                                   size=stat.st_size, cluster_name=cluster_name, error=str(e))
+            entries.append(entry)
+
+        if reindexed or set(previous) != {entry.path for entry in entries}:
+            try:
+                _save_index(cluster_dir, entries)
+            except OSError as e:
+                log.warning(f"Unable to save the fleet inventory index: {e}")
+    log.debug(f"Fleet inventory index: {len(entries)} state files, {reindexed} re-read.")
+    return entries
+
+
+def get_cluster_status(running: bool, newest_state: Optional[StateEntry], has_state: bool) -> str:
+    """
+    :param running: Whether AWS lists the cluster.
+    :param newest_state: The newest readable state of the cluster, if any.
+    :param has_state: Whether any state file (readable or not) was found for the cluster.
+    :return: The status of the cluster, one of STATUSES.
+    """
+    if running:
+        return STATUS_RUNNING if has_state else STATUS_ORPHANED
+    if newest_state is None or newest_state.resource_count:
+        return STATUS_STALE_STATE
+    return STATUS_DESTROYED
+
+
+def reconcile(entries: List[StateEntry], running_clusters: List[str]) -> List[ClusterInventory]:
+    """
+    Combine the indexed state files with the clusters listed by AWS.
+    :param entries: The index entries of the state files.
+    :param running_clusters: The clusters listed by AWS.
+    :return: One inventory per cluster, sorted by name.
+    """
+    states: Dict[str, List[StateEntry]] = {}
+    for entry in entries:
+        if entry.cluster_name:
+            states.setdefault(entry.cluster_name, []).append(entry)
+        else:
+            log.warning(f"No cluster name found in the state file '{entry.path}'; leaving it out of the inventory.")
+
+    running = set(running_clusters)
+    inventory = []
+    for cluster_name in sorted(running | set(states)):
+        cluster = ClusterInventory(cluster_name=cluster_name, status="", running=cluster_name in running,
+                                   states=sorted(states.get(cluster_name, []), key=lambda state: state.source))
+        cluster.status = get_cluster_status(cluster.running, cluster.newest_state, bool(cluster.states))
+        inventory.append(cluster)
+    return inventory
+
+
+def build_inventory(cluster_dir: str, refresh: bool = False, rebuild: bool = False) -> List[ClusterInventory]:
+    """
+    Build the fleet inventory of a target-cluster directory.
+    :param cluster_dir: The target-cluster directory.
+    :param refresh: List the clusters live instead of reusing a recent listing (see read_cache).
+    :param rebuild: Re-read every state file instead of only the changed ones.
+    :return: One inventory per cluster, sorted by name.
+    :raises ValueError: If the clusters cannot be listed.
+    """
+    entries = update_state_index(cluster_dir, rebuild=rebuild)
+    return reconcile(entries, list_clusters(refresh=refresh))
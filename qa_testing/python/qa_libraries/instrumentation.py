@@ -0,0 +1,245 @@
+###########################################################
+#
+# Phase-level timing instrumentation.
+#
+# Work is recorded as spans: a name, a category ('run',
+# 'cluster', 'command', 'state', ...), an optional label
+# (normally the cluster name), start/end times and a status.
+# Command spans also record the exit code and the number of
+# bytes written to stdout/stderr. Spans nest through a
+# context variable, so steps running in asyncio tasks or
+# worker threads are attributed to the span that started
+# them.
+#
+# Each CLI run writes a timing report to the log directory:
+#
+#   <timestamp>_<run>_timings.json   run metadata, all spans
+#                                    and per-phase totals
+#   <timestamp>_<run>_timings.csv    one row per span
+#
+
+from contextlib import contextmanager
+import contextvars
+import csv
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime
+import functools
+import inspect
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from qa_libraries.logger import log, log_context
+from qa_libraries.qa_paths import QA_LOG_DIR
+
+TIMING_REPORT_DIR = os.getenv('QA_TIMING_REPORT_DIR', QA_LOG_DIR)
+TIMING_REPORT_ENABLED = os.getenv('QA_TIMING_REPORT', '1') != '0'
+
+
+@dataclass
+class Span:
+    span_id: int
+    parent_id: Optional[int]
+    name: str
+    category: str
+    label: Optional[str]
+    start: float
+    end: Optional[float] = None
+    duration: Optional[float] = None
+    status: str = "ok"
+    returncode: Optional[int] = None
+    stdout_bytes: Optional[int] = None
+    stderr_bytes: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+_span_ids = itertools.count(1)
+_current_span_id: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('qa_current_span_id', default=None)
+_spans: List[Span] = []
+_spans_lock = threading.Lock()
+
+
+@contextmanager
+def span(name: str, category: str, label: Optional[str] = None, **attributes) -> Iterator[Span]:
+    """
+    Time a block of work as a span nested in the current span.
+    :param name: The name of the phase, e.g. 'apply' or 'tfstate_restore'.
+    :param category: The kind of work, e.g. 'command', 'state' or 'cluster'.
+    :param label: Optional label, normally the cluster name.
+    :param attributes: Extra values stored with the span.
+    :return: The span, so the block can fill in the exit code, byte counts or status.
+    """
+    current = Span(next(_span_ids), _current_span_id.get(), name, category, label, time.time(),
+                   attributes=attributes)
+    token = _current_span_id.set(current.span_id)
+    start = time.monotonic()
+    try:
+        yield current
+    except SystemExit as e:
+        if e.code not in (0, None):
+            current.status = "failed"
+        raise
+    except BaseException as e:
+        current.status = "error"
+        current.attributes.setdefault("error", str(e) or type(e).__name__)
+        raise
+    finally:
+        current.duration = time.monotonic() - start
+        current.end = current.start + current.duration
+        _current_span_id.reset(token)
+        with _spans_lock:
+            _spans.append(current)
+
+
+def record_command_result(command_span: Span, result) -> None:
+    """
+    Copy the exit code and output sizes of a command result into its span.
+    :param command_span: The span of the command.
+    :param result: The CommandResult of the command.
+    :return: None
+    """
+    command_span.returncode = result.returncode
+    command_span.stdout_bytes = result.stdout_bytes
+    command_span.stderr_bytes = result.stderr_bytes
+    if result.timed_out:
+        command_span.status = "timeout"
+    elif result.returncode != 0:
+        command_span.status = "failed"
+
+
+def timed(name: str, category: str, label_arg: Optional[str] = None) -> Callable:
+    """
+    Decorate a function so every call is recorded as a span. A call returning False is marked as failed.
+    :param name: The name of the span.
+    :param category: The category of the span.
+    :param label_arg: The name of the argument used as the span label, e.g. 'target_cluster_name'.
+    :return: The decorator.
+    """
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            label = signature.bind_partial(*args, **kwargs).arguments.get(label_arg) if label_arg else None
+            with span(name, category, label) as call_span:
+                value = func(*args, **kwargs)
+                if value is False:
+                    call_span.status = "failed"
+                return value
+        return wrapper
+    return decorator
+
+
+def get_spans() -> List[Span]:
+    """
+    Get the spans recorded so far, in the order they finished.
+    :return: A copy of the recorded spans.
+    """
+    with _spans_lock:
+        return list(_spans)
+
+
+def summarize_spans(spans: List[Span]) -> List[Dict[str, Any]]:
+    """
+    Total the recorded time per phase.
+    :param spans: The spans to summarize.
+    :return: One entry per (category, name) with the count, total and maximum duration, slowest first.
+    """
+    totals: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for recorded in spans:
+        entry = totals.setdefault((recorded.category, recorded.name), {
+            "category": recorded.category, "name": recorded.name, "count": 0, "total": 0.0, "max": 0.0,
+        })
+        entry["count"] += 1
+        entry["total"] += recorded.duration or 0.0
+        entry["max"] = max(entry["max"], recorded.duration or 0.0)
+    return sorted(totals.values(), key=lambda entry: entry["total"], reverse=True)
+
+
+def write_run_report(run_name: str, report_dir: str = TIMING_REPORT_DIR) -> Optional[Tuple[str, str]]:
+    """
+    Write the JSON and CSV timing reports of the spans recorded in this process.
+    :param run_name: The name of the run, used in the report file names (e.g. 'bringup_cluster').
+    :param report_dir: The directory to write the reports to.
+    :return: The paths of the JSON and CSV reports, or None if reporting is disabled or nothing was recorded.
+    """
+    spans = sorted(get_spans(), key=lambda recorded: recorded.start)
+    if not TIMING_REPORT_ENABLED or not spans:
+        return None
+
+    os.makedirs(report_dir, exist_ok=True)
+    base_path = os.path.join(report_dir, f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{run_name}_timings")
+    json_path, csv_path = f"{base_path}.json", f"{base_path}.csv"
+
+    with open(json_path, 'w') as file:
+        json.dump({
+            "run": run_name,
+            "argv": sys.argv,
+            "pid": os.getpid(),
+            "start": spans[0].start,
+            "end": max(recorded.end or recorded.start for recorded in spans),
+            "summary": summarize_spans(spans),
+            "spans": [asdict(recorded) for recorded in spans],
+        }, file, indent=2)
+
+    write_spans_csv(spans, csv_path)
+    return json_path, csv_path
+
+
+def write_spans_csv(spans: List[Span], csv_path: str) -> None:
+    """
+    Write spans to a CSV file, one row per span.
+    :param spans: The spans to write.
+    :param csv_path: The CSV file to write.
+    :return: None
+    """
+    columns = [span_field.name for span_field in fields(Span)]
+    with open(csv_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=columns)
+        writer.writeheader()
+        for recorded in spans:
+            row = asdict(recorded)
+            row["attributes"] = json.dumps(recorded.attributes, sort_keys=True) if recorded.attributes else ""
+            writer.writerow(row)
+
+
+def log_timing_summary(spans: List[Span]) -> None:
+    """
+    Log the time spent per phase.
+    :param spans: The spans to summarize.
+    :return: None
+    """
+    summary = summarize_spans(spans)
+    if not summary:
+        return
+    width = max(len(f"{entry['category']}/{entry['name']}") for entry in summary)
+    log.info("Timing summary:")
+    log.info(f"  {'Phase':<{width}}  {'Count':>5}  {'Total':>9}  {'Max':>9}")
+    for entry in summary:
+        log.info(f"  {entry['category'] + '/' + entry['name']:<{width}}  {entry['count']:>5}  "
+                 f"{entry['total']:>8.1f}s  {entry['max']:>8.1f}s")
+
+
+@contextmanager
+def run_report(run_name: str) -> Iterator[Span]:
+    """
+    Time a whole CLI run and write its timing report when it ends, however it ends.
+    :param run_name: The name of the run, used in the report file names.
+    :return: The top-level span of the run.
+    """
+    try:
+        with log_context(run=run_name), span(run_name, "run") as run_span:
+            yield run_span
+    finally:
+        log_timing_summary(get_spans())
+        try:
+            paths = write_run_report(run_name)
+        except OSError as e:
+            log.warning(f"Unable to write the timing report: {e}")
+        else:
+            if paths:
+                log.info(f"Timing report saved to: {paths[0]} (CSV: {paths[1]})")
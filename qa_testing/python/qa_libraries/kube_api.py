@@ -0,0 +1,501 @@
+###########################################################
+#
+# Kubernetes API access of the QA checks.
+#
+# Instead of forking 'kubectl' (and 'jq') for every query,
+# each with its own TLS handshake and credential-plugin
+# call, the checks talk to the API server directly through
+# one KubeClient per kubeconfig context (see get_client):
+#
+#   connections  a pool of up to QA_KUBE_API_POOL_SIZE
+#                keep-alive HTTP/1.1 connections, reused by
+#                every request of the process
+#   concurrency  get_many() sends independent requests over
+#                the pooled connections at the same time
+#   selectors    label and field selectors are applied by
+#                the API server, so only matching objects
+#                are transferred
+#   pagination   lists are read in pages of
+#                QA_KUBE_API_PAGE_SIZE objects ('limit'/
+#                'continue') and yielded page by page, so a
+#                large cluster is never held in memory
+#
+# The kubeconfig is the one kubectl would use in the same
+# context (see read_cache.using_kubeconfig). Bearer tokens,
+# exec credential plugins (e.g. the per-cluster kubeconfig
+# of eks_auth) and client certificates are supported; an
+# exec token is kept until shortly before it expires.
+#
+
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import http.client
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import urllib.parse
+
+from qa_libraries.instrumentation import span
+from qa_libraries.lazy_imports import lazy_import
+from qa_libraries.logger import log
+from qa_libraries.read_cache import get_kubeconfig_paths
+
+yaml = lazy_import("yaml")
+
+KUBE_API_POOL_SIZE = int(os.getenv('QA_KUBE_API_POOL_SIZE', '8'))
+KUBE_API_PAGE_SIZE = int(os.getenv('QA_KUBE_API_PAGE_SIZE', '500'))
+KUBE_API_TIMEOUT = float(os.getenv('QA_KUBE_API_TIMEOUT', '30'))
+
+# Seconds before its expiration an exec credential is renewed
+EXEC_CREDENTIAL_MARGIN = 60
+EXEC_TIMEOUT = float(os.getenv('QA_KUBE_API_EXEC_TIMEOUT', '60'))
+
+USER_AGENT = "qa-testing-kube-api"
+
+# Errors of a reused keep-alive connection the server closed in the meantime
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError,
+                            BrokenPipeError)
+
+Selector = Union[str, Dict[str, str], None]
+
+
+class KubeApiError(RuntimeError):
+    """
+    A failed Kubernetes API request.
+    """
+
+    def __init__(self, message: str, status: int = 0, reason: str = ""):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+@dataclass
+class KubeConfig:
+    context: str
+    server: str
+    certificate_authority: Optional[str] = None
+    certificate_authority_data: Optional[str] = None
+    insecure_skip_tls_verify: bool = False
+    token: Optional[str] = None
+    token_file: Optional[str] = None
+    client_certificate: Optional[str] = None
+    client_certificate_data: Optional[str] = None
+    client_key: Optional[str] = None
+    client_key_data: Optional[str] = None
+    exec: Optional[Dict] = None
+    sources: List[str] = field(default_factory=list)
+
+
+def _resolve_file(path: Optional[str], kubeconfig_file: str) -> Optional[str]:
+    if not path or os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(kubeconfig_file)), path)
+
+
+def load_kubeconfig(paths: Optional[List[str]] = None, context: Optional[str] = None) -> KubeConfig:
+    """
+    Load a context of the kubeconfig files the way kubectl merges them (the first definition of a name wins).
+    :param paths: The kubeconfig files (default: those kubectl would read in this context).
+    :param context: The context (default: the current context).
+    :return: The server and credentials of the context.
+    """
+    paths = paths or get_kubeconfig_paths()
+    entries: Dict[str, Dict[str, Tuple[Dict, str]]] = {"clusters": {}, "users": {}, "contexts": {}}
+    current_context = ""
+    for path in paths:
+        try:
+            with open(path, 'r') as file:
+                document = yaml.safe_load(file) or {}
+        except FileNotFoundError:
+            continue
+        except (OSError, yaml.YAMLError) as e:
+            log.error(f"Unable to read the kubeconfig '{path}': {e}")
+            raise KubeApiError(f"Unable to read the kubeconfig '{path}': {e}") from e
+        current_context = current_context or document.get("current-context") or ""
+        for kind, named in entries.items():
+            for entry in document.get(kind) or []:
+                named.setdefault(entry.get("name"), (entry.get(kind[:-1]) or {}, path))
+
+    context = context or current_context
+    try:
+        context_entry, _ = entries["contexts"][context]
+        cluster, cluster_file = entries["clusters"][context_entry["cluster"]]
+        user, user_file = entries["users"].get(context_entry.get("user"), ({}, ""))
+        server = cluster["server"]
+    except KeyError as e:
+        log.error(f"The kubeconfig ({os.pathsep.join(paths)}) has no complete context '{context}': missing {e}")
+        raise KubeApiError(f"The kubeconfig has no complete context '{context}': missing {e}") from e
+
+    return KubeConfig(
+        context=context,
+        server=server.rstrip("/"),
+        certificate_authority=_resolve_file(cluster.get("certificate-authority"), cluster_file),
+        certificate_authority_data=cluster.get("certificate-authority-data"),
+        insecure_skip_tls_verify=bool(cluster.get("insecure-skip-tls-verify")),
+        token=user.get("token"),
+        token_file=_resolve_file(user.get("tokenFile"), user_file),
+        client_certificate=_resolve_file(user.get("client-certificate"), user_file),
+        client_certificate_data=user.get("client-certificate-data"),
+        client_key=_resolve_file(user.get("client-key"), user_file),
+        client_key_data=user.get("client-key-data"),
+        exec=user.get("exec"),
+        sources=list(paths))
+
+
+def _ssl_context(config: KubeConfig) -> ssl.SSLContext:
+    if config.certificate_authority_data:
+        context = ssl.create_default_context(cadata=base64.b64decode(config.certificate_authority_data).decode())
+    else:
+        context = ssl.create_default_context(cafile=config.certificate_authority)
+    if config.insecure_skip_tls_verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+    if config.client_certificate or config.client_certificate_data:
+        # load_cert_chain only reads files: embedded certificates go through a private temporary directory
+        temp_dir = tempfile.mkdtemp(prefix="qa-kube-api-")
+        try:
+            files = {}
+            for name, path, data in (("client.crt", config.client_certificate, config.client_certificate_data),
+                                     ("client.key", config.client_key, config.client_key_data)):
+                if data:
+                    path = os.path.join(temp_dir, name)
+                    with open(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600), 'wb') as file:
+                        file.write(base64.b64decode(data))
+                files[name] = path
+            context.load_cert_chain(files["client.crt"], files["client.key"])
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    return context
+
+
+class ConnectionPool:
+    """
+    A bounded pool of keep-alive HTTP(S) connections to one server, shared by threads.
+    """
+
+    def __init__(self, server: str, ssl_context: Optional[ssl.SSLContext] = None, size: int = KUBE_API_POOL_SIZE,
+                 timeout: float = KUBE_API_TIMEOUT):
+        parsed = urllib.parse.urlsplit(server)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            log.error(f"Unsupported Kubernetes API server URL '{server}'.")
+            raise KubeApiError(f"Unsupported Kubernetes API server URL '{server}'.")
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip("/")
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._ssl_context = ssl_context
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self.connections_opened = 0
+        self.requests_sent = 0
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        with self._lock:
+            self.connections_opened += 1
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self._ssl_context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _checkout(self) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._new_connection(), False
+
+    def _checkin(self, connection: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.append(connection)
+
+    def request(self, method: str, path: str, headers: Dict[str, str],
+                body: Optional[bytes] = None) -> Tuple[int, str, bytes]:
+        """
+        Send a request over a pooled connection and read its whole response.
+        :param method: The HTTP method.
+        :param path: The request path and query, relative to the server URL.
+        :param headers: The request headers.
+        :param body: The request body, if any.
+        :return: The response status, reason and body.
+        """
+        with self._slots:
+            connection, reused = self._checkout()
+            while True:
+                try:
+                    connection.request(method, self.base_path + path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    data = response.read()
+                    break
+                except _STALE_CONNECTION_ERRORS:
+                    connection.close()
+                    if not reused:
+                        raise
+                    # The server closed the idle connection: retry once on a new one
+                    connection, reused = self._new_connection(), False
+                except BaseException:
+                    connection.close()
+                    raise
+            with self._lock:
+                self.requests_sent += 1
+            if response.will_close:
+                connection.close()
+            else:
+                self._checkin(connection)
+            return response.status, response.reason, data
+
+    def close(self) -> None:
+        """
+        Close the idle connections.
+        :return: None
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+def _format_selector(selector: Selector) -> Optional[str]:
+    if isinstance(selector, dict):
+        return ",".join(f"{key}={value}" for key, value in selector.items())
+    return selector or None
+
+
+def api_path(resource: str, namespace: Optional[str] = None, name: Optional[str] = None, api_version: str = "v1",
+             subresource: Optional[str] = None) -> str:
+    """
+    :param resource: The plural resource, e.g. 'pods' or 'deployments'.
+    :param namespace: The namespace (default: all namespaces, or a cluster-scoped resource).
+    :param name: The object name (default: the collection).
+    :param api_version: 'v1' for the core API, otherwise '<group>/<version>', e.g. 'apps/v1'.
+    :param subresource: A subresource of the object, e.g. 'log'.
+    :return: The API path of the resource collection or object.
+    """
+    parts = ["api/v1" if api_version == "v1" else f"apis/{api_version}"]
+    if namespace:
+        parts += ["namespaces", urllib.parse.quote(namespace, safe="")]
+    parts.append(resource)
+    if name:
+        parts.append(urllib.parse.quote(name, safe=""))
+    if subresource:
+        parts.append(subresource)
+    return "/" + "/".join(parts)
+
+
+class KubeClient:
+    """
+    A Kubernetes API client for one kubeconfig context, over a pool of keep-alive connections.
+    """
+
+    def __init__(self, config: KubeConfig, pool_size: int = KUBE_API_POOL_SIZE, timeout: float = KUBE_API_TIMEOUT):
+        self.config = config
+        ssl_context = _ssl_context(config) if config.server.startswith("https:") else None
+        self.pool = ConnectionPool(config.server, ssl_context, pool_size, timeout)
+        self._token: Optional[str] = None
+        self._token_expiration = 0.0
+        self._token_lock = threading.Lock()
+
+    def __enter__(self) -> "KubeClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the pooled connections.
+        :return: None
+        """
+        self.pool.close()
+
+    def _run_exec_plugin(self) -> Tuple[str, float]:
+        plugin = self.config.exec
+        env = dict(os.environ, **{entry["name"]: entry["value"] for entry in plugin.get("env") or []})
+        env["KUBERNETES_EXEC_INFO"] = json.dumps({
+            "apiVersion": plugin.get("apiVersion"), "kind": "ExecCredential", "spec": {"interactive": False}})
+        command = [plugin["command"], *(plugin.get("args") or [])]
+        try:
+            completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       stdin=subprocess.DEVNULL, env=env, timeout=EXEC_TIMEOUT)
+            if completed.returncode != 0:
+                raise ValueError(completed.stderr.decode(errors='replace').strip())
+            status = json.loads(completed.stdout)["status"]
+            token = status["token"]
+        except (OSError, subprocess.TimeoutExpired, ValueError, KeyError) as e:
+            log.error(f"The credential plugin '{plugin['command']}' of context '{self.config.context}' failed: {e}")
+            raise KubeApiError(f"The credential plugin of context '{self.config.context}' failed: {e}") from e
+
+        expiration = time.time() + EXEC_CREDENTIAL_MARGIN
+        if status.get("expirationTimestamp"):
+            expires = datetime.strptime(status["expirationTimestamp"], "%Y-%m-%dT%H:%M:%SZ")
+            expiration = expires.replace(tzinfo=timezone.utc).timestamp()
+        return token, expiration
+
+    def _bearer_token(self, renew: bool = False) -> Optional[str]:
+        if self.config.token:
+            return self.config.token
+        if self.config.token_file:
+            with open(self.config.token_file, 'r') as file:
+                return file.read().strip()
+        if not self.config.exec:
+            return None
+        with self._token_lock:
+            if renew or not self._token or self._token_expiration - EXEC_CREDENTIAL_MARGIN <= time.time():
+                self._token, self._token_expiration = self._run_exec_plugin()
+            return self._token
+
+    def request(self, method: str, path: str, query: Optional[Dict[str, Union[str, int, None]]] = None,
+                body: Optional[Dict] = None) -> bytes:
+        """
+        Send an API request.
+        :param method: The HTTP method.
+        :param path: The API path, e.g. from api_path().
+        :param query: The query parameters; None values are left out.
+        :param body: A JSON body, if any.
+        :return: The response body.
+        """
+        query = {key: value for key, value in (query or {}).items() if value is not None}
+        target = f"{path}?{urllib.parse.urlencode(query)}" if query else path
+        data = json.dumps(body).encode() if body is not None else None
+        with span("request", "kube_api", method=method, path=target) as request_span:
+            for renew in (False, True):
+                headers = {"Accept": "application/json", "User-Agent": USER_AGENT}
+                if data is not None:
+                    headers["Content-Type"] = "application/json"
+                token = self._bearer_token(renew)
+                if token:
+                    headers["Authorization"] = f"Bearer {token}"
+                try:
+                    status, reason, response = self.pool.request(method, target, headers, data)
+                except (OSError, http.client.HTTPException) as e:
+                    log.error(f"Kubernetes API request '{method} {target}' to {self.config.server} failed: {e}")
+                    raise KubeApiError(f"Kubernetes API request '{method} {target}' failed: {e}") from e
+                # An expired exec credential is renewed once, like kubectl does
+                if status == 401 and self.config.exec and not renew:
+                    continue
+                break
+            request_span.attributes["status"] = status
+            request_span.attributes["bytes"] = len(response)
+
+        if status >= 400:
+            try:
+                message = json.loads(response).get("message") or reason
+            except ValueError:
+                message = response.decode(errors='replace').strip() or reason
+            log.debug(f"Kubernetes API request '{method} {target}' returned {status}: {message}")
+            raise KubeApiError(f"{method} {target}: {status} {message}", status, reason)
+        return response
+
+    def get(self, path: str, **query) -> Dict:
+        """
+        :param path: The API path of an object or collection.
+        :param query: The query parameters.
+        :return: The decoded JSON response.
+        """
+        return json.loads(self.request("GET", path, query))
+
+    def get_many(self, paths: Iterable[str], jobs: Optional[int] = None) -> List[Union[Dict, KubeApiError]]:
+        """
+        GET several objects at the same time over the pooled connections.
+        :param paths: The API paths.
+        :param jobs: The number of requests in flight (default: the pool size).
+        :return: The decoded response of each path, in order, or the KubeApiError it failed with.
+        """
+        def get_one(path: str) -> Union[Dict, KubeApiError]:
+            try:
+                return self.get(path)
+            except KubeApiError as e:
+                return e
+
+        paths = list(paths)
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs or self.pool.size, len(paths) or 1))) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, get_one, path) for path in paths]
+            return [future.result() for future in futures]
+
+    def list_pages(self, path: str, label_selector: Selector = None, field_selector: Selector = None,
+                   limit: int = KUBE_API_PAGE_SIZE) -> Iterator[List[Dict]]:
+        """
+        List a collection page by page, with the selectors applied by the API server.
+        :param path: The API path of the collection, e.g. api_path('pods').
+        :param label_selector: A label selector, e.g. 'k8s-app=kube-dns' or {'k8s-app': 'kube-dns'}.
+        :param field_selector: A field selector, e.g. 'status.phase!=Running'.
+        :param limit: The maximum number of objects per page.
+        :return: The objects of each page.
+        """
+        query = {"labelSelector": _format_selector(label_selector),
+                 "fieldSelector": _format_selector(field_selector),
+                 "limit": limit if limit > 0 else None}
+        pages = 0
+        while True:
+            listing = self.get(path, **query)
+            pages += 1
+            yield listing.get("items") or []
+            query["continue"] = (listing.get("metadata") or {}).get("continue")
+            if not query["continue"]:
+                break
+        log.debug(f"Listed '{path}' in {pages} page(s).")
+
+    def list_items(self, path: str, label_selector: Selector = None, field_selector: Selector = None,
+                   limit: int = KUBE_API_PAGE_SIZE) -> Iterator[Dict]:
+        """
+        List a collection object by object; see list_pages.
+        :return: The objects of the collection.
+        """
+        for page in self.list_pages(path, label_selector, field_selector, limit):
+            yield from page
+
+    def pod_logs(self, namespace: str, name: str, container: Optional[str] = None,
+                 tail_lines: Optional[int] = None) -> str:
+        """
+        :param namespace: The namespace of the pod.
+        :param name: The name of the pod.
+        :param container: The container (default: the pod's only or default container).
+        :param tail_lines: Only the last lines of the log.
+        :return: The log of the pod.
+        """
+        return self.request("GET", api_path("pods", namespace, name, subresource="log"),
+                            {"container": container, "tailLines": tail_lines}).decode(errors='replace')
+
+
+_clients: Dict[Tuple[Tuple[str, ...], str], KubeClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(kubeconfig: Optional[str] = None, context: Optional[str] = None) -> KubeClient:
+    """
+    Get the shared client of a kubeconfig context, so every check of the process reuses one connection pool.
+    :param kubeconfig: The kubeconfig file(s), separated like $KUBECONFIG (default: those kubectl would read
+                       in this context, see read_cache.using_kubeconfig).
+    :param context: The context (default: the current context).
+    :return: The client.
+    """
+    paths = kubeconfig.split(os.pathsep) if kubeconfig else get_kubeconfig_paths()
+    key = (tuple(paths), context or "")
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = KubeClient(load_kubeconfig(paths, context))
+        return client
+
+
+def close_clients() -> None:
+    """
+    Close the connections of every shared client.
+    :return: None
+    """
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
@@ -0,0 +1,392 @@
+###########################################################
+#
+# Cluster checks over the Kubernetes API (see kube_api).
+#
+# Each check makes a few selector-filtered list calls on the
+# shared connection pool instead of one 'kubectl' process
+# per object, and returns a CheckReport with the PASS/FAIL
+# lines of the corresponding shell smoketest:
+#
+#   check_cluster_health.sh    -> check_cluster_health()
+#   check_coredns.sh           -> check_coredns()
+#   (per-pod status loop)      -> check_pods_running()
+#
+# check_cluster_health() streams: each resource type is
+# listed page by page and every object is evaluated as its
+# page arrives, so only one page per resource type is held
+# at a time, whatever the size of the cluster. Its
+# predicates reproduce the jq filters of the script,
+# including how jq orders null against numbers. Where the
+# script would pass a resource type 'kubectl get' failed
+# on, it fails with 'FAIL: Unable to list the <type>'.
+#
+# The checks are also a Robot Framework library:
+#
+#   Library    qa_libraries.kube_checks.KubeChecks
+#
+# (run_qa_robot.sh puts qa_testing/python on the Robot
+# path).
+#
+
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from dataclasses import dataclass, field
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from qa_libraries.kube_api import KUBE_API_PAGE_SIZE, KubeApiError, KubeClient, Selector, api_path, get_client
+from qa_libraries.logger import log
+
+# Pattern of an error line in the CoreDNS logs, as in check_coredns.sh
+COREDNS_LOG_ERROR_PATTERN = re.compile("error|fail|crash|timeout", re.IGNORECASE)
+COREDNS_LABEL_SELECTOR = "k8s-app=kube-dns"
+COREDNS_LOG_TAIL = 100
+
+# Attempts at listing a resource type whose continue token expired (410) mid-way
+HEALTH_LIST_ATTEMPTS = 3
+
+
+@dataclass
+class CheckReport:
+    name: str
+    passed: bool = True
+    lines: List[str] = field(default_factory=list)
+
+    def info(self, message: str) -> None:
+        self.lines.append(message)
+
+    def fail(self, message: str) -> None:
+        self.passed = False
+        self.lines.append(f"FAIL: {message}")
+
+
+def get_pod_phases(client: KubeClient, namespace: Optional[str] = None, name_pattern: Optional[str] = None,
+                   label_selector: Selector = None, field_selector: Selector = None) -> Dict[str, str]:
+    """
+    Get the phase of pods with a single (paginated) list call.
+    :param client: The API client.
+    :param namespace: The namespace (default: all namespaces, with pods named '<namespace>/<name>').
+    :param name_pattern: A regular expression the pod names must match from their start, as in KubeLibrary.
+    :param label_selector: A label selector applied by the API server.
+    :param field_selector: A field selector applied by the API server.
+    :return: The phase of each matching pod.
+    """
+    pattern = re.compile(name_pattern) if name_pattern else None
+    phases = {}
+    for pod in client.list_items(api_path("pods", namespace), label_selector, field_selector):
+        metadata = pod["metadata"]
+        if pattern is None or pattern.match(metadata["name"]):
+            name = metadata["name"] if namespace else f"{metadata['namespace']}/{metadata['name']}"
+            phases[name] = (pod.get("status") or {}).get("phase", "Unknown")
+    return phases
+
+
+def check_pods_running(client: KubeClient, namespace: str, name_pattern: Optional[str] = None,
+                       label_selector: Selector = None) -> CheckReport:
+    """
+    Check that pods exist and are all Running.
+    :param client: The API client.
+    :param namespace: The namespace of the pods.
+    :param name_pattern: A regular expression the pod names must match from their start.
+    :param label_selector: A label selector applied by the API server.
+    :return: The report of the check.
+    """
+    report = CheckReport("pods_running")
+    description = f"pods matching '{name_pattern or '.*'}'" + (f" ({label_selector})" if label_selector else "")
+    report.info(f"Testcase: Verify that the {description} in namespace '{namespace}' are running")
+    phases = get_pod_phases(client, namespace, name_pattern, label_selector)
+    if not phases:
+        report.fail(f"No {description} found in namespace '{namespace}'.")
+        return report
+    for name, phase in sorted(phases.items()):
+        if phase != "Running":
+            report.fail(f"Pod '{name}' is not in Running state. Current state: {phase}.")
+    if report.passed:
+        report.info(f"PASS: All {len(phases)} {description} are running.")
+    return report
+
+
+def check_coredns(client: KubeClient) -> CheckReport:
+    """
+    Verify the health of CoreDNS, like check_coredns.sh: pods, pod logs, service and endpoints.
+    :param client: The API client.
+    :return: The report of the check.
+    """
+    report = CheckReport("coredns")
+    report.info("Testcase: CoreDNS addon: Verify health and functionality")
+
+    report.info("Checking CoreDNS pod status...")
+    phases = get_pod_phases(client, "kube-system", label_selector=COREDNS_LABEL_SELECTOR)
+    if not phases:
+        report.fail("No CoreDNS pods found.")
+        report.fail("CoreDNS is not running correctly.")
+        return report
+    for name, phase in sorted(phases.items()):
+        if phase != "Running":
+            report.fail(f"CoreDNS pod '{name}' is not in Running state. Current state: {phase}.")
+
+    report.info("Checking CoreDNS pod logs for errors...")
+    for name in sorted(phases):
+        try:
+            pod_log = client.pod_logs("kube-system", name, tail_lines=COREDNS_LOG_TAIL)
+        except KubeApiError as e:
+            log.debug(f"Unable to read the log of CoreDNS pod '{name}': {e}")
+            continue
+        if COREDNS_LOG_ERROR_PATTERN.search(pod_log):
+            report.fail("Errors found in CoreDNS pod logs.")
+            break
+
+    # The service and its endpoints are independent reads: fetch both at once
+    report.info("Checking CoreDNS service availability...")
+    service, endpoints = client.get_many([api_path("services", "kube-system", "kube-dns"),
+                                          api_path("endpoints", "kube-system", "kube-dns")])
+    if isinstance(service, KubeApiError) or not (service.get("spec") or {}).get("clusterIP"):
+        report.fail("CoreDNS service is not available or has no cluster IP.")
+
+    report.info("Checking CoreDNS endpoints...")
+    addresses = [] if isinstance(endpoints, KubeApiError) else \
+        [address for subset in endpoints.get("subsets") or [] for address in subset.get("addresses") or []]
+    if not addresses:
+        report.fail("CoreDNS endpoints are not correctly populated.")
+
+    report.info("PASS: CoreDNS is running correctly." if report.passed else "FAIL: CoreDNS is not running correctly.")
+    return report
+
+
+class _JqError(ValueError):
+    """
+    An object a jq filter of check_cluster_health.sh fails on, which ends the evaluation of its resource type.
+    """
+
+
+def _jq_get(obj: Any, path: str) -> Any:
+    for key in path.split("."):
+        obj = obj.get(key) if isinstance(obj, dict) else None
+    return obj
+
+
+def _jq_sort_key(value: Any) -> Tuple:
+    # jq orders null < false < true < numbers < strings < arrays < objects
+    if value is None:
+        return 0,
+    if isinstance(value, bool):
+        return 1 + value,
+    if isinstance(value, (int, float)):
+        return 3, value
+    if isinstance(value, str):
+        return 4, value
+    if isinstance(value, list):
+        return 5, [_jq_sort_key(item) for item in value]
+    return 6, sorted(value), [_jq_sort_key(value[key]) for key in sorted(value)]
+
+
+def _jq_less(left: Any, right: Any) -> bool:
+    return _jq_sort_key(left) < _jq_sort_key(right)
+
+
+def _tsv_field(value: Any) -> str:
+    # jq's @tsv, as printed by the script's 'echo -e' (which undoes the @tsv escapes)
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _below(actual: str, expected: str) -> Callable[[Dict], List[List[Any]]]:
+    def rows(obj: Dict) -> List[List[Any]]:
+        if not _jq_less(_jq_get(obj, actual), _jq_get(obj, expected)):
+            return []
+        return [[_jq_get(obj, "metadata.namespace"), _jq_get(obj, "metadata.name"), _jq_get(obj, actual),
+                 _jq_get(obj, expected)]]
+    return rows
+
+
+def _pod_rows(obj: Dict) -> List[List[Any]]:
+    phase = _jq_get(obj, "status.phase")
+    return [] if phase == "Running" else [[_jq_get(obj, "metadata.namespace"), _jq_get(obj, "metadata.name"), phase]]
+
+
+def _node_rows(obj: Dict) -> List[List[Any]]:
+    conditions = _jq_get(obj, "status.conditions")
+    if isinstance(conditions, dict):
+        conditions = list(conditions.values())
+    if not isinstance(conditions, list):
+        raise _JqError(f"Cannot iterate over {'null' if conditions is None else type(conditions).__name__}")
+    # One row per matching condition, as jq's select emits the node once per match
+    return [[_jq_get(obj, "metadata.name")] for condition in conditions
+            if isinstance(condition, dict) and condition.get("type") == "Ready" and condition.get("status") != "True"]
+
+
+def _namespace_rows(obj: Dict) -> List[List[Any]]:
+    phase = _jq_get(obj, "status.phase")
+    return [] if phase == "Active" else [[_jq_get(obj, "metadata.name"), phase]]
+
+
+@dataclass(frozen=True)
+class HealthPredicate:
+    # The resource type, as named by check_cluster_health.sh
+    resource_type: str
+    path: str
+    failure: str
+    rows: Callable[[Dict], List[List[Any]]]
+    # A server-side filter that drops only objects the predicate passes
+    field_selector: Optional[str] = None
+
+
+HEALTH_PREDICATES = (
+    HealthPredicate("pods", api_path("pods"), "Some pods are not running", _pod_rows,
+                    field_selector="status.phase!=Running"),
+    HealthPredicate("deployments", api_path("deployments", api_version="apps/v1"),
+                    "Some deployments have unavailable replicas",
+                    _below("status.availableReplicas", "status.replicas")),
+    HealthPredicate("statefulsets", api_path("statefulsets", api_version="apps/v1"),
+                    "Some statefulsets have unavailable replicas",
+                    _below("status.readyReplicas", "status.replicas")),
+    HealthPredicate("daemonsets", api_path("daemonsets", api_version="apps/v1"),
+                    "Some daemonsets have unavailable replicas",
+                    _below("status.numberAvailable", "status.desiredNumberScheduled")),
+    HealthPredicate("jobs", api_path("jobs", api_version="batch/v1"), "Some jobs are not completed",
+                    _below("status.succeeded", "spec.completions")),
+    HealthPredicate("hpa", api_path("horizontalpodautoscalers", api_version="autoscaling/v2"),
+                    "Some HPAs do not have desired replicas",
+                    _below("status.currentReplicas", "status.desiredReplicas")),
+    HealthPredicate("nodes", api_path("nodes"), "Some nodes are not in Ready state", _node_rows),
+    HealthPredicate("namespaces", api_path("namespaces"), "Some namespaces are not active", _namespace_rows,
+                    field_selector="status.phase!=Active"),
+)
+
+
+@dataclass
+class ResourceHealth:
+    resource_type: str
+    rows: List[List[Any]] = field(default_factory=list)
+    objects: int = 0
+    pages: int = 0
+    # Why the resource type could not be listed, if it could not
+    error: Optional[str] = None
+
+
+def evaluate_resource_health(client: KubeClient, predicate: HealthPredicate,
+                             page_size: int = KUBE_API_PAGE_SIZE) -> ResourceHealth:
+    """
+    Stream a resource type page by page and collect the rows of its unhealthy objects.
+    :param client: The API client.
+    :param predicate: The health predicate of the resource type.
+    :param page_size: The number of objects per page.
+    :return: The unhealthy rows and the number of objects and pages read, or the error listing them.
+    """
+    for attempt in range(1, HEALTH_LIST_ATTEMPTS + 1):
+        health = ResourceHealth(predicate.resource_type)
+        try:
+            for page in client.list_pages(predicate.path, field_selector=predicate.field_selector, limit=page_size):
+                health.pages += 1
+                for obj in page:
+                    health.objects += 1
+                    health.rows.extend(predicate.rows(obj))
+            return health
+        except _JqError as e:
+            # jq stops at the first object it fails on, keeping the rows printed so far
+            log.error(f"Unable to evaluate the {predicate.resource_type}: {e}")
+            return health
+        except KubeApiError as e:
+            if e.status == 410 and attempt < HEALTH_LIST_ATTEMPTS:
+                log.debug(f"The list of {predicate.resource_type} changed while paging; listing it again.")
+                continue
+            # Unlike the script, where a failed 'kubectl get' leaves jq nothing to report and the resource
+            # type passes: an unreachable API or rejected credentials must not read as a healthy cluster
+            log.error(f"Unable to list the {predicate.resource_type}: {e}")
+            return ResourceHealth(predicate.resource_type, error=str(e))
+    return ResourceHealth(predicate.resource_type, error="the list changed on every attempt")
+
+
+def check_cluster_health(client: KubeClient, page_size: int = KUBE_API_PAGE_SIZE,
+                         jobs: Optional[int] = None) -> CheckReport:
+    """
+    Check the health of the pods, deployments, statefulsets, daemonsets, jobs, HPAs, nodes and namespaces, with
+    the same PASS/FAIL lines as check_cluster_health.sh.
+    :param client: The API client.
+    :param page_size: The number of objects per page.
+    :param jobs: The number of resource types streamed at the same time (default: the connection pool size).
+    :return: The report of the check.
+    """
+    report = CheckReport("cluster_health")
+    report.info("Testcase name: Verify if all resources are running healthy?")
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs or client.pool.size, len(HEALTH_PREDICATES)))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, evaluate_resource_health, client, predicate,
+                                   page_size)
+                   for predicate in HEALTH_PREDICATES]
+        for predicate, future in zip(HEALTH_PREDICATES, futures):
+            health = future.result()
+            log.debug(f"Evaluated {health.objects} {health.resource_type} in {health.pages} page(s).")
+            if health.error:
+                report.fail(f"Unable to list the {predicate.resource_type}: {health.error}")
+            elif health.rows:
+                report.fail(f"{predicate.failure}:")
+                for row in health.rows:
+                    report.info("\t".join(_tsv_field(value) for value in row))
+            else:
+                report.info(f"PASS: All {predicate.resource_type} resources are healthy.")
+    return report
+
+
+# Smoketest scripts the runner replaces with these checks (see smoketest_runner.py)
+API_CHECKS: Dict[str, Callable[[KubeClient], CheckReport]] = {
+    "check_cluster_health.sh": check_cluster_health,
+}
+
+
+class KubeChecks:
+    """
+    Robot Framework keywords of the Kubernetes API checks, sharing one connection pool.
+    """
+
+    ROBOT_LIBRARY_SCOPE = "GLOBAL"
+
+    def __init__(self, kubeconfig: Optional[str] = None, context: Optional[str] = None):
+        """
+        :param kubeconfig: The kubeconfig file(s) (default: those kubectl would use; 'None' like KubeLibrary).
+        :param context: The kubeconfig context (default: the current context).
+        """
+        self._kubeconfig = None if kubeconfig in (None, "None") else kubeconfig
+        self._context = None if context in (None, "None") else context
+
+    @property
+    def client(self) -> KubeClient:
+        return get_client(self._kubeconfig, self._context)
+
+    @staticmethod
+    def _assert_passed(report: CheckReport) -> None:
+        if not report.passed:
+            raise AssertionError("\n".join(report.lines))
+        for line in report.lines:
+            log.info(line)
+
+    def get_pod_phases_in_namespace(self, name_pattern: str, namespace: str,
+                                    label_selector: Optional[str] = None) -> Dict[str, str]:
+        """
+        Get the phase of every pod matching ``name_pattern`` in ``namespace`` with one API call.
+        """
+        return get_pod_phases(self.client, namespace, name_pattern, label_selector)
+
+    def pods_in_namespace_should_be_running(self, name_pattern: str, namespace: str,
+                                            label_selector: Optional[str] = None) -> None:
+        """
+        Fail unless at least one pod matches ``name_pattern`` in ``namespace`` and all of them are Running.
+        """
+        self._assert_passed(check_pods_running(self.client, namespace, name_pattern, label_selector))
+
+    def coredns_should_be_healthy(self) -> None:
+        """
+        Fail unless the CoreDNS pods, logs, service and endpoints pass the checks of check_coredns.sh.
+        """
+        self._assert_passed(check_coredns(self.client))
+
+    def cluster_should_be_healthy(self) -> None:
+        """
+        Fail unless the pods, deployments, statefulsets, daemonsets, jobs, HPAs, nodes and namespaces pass the
+        checks of check_cluster_health.sh.
+        """
+        self._assert_passed(check_cluster_health(self.client))
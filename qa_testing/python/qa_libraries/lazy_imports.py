@@ -0,0 +1,62 @@
+###########################################################
+#
+# Lazy imports for the QA CLI entry points.
+#
+# Heavy third-party modules that only some code paths need
+# (GitPython, pkg_resources, ...) are bound to a LazyModule
+# at import time and only imported on first attribute
+# access, so a CLI run that never touches them does not pay
+# for their import:
+#
+#   git = lazy_import("git")
+#   ...
+#   repo = git.Repo(path)   # GitPython is imported here
+#
+
+import importlib
+import threading
+from types import ModuleType
+from typing import Optional
+
+from qa_libraries.logger import log
+
+
+class LazyModule:
+    """
+    A stand-in for a module that is imported on first attribute access.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module: Optional[ModuleType] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> ModuleType:
+        with self._lock:
+            if self._module is None:
+                try:
+                    self._module = importlib.import_module(self._name)
+                except ModuleNotFoundError as e:
+                    log.error(f"Missing required Python package '{self._name}'. Please review the "
+                              f"'Python Script Dependencies' in qa_testing/python/requirements.txt.")
+                    raise ModuleNotFoundError(f"Missing required Python package '{self._name}'.") from e
+            return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self) -> str:
+        return f"<lazy module '{self._name}' ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """
+    Bind a module without importing it yet.
+    :param name: The module name, e.g. 'git'.
+    :return: A stand-in that imports the module on first attribute access.
+    """
+    return LazyModule(name)
@@ -1,5 +1,221 @@
-import os
+###########################################################
+#
+# Logging backend of the QA tools.
+#
+# Records are handed to a QueueHandler on the root logger and
+# written by a background QueueListener thread, so a slow
+# console never blocks the callers (e.g. the pipe readers of
+# 'terraform apply'). The listener writes to:
+#
+#   the console     every record, or in summary mode
+#                   (QA_LOG_CONSOLE=summary) with repeated
+#                   terraform progress lines ('Still
+#                   creating...', 'Refreshing state...')
+#                   collapsed to one line per cluster every
+#                   QA_LOG_SUMMARY_INTERVAL seconds
+#   a JSON-lines    <repo-root>/qa_testing/logs/qa_run.jsonl,
+#   file            rotated by size, one object per record with
+#                   the run id and the context fields set with
+#                   log_context() (e.g. the cluster name)
+#
+# Call drain_logs() before prompting the user, so the records
+# logged before the prompt are written out ahead of it. Set
+# QA_LOG_ASYNC=0 to write from the calling thread instead.
+#
+
+import atexit
+from contextlib import contextmanager
+import contextvars
+from datetime import datetime
+import json
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from qa_libraries.qa_paths import QA_LOG_DIR
+
+LOG_FORMAT = '%(asctime)s\t[%(levelname)s] -- %(message)s'
+
+LOG_ASYNC = os.getenv('QA_LOG_ASYNC', '1') != '0'
+CONSOLE_MODE = os.getenv('QA_LOG_CONSOLE', 'full').lower()
+SUMMARY_INTERVAL = float(os.getenv('QA_LOG_SUMMARY_INTERVAL', '10'))
+
+# JSON-lines log; an empty value disables it
+JSON_LOG_FILE = os.getenv('QA_LOG_JSON_FILE', os.path.join(QA_LOG_DIR, "qa_run.jsonl"))
+JSON_LOG_MAX_BYTES = int(os.getenv('QA_LOG_JSON_MAX_BYTES', str(20 * 1024 * 1024)))
+JSON_LOG_BACKUP_COUNT = int(os.getenv('QA_LOG_JSON_BACKUP_COUNT', '5'))
+
+RUN_ID = os.getenv('QA_RUN_ID') or f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+
+# Terraform progress lines, collapsed in the console summary mode
+TERRAFORM_PROGRESS_PATTERN = re.compile(
+    r': (Still [a-z]+\.\.\. \[|Refreshing state\.\.\.|Reading\.\.\.|Read complete after|'
+    r'(Creating|Modifying|Destroying)\.\.\.)')
+
+_log_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar('qa_log_context', default={})
+
+_listeners: List[QueueListener] = []
+
+# Attributes of every LogRecord, everything else on a record was passed with 'extra'
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+@contextmanager
+def log_context(**fields) -> Iterator[None]:
+    """
+    Add fields (e.g. cluster=<name>) to the JSON log records logged in this block, including
+    the records of the asyncio tasks and worker threads started with a copy of the context.
+    :param fields: The context fields.
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Attaches the run id and the current log context to each record, in the thread that logged it.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.qa_run_id = RUN_ID
+        record.qa_context = _log_context.get()
+        return True
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "logger": record.name,
+            "thread": record.threadName,
+            "run_id": getattr(record, 'qa_run_id', RUN_ID),
+            **getattr(record, 'qa_context', {}),
+        }
+        entry.update({key: value for key, value in vars(record).items()
+                      if key not in _RECORD_ATTRIBUTES and not key.startswith('qa_')})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ConsoleSummaryFilter(logging.Filter):
+    """
+    Collapses terraform progress lines: at most one per label every interval seconds,
+    followed by the number of progress lines it stands for.
+    """
+
+    def __init__(self, interval: float = SUMMARY_INTERVAL):
+        super().__init__()
+        self.interval = interval
+        self._last_shown: Dict[str, float] = {}
+        self._suppressed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'command_output', None) or \
+                not TERRAFORM_PROGRESS_PATTERN.search(record.getMessage()):
+            return True
+        key = getattr(record, 'label', None) or ""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_shown.get(key, float('-inf')) < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return False
+            self._last_shown[key] = now
+            suppressed = self._suppressed.pop(key, 0)
+        if suppressed:
+            record.msg = f"{record.getMessage()} (+{suppressed} progress lines)"
+            record.args = None
+        return True
+
+
+def _make_json_handler() -> Optional[logging.Handler]:
+    if not JSON_LOG_FILE:
+        return None
+    try:
+        os.makedirs(os.path.dirname(JSON_LOG_FILE), exist_ok=True)
+        handler = RotatingFileHandler(JSON_LOG_FILE, maxBytes=JSON_LOG_MAX_BYTES, backupCount=JSON_LOG_BACKUP_COUNT,
+                                      encoding='utf-8', delay=True)
+    except OSError as e:
+        sys.stderr.write(f"Unable to open the JSON log file '{JSON_LOG_FILE}': {e}\n")
+        return None
+    handler.setFormatter(JsonLinesFormatter())
+    return handler
+
+
+class _DrainableQueueListener(QueueListener):
+    """
+    A QueueListener that sets the threading.Event markers put on its queue once the records before them are written.
+    """
+
+    def handle(self, record) -> None:
+        if isinstance(record, threading.Event):
+            record.set()
+            return
+        super().handle(record)
+
+
+def make_async(logger: logging.Logger, *handlers: logging.Handler) -> None:
+    """
+    Attach handlers to a logger, written by a background thread unless QA_LOG_ASYNC=0.
+    :param logger: The logger.
+    :param handlers: The handlers to write the records of the logger.
+    :return: None
+    """
+    if not LOG_ASYNC:
+        for handler in handlers:
+            logger.addHandler(handler)
+        return
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = QueueHandler(records)
+    queue_handler.addFilter(ContextFilter())
+    logger.addHandler(queue_handler)
+    listener = _DrainableQueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+
+def drain_logs(timeout: float = 5.0) -> None:
+    """
+    Wait until the background writers wrote every record queued so far, keeping them running
+    (e.g. before an input() prompt, so a warning logged just before it is not printed inside it).
+    :param timeout: Seconds to wait for each writer.
+    :return: None
+    """
+    for listener in list(_listeners):
+        written = threading.Event()
+        listener.queue.put_nowait(written)
+        written.wait(timeout)
+
+
+def flush_logs() -> None:
+    """
+    Write out every queued record and stop the background writers (runs at exit).
+    :return: None
+    """
+    while _listeners:
+        _listeners.pop().stop()
+
+
+atexit.register(flush_logs)
 
 # Create a logger object
 log = logging.getLogger()
@@ -8,11 +224,19 @@ log = logging.getLogger()
 console_handler = logging.StreamHandler()
 
 # Define the format for the logs
-format_string = '%(asctime)s\t[%(levelname)s] -- %(message)s'
+format_string = LOG_FORMAT
 console_handler.setFormatter(logging.Formatter(format_string))
+if CONSOLE_MODE == 'summary':
+    console_handler.addFilter(ConsoleSummaryFilter())
 
-# Add the console handler to the logger
-log.addHandler(console_handler)
+# Add the JSON-lines and console handlers to the logger (JSON first: it keeps every progress line
+# as is, before the console summary filter collapses them)
+handlers = [handler for handler in (_make_json_handler(), console_handler) if handler]
+if not LOG_ASYNC:
+    # Without the queue, the context is attached by the handlers themselves
+    for handler in handlers:
+        handler.addFilter(ContextFilter())
+make_async(log, *handlers)
 
 # Set the logging level based on an environment variable
 log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
@@ -24,4 +248,4 @@ log.setLevel(
         'ERROR': logging.ERROR,
         'CRITICAL': logging.CRITICAL,
     }.get(log_level, logging.INFO)
-)
\ No newline at end of file
+)
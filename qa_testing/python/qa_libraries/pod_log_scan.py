@@ -0,0 +1,237 @@
+###########################################################
+#
+# Concurrent pod-log scanning for the log smoketests.
+#
+# Pod logs are fetched by a bounded pool of 'kubectl logs'
+# processes. Each log is matched line by line with a
+# compiled pattern while it streams in, and the process is
+# stopped as soon as the pod has a verdict (e.g. the first
+# line of a log that only has to be non-empty), so large
+# logs are never read in full.
+#
+# The checks reproduce the output of the shell smoketests:
+#
+#   check_pods_triggering_errors.sh   -> check_pods_triggering_errors()
+#   check_pods_withno_activelogs.sh   -> check_pods_without_logs()
+#
+# and add per-namespace aggregates.
+#
+
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from dataclasses import dataclass, field
+import json
+import os
+import re
+import subprocess
+import threading
+from typing import Callable, Dict, List, Optional, Pattern
+
+from qa_libraries.instrumentation import span
+from qa_libraries.logger import log
+from qa_libraries.read_cache import KUBE_READ_TTL, cached_read, kube_env, kube_scope
+
+DEFAULT_JOBS = int(os.getenv('QA_LOG_SCAN_JOBS', '16'))
+POD_LOG_TIMEOUT = float(os.getenv('QA_LOG_SCAN_TIMEOUT', '60'))
+
+ERROR_PATTERN = re.compile("error", re.IGNORECASE)
+
+# Container states of the pods check_pods_withno_activelogs.sh inspects
+PROBLEM_WAITING_REASONS = ("CrashLoopBackOff",)
+PROBLEM_TERMINATED_REASONS = ("Error",)
+
+
+@dataclass
+class PodLogScan:
+    namespace: str
+    name: str
+    lines_read: int = 0
+    matches: List[str] = field(default_factory=list)
+    stopped_early: bool = False
+    timed_out: bool = False
+
+
+@dataclass
+class LogScanReport:
+    passed: bool
+    lines: List[str]
+    scans: List[PodLogScan]
+    failed_pods: List[PodLogScan]
+
+    def namespace_aggregates(self) -> Dict[str, Dict[str, int]]:
+        """
+        :return: Per namespace: the number of pods scanned, failed pods, log lines read and early stops.
+        """
+        failed = {(scan.namespace, scan.name) for scan in self.failed_pods}
+        aggregates: Dict[str, Dict[str, int]] = {}
+        for scan in self.scans:
+            entry = aggregates.setdefault(scan.namespace, {"pods": 0, "failed": 0, "lines_read": 0, "stopped_early": 0})
+            entry["pods"] += 1
+            entry["failed"] += (scan.namespace, scan.name) in failed
+            entry["lines_read"] += scan.lines_read
+            entry["stopped_early"] += scan.stopped_early
+        return dict(sorted(aggregates.items()))
+
+
+def load_pods(snapshot_dir: Optional[str] = None) -> List[Dict]:
+    """
+    Get all pods of the cluster.
+    :param snapshot_dir: A resource snapshot directory (see smoketest_runner) to read the pods from, if available.
+    :return: The pod objects.
+    """
+    snapshot_file = os.path.join(snapshot_dir, "pods.json") if snapshot_dir else None
+    if snapshot_file and os.path.exists(snapshot_file):
+        with open(snapshot_file, 'r') as file:
+            return json.load(file).get("items", [])
+
+    listing = cached_read("kubectl get pods -A -o json", kube_scope(), KUBE_READ_TTL)
+    if listing.returncode != 0:
+        log.error(f"Failed to list the pods: {listing.stderr.strip()}")
+        raise RuntimeError(f"Failed to list the pods: {listing.stderr.strip()}")
+    return json.loads(listing.stdout).get("items", [])
+
+
+def stream_pod_log(namespace: str, name: str, kubectl_args: List[str], pattern: Optional[Pattern] = None,
+                   is_decided: Optional[Callable[[PodLogScan], bool]] = None,
+                   timeout: float = POD_LOG_TIMEOUT) -> PodLogScan:
+    """
+    Stream the log of a pod, matching each line, until it ends or the pod has a verdict.
+    :param namespace: The namespace of the pod.
+    :param name: The name of the pod.
+    :param kubectl_args: Extra 'kubectl logs' arguments, e.g. ['--tail=4'].
+    :param pattern: The pattern matched against each line; matching lines are kept.
+    :param is_decided: Called after each line; returning True stops reading the log.
+    :param timeout: Seconds after which the log stream is stopped.
+    :return: The scan result of the pod.
+    """
+    scan = PodLogScan(namespace, name)
+    process = subprocess.Popen(["kubectl", "logs", "-n", namespace, name, *kubectl_args], stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL, env=kube_env())
+
+    def stop_on_timeout():
+        scan.timed_out = True
+        process.kill()
+
+    timer = threading.Timer(timeout, stop_on_timeout)
+    timer.start()
+    try:
+        for raw_line in process.stdout:
+            line = raw_line.decode(errors='replace').rstrip("\n")
+            scan.lines_read += 1
+            if pattern is not None and pattern.search(line):
+                scan.matches.append(line)
+            if is_decided is not None and is_decided(scan):
+                scan.stopped_early = True
+                process.kill()
+                break
+    finally:
+        timer.cancel()
+        process.stdout.close()
+        process.wait()
+    if scan.timed_out:
+        log.warning(f"Stopped reading the log of pod '{namespace}/{name}' after {timeout:.0f}s.")
+    return scan
+
+
+def scan_pod_logs(pods: List[Dict], kubectl_args: List[str], pattern: Optional[Pattern] = None,
+                  is_decided: Optional[Callable[[PodLogScan], bool]] = None,
+                  jobs: int = DEFAULT_JOBS) -> List[PodLogScan]:
+    """
+    Scan the logs of several pods concurrently with a bounded pool.
+    :param pods: The pod objects to scan.
+    :param kubectl_args: Extra 'kubectl logs' arguments.
+    :param pattern: The pattern matched against each line.
+    :param is_decided: Called after each line of a pod; returning True stops reading that pod's log.
+    :param jobs: The maximum number of logs streamed at the same time.
+    :return: The scan results, in the order of the pods.
+    """
+    def scan(pod: Dict) -> PodLogScan:
+        return stream_pod_log(pod["metadata"]["namespace"], pod["metadata"]["name"], kubectl_args, pattern,
+                              is_decided)
+
+    with span("scan_pod_logs", "logscan", pods=len(pods)):
+        with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="qa-logscan") as executor:
+            return list(executor.map(lambda pod: contextvars.copy_context().run(scan, pod), pods))
+
+
+def check_pods_triggering_errors(pods: List[Dict], jobs: int = DEFAULT_JOBS, tail: int = 4,
+                                 pattern: Pattern = ERROR_PATTERN) -> LogScanReport:
+    """
+    Find pods whose last log lines contain errors (check_pods_triggering_errors.sh).
+    :param pods: The pods to check.
+    :param jobs: The maximum number of logs streamed at the same time.
+    :param tail: The number of trailing log lines inspected per pod.
+    :param pattern: The pattern of an error line.
+    :return: The report, with the output lines of the shell smoketest.
+    """
+    scans = scan_pod_logs(pods, [f"--tail={tail}"], pattern, jobs=jobs)
+    failed_pods = [scan for scan in scans if scan.matches]
+
+    lines = ["Testcase: Confirm, are there any pods which are actively triggering errors"]
+    for scan in failed_pods:
+        lines += ["FAIL: The following pod is actively triggering errors:", f"Pod Name: {scan.name}",
+                  "Logs: " + "\n".join(scan.matches), ""]
+    lines.append("FAIL: There are active pods triggering errors." if failed_pods
+                 else "PASS: There are no active pods which are triggering errors.")
+    return LogScanReport(not failed_pods, lines, scans, failed_pods)
+
+
+def is_problem_pod(pod: Dict) -> bool:
+    """
+    :return: True if a container of the pod is in CrashLoopBackOff or terminated with an error.
+    """
+    for container_status in pod.get("status", {}).get("containerStatuses") or []:
+        state = container_status.get("state") or {}
+        if (state.get("waiting") or {}).get("reason") in PROBLEM_WAITING_REASONS \
+                or (state.get("terminated") or {}).get("reason") in PROBLEM_TERMINATED_REASONS:
+            return True
+    return False
+
+
+def check_pods_without_logs(pods: List[Dict], jobs: int = DEFAULT_JOBS) -> LogScanReport:
+    """
+    Find crashing pods that do not generate any logs (check_pods_withno_activelogs.sh).
+
+    Only the first log line of each pod is read: any output means the pod is generating logs.
+
+    :param pods: The pods to check; only those in CrashLoopBackOff or Error are inspected.
+    :param jobs: The maximum number of logs streamed at the same time.
+    :return: The report, with the output lines of the shell smoketest.
+    """
+    problem_pods = [pod for pod in pods if is_problem_pod(pod)]
+    scans = scan_pod_logs(problem_pods, ["--all-containers=true"], is_decided=lambda scan: scan.lines_read > 0,
+                          jobs=jobs)
+    failed_pods = [scan for scan in scans if scan.lines_read == 0]
+
+    lines = ["Testcase name: Confirm if there are any pods which are not actively generating logs."]
+    if failed_pods:
+        lines.append("FAIL: The following problematic pods are not generating logs:")
+        lines += [f"Pod '{scan.name}' in namespace '{scan.namespace}' is not generating logs." for scan in failed_pods]
+        lines.append("")
+    else:
+        lines.append("PASS: All problematic pods are actively generating logs.")
+    return LogScanReport(not failed_pods, lines, scans, failed_pods)
+
+
+def format_namespace_aggregates(report: LogScanReport) -> List[str]:
+    """
+    Format the per-namespace aggregates of a report as a table.
+    :param report: The log scan report.
+    :return: The table lines.
+    """
+    aggregates = report.namespace_aggregates()
+    if not aggregates:
+        return []
+    width = max([len("Namespace")] + [len(namespace) for namespace in aggregates])
+    lines = [f"{'Namespace':<{width}}  {'Pods':>6}  {'Failed':>6}  {'Lines read':>10}  {'Stopped early':>13}"]
+    for namespace, entry in aggregates.items():
+        lines.append(f"{namespace:<{width}}  {entry['pods']:>6}  {entry['failed']:>6}  {entry['lines_read']:>10}  "
+                     f"{entry['stopped_early']:>13}")
+    return lines
+
+
+# Python implementations of smoketest scripts, used by smoketest_runner instead of the scripts
+LOG_SCAN_CHECKS: Dict[str, Callable[..., LogScanReport]] = {
+    "check_pods_triggering_errors.sh": check_pods_triggering_errors,
+    "check_pods_withno_activelogs.sh": check_pods_without_logs,
+}
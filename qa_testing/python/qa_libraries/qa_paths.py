@@ -0,0 +1,8 @@
+import os
+
+# Absolute paths to the QA Testing directories, resolved from this file so they
+# do not depend on the current working directory or on git being available
+QA_PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QA_DIR = os.path.dirname(QA_PYTHON_DIR)
+QA_LOG_DIR = os.path.join(QA_DIR, "logs")
+QA_CACHE_DIR = os.path.join(QA_DIR, ".cache")
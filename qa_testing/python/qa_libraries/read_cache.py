@@ -0,0 +1,285 @@
+###########################################################
+#
+# Shared cache for read-only 'aws' and 'kubectl' calls.
+#
+# The stdout of a successful read (e.g. 'aws eks
+# list-clusters') is spooled to disk, keyed by a scope (the
+# AWS profile/region/credentials or the kubeconfig context)
+# and the command, and kept in memory for the rest of the
+# process. Every QA tool - and scripts/run_smoketest.sh
+# through scripts/libraries/read_cache.sh - reuses it:
+#
+#   <cache dir>/generation        invalidation counter
+#   <cache dir>/entries/<key>.out stdout of the read
+#   <cache dir>/entries/<key>.meta "<generation> <created>"
+#                                 line, then scope and command
+#
+# An entry is used while it is younger than its TTL and was
+# written in the current generation. Mutating steps
+# ('terraform apply'/'destroy') bump the generation, which
+# invalidates every entry at once. Set QA_READ_CACHE=0 to
+# always read live.
+#
+
+from contextlib import contextmanager
+import contextvars
+from dataclasses import dataclass
+import fcntl
+import hashlib
+import os
+import re
+import shlex
+import subprocess
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from qa_libraries.instrumentation import span
+from qa_libraries.logger import log
+from qa_libraries.qa_paths import QA_CACHE_DIR
+
+READ_CACHE_DIR = os.getenv('QA_READ_CACHE_DIR', os.path.join(QA_CACHE_DIR, "reads"))
+READ_CACHE_ENABLED = os.getenv('QA_READ_CACHE', '1') != '0'
+
+# Default TTLs (seconds) of AWS reads, AWS identity reads and cluster-wide kubectl lists
+AWS_READ_TTL = float(os.getenv('QA_READ_CACHE_TTL', '300'))
+IDENTITY_READ_TTL = float(os.getenv('QA_READ_CACHE_IDENTITY_TTL', '3600'))
+KUBE_READ_TTL = float(os.getenv('QA_READ_CACHE_KUBE_TTL', '30'))
+
+# Outputs up to this size are also kept in memory
+MEMORY_MAX_BYTES = 256 * 1024
+
+GENERATION_FILE = "generation"
+
+_CURRENT_CONTEXT_PATTERN = re.compile(r'^current-context:\s*["\']?([^"\'\n]*?)["\']?\s*$', re.M)
+
+# The kubeconfig selected with using_kubeconfig() for the kubectl commands run in this context
+_kubeconfig: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('qa_kubeconfig', default=None)
+
+_memory: Dict[str, Tuple[int, float, bytes]] = {}
+_memory_lock = threading.Lock()
+_key_locks: Dict[str, threading.Lock] = {}
+
+
+@dataclass
+class CachedRead:
+    command: str
+    returncode: int
+    stdout: bytes
+    stderr: str
+    hit: bool = False
+
+    @property
+    def text(self) -> str:
+        return self.stdout.decode(errors='replace')
+
+
+def aws_scope() -> str:
+    """
+    Get the cache scope of AWS reads: the profile, region and access key the aws CLI would use.
+    :return: The scope string.
+    """
+    region = os.getenv('AWS_REGION') or os.getenv('AWS_DEFAULT_REGION') or ""
+    return f"aws:{os.getenv('AWS_PROFILE') or 'default'}:{region}:{os.getenv('AWS_ACCESS_KEY_ID') or ''}"
+
+
+@contextmanager
+def using_kubeconfig(path: str) -> Iterator[None]:
+    """
+    Run the kubectl commands of this block (and of the threads started from it with a copy of the
+    context) with a kubeconfig, without changing the environment of the process.
+    :param path: The kubeconfig file, e.g. the cluster's own (see eks_auth.write_kubeconfig).
+    :return: None
+    """
+    token = _kubeconfig.set(path)
+    try:
+        yield
+    finally:
+        _kubeconfig.reset(token)
+
+
+def kube_env() -> Optional[Dict[str, str]]:
+    """
+    :return: The environment of the kubectl commands run in this context, or None to inherit the
+             process environment.
+    """
+    path = _kubeconfig.get()
+    return dict(os.environ, KUBECONFIG=path) if path else None
+
+
+def get_kubeconfig_paths() -> List[str]:
+    """
+    :return: The kubeconfig files kubectl would read in this context, in order of precedence.
+    """
+    paths = _kubeconfig.get() or os.getenv('KUBECONFIG') or os.path.join(os.path.expanduser("~"), ".kube", "config")
+    return [path for path in paths.split(os.pathsep) if path]
+
+
+def get_kubeconfig_context() -> str:
+    """
+    Read the current context from the kubeconfig files without running kubectl.
+    :return: The current context, or an empty string if none is set.
+    """
+    for path in get_kubeconfig_paths():
+        try:
+            with open(path, 'r') as file:
+                match = _CURRENT_CONTEXT_PATTERN.search(file.read())
+        except OSError:
+            continue
+        if match and match.group(1):
+            return match.group(1)
+    return ""
+
+
+def kube_scope() -> str:
+    """
+    Get the cache scope of kubectl reads: the kubeconfig and its current context (which names the cluster).
+    :return: The scope string.
+    """
+    return f"kube:{_kubeconfig.get() or os.getenv('KUBECONFIG') or '~/.kube/config'}:{get_kubeconfig_context()}"
+
+
+def _entry_key(scope: str, command: str) -> str:
+    return hashlib.sha256(f"{scope}\n{command}".encode()).hexdigest()
+
+
+def _entry_paths(key: str) -> Tuple[str, str]:
+    base = os.path.join(READ_CACHE_DIR, "entries", key)
+    return f"{base}.out", f"{base}.meta"
+
+
+@contextmanager
+def _locked_generation_file() -> Iterator:
+    os.makedirs(READ_CACHE_DIR, exist_ok=True)
+    with open(os.path.join(READ_CACHE_DIR, GENERATION_FILE), 'a+') as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            file.seek(0)
+            yield file
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def get_generation() -> int:
+    """
+    :return: The current cache generation; entries of older generations are stale.
+    """
+    try:
+        with open(os.path.join(READ_CACHE_DIR, GENERATION_FILE), 'r') as file:
+            return int(file.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def invalidate(reason: str) -> int:
+    """
+    Invalidate every cached read, in this process and in all others sharing the cache directory.
+    :param reason: Why the cache is invalidated, e.g. 'terraform apply'.
+    :return: The new cache generation.
+    """
+    with _memory_lock:
+        _memory.clear()
+    if not READ_CACHE_ENABLED:
+        return 0
+    with _locked_generation_file() as file:
+        generation = int(file.read().strip() or 0) + 1
+        file.seek(0)
+        file.truncate()
+        file.write(f"{generation}\n")
+        file.flush()
+    log.debug(f"Invalidated the read cache after {reason} (generation {generation}).")
+    return generation
+
+
+def _read_spool(key: str, generation: int, ttl: float) -> Optional[Tuple[float, bytes]]:
+    out_path, meta_path = _entry_paths(key)
+    try:
+        with open(meta_path, 'r') as file:
+            entry_generation, created = file.readline().split()
+        if int(entry_generation) != generation or time.time() - float(created) >= ttl:
+            return None
+        with open(out_path, 'rb') as file:
+            return float(created), file.read()
+    except (OSError, ValueError):
+        return None
+
+
+def _write_spool(key: str, generation: int, created: float, scope: str, command: str, stdout: bytes) -> None:
+    out_path, meta_path = _entry_paths(key)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    suffix = f".tmp-{os.getpid()}-{threading.get_ident()}"
+    # The output is written before its meta line, so a fresh meta line never describes an older output
+    with open(out_path + suffix, 'wb') as file:
+        file.write(stdout)
+    os.replace(out_path + suffix, out_path)
+    with open(meta_path + suffix, 'w') as file:
+        file.write(f"{generation} {created:.3f}\n{scope}\n{command}\n")
+    os.replace(meta_path + suffix, meta_path)
+
+
+def _key_lock(key: str) -> threading.Lock:
+    with _memory_lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def _remember(key: str, generation: int, created: float, stdout: bytes) -> None:
+    if len(stdout) <= MEMORY_MAX_BYTES:
+        with _memory_lock:
+            _memory[key] = (generation, created, stdout)
+
+
+def cached_read(command: str, scope: str, ttl: float, refresh: bool = False,
+                timeout: Optional[float] = None) -> CachedRead:
+    """
+    Run a read-only command, or reuse its output if it was read recently in the same scope.
+
+    Concurrent identical reads in one process wait for a single command. Only successful
+    reads are cached.
+
+    :param command: The read-only command, e.g. 'aws eks list-clusters --query clusters --output text'.
+    :param scope: The scope the output is valid in (see aws_scope and kube_scope).
+    :param ttl: Seconds the output stays valid.
+    :param refresh: Skip the cache and read live, updating the cache.
+    :param timeout: Seconds after which the command is killed.
+    :return: The output of the read.
+    """
+    key = _entry_key(scope, command)
+    with _key_lock(key), span("read", "cache", command=command) as read_span:
+        generation = get_generation() if READ_CACHE_ENABLED else 0
+        if READ_CACHE_ENABLED and not refresh:
+            with _memory_lock:
+                cached = _memory.get(key)
+            if cached and cached[0] == generation and time.time() - cached[1] < ttl:
+                read_span.attributes["hit"] = "memory"
+                return CachedRead(command, 0, cached[2], "", hit=True)
+            spooled = _read_spool(key, generation, ttl)
+            if spooled:
+                read_span.attributes["hit"] = "disk"
+                _remember(key, generation, *spooled)
+                return CachedRead(command, 0, spooled[1], "", hit=True)
+
+        read_span.attributes["hit"] = False
+        created = time.time()
+        try:
+            completed = subprocess.run(shlex.split(command), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       stdin=subprocess.DEVNULL, timeout=timeout, env=kube_env())
+        except FileNotFoundError as e:
+            read_span.status = "failed"
+            return CachedRead(command, 127, b"", str(e))
+        except subprocess.TimeoutExpired:
+            read_span.status = "timeout"
+            return CachedRead(command, 124, b"", f"Timed out after {timeout}s: {command}")
+
+        read_span.returncode = completed.returncode
+        read_span.stdout_bytes = len(completed.stdout)
+        result = CachedRead(command, completed.returncode, completed.stdout, completed.stderr.decode(errors='replace'))
+        if completed.returncode != 0:
+            read_span.status = "failed"
+            return result
+        if READ_CACHE_ENABLED:
+            try:
+                _write_spool(key, generation, created, scope, command, completed.stdout)
+            except OSError as e:
+                log.warning(f"Unable to spool the output of '{command}': {e}")
+            _remember(key, generation, created, completed.stdout)
+        return result
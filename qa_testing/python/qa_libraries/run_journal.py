@@ -0,0 +1,240 @@
+###########################################################
+#
+# Per-cluster run journal of the lifecycle pipeline.
+#
+# A bringup/bringdown records each completed stage (state
+# restore, init, apply/destroy, kubeconfig, verify and each
+# smoketest) in '<repo-root>/qa_testing/.cache/run_journals/
+# <cluster>.json' as soon as it completes. When a run fails,
+# the next run with --resume skips the completed stages and
+# continues from the first one that did not complete.
+#
+# A journal is only resumed by the same action on the same
+# configuration: if the Terraform configuration of the
+# target-cluster directory (files, variables, AWS account, see
+# drift_check) changed since the journal was started, the run
+# starts from the beginning.
+#
+# The journal of the running operation is found through a
+# context variable, so run_cluster_steps (and the asyncio
+# tasks and worker threads started from it) checkpoint into
+# it without it being passed down explicitly.
+#
+
+from contextlib import contextmanager
+import contextvars
+from dataclasses import replace
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterator, List, Optional
+
+from qa_libraries.async_engine import Step
+from qa_libraries.drift_check import compute_apply_fingerprint
+from qa_libraries.logger import RUN_ID, log
+from qa_libraries.qa_paths import QA_CACHE_DIR
+
+JOURNAL_DIR = os.getenv('QA_RUN_JOURNAL_DIR', os.path.join(QA_CACHE_DIR, "run_journals"))
+JOURNAL_FORMAT_VERSION = 1
+
+# Steps whose result does not outlive the run (the saved plan is deleted), so they always run again
+NON_RESUMABLE_STEPS = ("plan",)
+
+STATUS_RUNNING = "running"
+STATUS_FAILED = "failed"
+STATUS_COMPLETED = "completed"
+
+_current_journal: contextvars.ContextVar[Optional["RunJournal"]] = \
+    contextvars.ContextVar('qa_current_journal', default=None)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def get_inputs_fingerprint(target_cluster_name: str, cluster_dir: str) -> str:
+    """
+    :param target_cluster_name: The name of the cluster.
+    :param cluster_dir: The target-cluster directory.
+    :return: A hash of the Terraform configuration of the directory, without what the run itself
+             changes (the state and the initialized providers/modules).
+    """
+    fingerprint = {key: value for key, value in compute_apply_fingerprint(target_cluster_name, cluster_dir).items()
+                   if key != "state" and not key.startswith("init: ")}
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class RunJournal:
+    """
+    The completed stages of one cluster's bringup/bringdown, saved after every change.
+    """
+
+    def __init__(self, path: str, data: Dict):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+
+    @property
+    def label(self) -> str:
+        return self.data["cluster"]
+
+    def is_done(self, stage: str) -> bool:
+        return self.data["stages"].get(stage, {}).get("status") == "done"
+
+    def done_stages(self) -> List[str]:
+        return [stage for stage, entry in self.data["stages"].items() if entry.get("status") == "done"]
+
+    def _update(self, stage: Optional[str] = None, **fields) -> None:
+        with self._lock:
+            if stage:
+                entry = self.data["stages"].setdefault(stage, {"attempts": 0})
+                entry.update(fields, finished=_now())
+            self.data["updated"] = _now()
+            temp_path = f"{self.path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            try:
+                with open(temp_path, 'w') as file:
+                    json.dump(self.data, file, indent=2)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                log.warning(f"[{self.label}] Unable to save the run journal: {e}")
+
+    def mark_done(self, stage: str) -> None:
+        """
+        Record a stage as completed.
+        :param stage: The stage, e.g. 'apply' or 'smoketest:check_coredns.sh'.
+        :return: None
+        """
+        attempts = self.data["stages"].get(stage, {}).get("attempts", 0) + 1
+        self._update(stage, status="done", attempts=attempts, run_id=RUN_ID)
+
+    def mark_failed(self, stage: str, error: str) -> None:
+        """
+        Record a stage as failed.
+        :param stage: The stage that failed.
+        :param error: A short description of the failure.
+        :return: None
+        """
+        attempts = self.data["stages"].get(stage, {}).get("attempts", 0) + 1
+        self._update(stage, status="failed", attempts=attempts, run_id=RUN_ID, error=error[-500:])
+
+    def finish(self, succeeded: bool) -> None:
+        self.data["status"] = STATUS_COMPLETED if succeeded else STATUS_FAILED
+        self._update()
+
+    def checkpoint(self, steps: List[Step]) -> List[Step]:
+        """
+        Drop the completed steps and record the others in the journal as they complete.
+        :param steps: The steps to run (see async_engine.run_steps).
+        :return: The steps still to run.
+        """
+        skipped = {step.name for step in steps if step.name not in NON_RESUMABLE_STEPS and self.is_done(step.name)}
+        if skipped:
+            log.info(f"[{self.label}] Resuming: skipping the completed steps {', '.join(sorted(skipped))}.")
+
+        def on_success(step: Step):
+            def record():
+                if step.on_success:
+                    step.on_success()
+                self.mark_done(step.name)
+            return record
+
+        return [replace(step, after=[name for name in step.after if name not in skipped], on_success=on_success(step))
+                for step in steps if step.name not in skipped]
+
+
+def _journal_path(target_cluster_name: str) -> str:
+    return os.path.join(JOURNAL_DIR, f"{target_cluster_name}.json")
+
+
+def load_journal(target_cluster_name: str) -> Optional[Dict]:
+    """
+    :param target_cluster_name: The name of the cluster.
+    :return: The saved journal of the cluster's last run, if any.
+    """
+    try:
+        with open(_journal_path(target_cluster_name), 'r') as file:
+            data = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return data if data.get("format_version") == JOURNAL_FORMAT_VERSION else None
+
+
+def _resumable(previous: Optional[Dict], action: str, inputs: str) -> Optional[str]:
+    """
+    :return: Why the previous journal cannot be resumed, or None if it can.
+    """
+    if previous is None:
+        return "no previous run recorded"
+    if previous["action"] != action:
+        return f"the previous run was a {previous['action']}"
+    if previous["status"] == STATUS_COMPLETED:
+        return "the previous run completed"
+    if previous["inputs"] != inputs:
+        return "the Terraform configuration changed since the previous run"
+    return None
+
+
+def open_journal(target_cluster_name: str, action: str, cluster_dir: str, resume: bool = False) -> RunJournal:
+    """
+    Start the journal of a run, or continue the journal of the previous failed run.
+    :param target_cluster_name: The name of the cluster.
+    :param action: Either 'bringup' or 'bringdown'.
+    :param cluster_dir: The target-cluster directory, whose inputs a resumed journal must match.
+    :param resume: Continue the previous run of the same action if it did not complete.
+    :return: The journal.
+    """
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    inputs = get_inputs_fingerprint(target_cluster_name, cluster_dir)
+    previous = load_journal(target_cluster_name)
+    if resume:
+        reason = _resumable(previous, action, inputs)
+        if reason is None:
+            journal = RunJournal(_journal_path(target_cluster_name), previous)
+            journal.data["status"] = STATUS_RUNNING
+            log.info(f"[{target_cluster_name}] Resuming the {action} started at {previous['started']} "
+                     f"(completed: {', '.join(journal.done_stages()) or 'nothing yet'}).")
+            return journal
+        log.info(f"[{target_cluster_name}] Nothing to resume ({reason}); starting from the beginning.")
+
+    return RunJournal(_journal_path(target_cluster_name), {
+        "format_version": JOURNAL_FORMAT_VERSION,
+        "cluster": target_cluster_name,
+        "action": action,
+        "status": STATUS_RUNNING,
+        "run_id": RUN_ID,
+        "started": _now(),
+        "updated": _now(),
+        "inputs": inputs,
+        "stages": {},
+    })
+
+
+@contextmanager
+def run_journal(target_cluster_name: str, action: str, cluster_dir: str, resume: bool = False) -> Iterator[RunJournal]:
+    """
+    Journal a bringup/bringdown: the steps run in this block (and the stages recorded with
+    the journal) are checkpointed. The journal is marked failed unless finish(True) is called.
+    :param target_cluster_name: The name of the cluster.
+    :param action: Either 'bringup' or 'bringdown'.
+    :param cluster_dir: The target-cluster directory.
+    :param resume: Continue the previous run of the same action if it did not complete.
+    :return: The journal.
+    """
+    journal = open_journal(target_cluster_name, action, cluster_dir, resume)
+    journal._update()
+    token = _current_journal.set(journal)
+    try:
+        yield journal
+    finally:
+        _current_journal.reset(token)
+        if journal.data["status"] == STATUS_RUNNING:
+            journal.finish(False)
+
+
+def current_journal() -> Optional[RunJournal]:
+    """
+    :return: The journal of the operation running in this context, if it is journaled.
+    """
+    return _current_journal.get()
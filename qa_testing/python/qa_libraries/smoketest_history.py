@@ -0,0 +1,144 @@
+###########################################################
+#
+# Run history of the smoketests.
+#
+# Every smoketest run by the Python runner is recorded with
+# its cluster, duration and outcome in a local SQLite
+# database, '<repo-root>/qa_testing/.cache/
+# smoketest_history.sqlite'. The history is used to:
+#
+#   - estimate each smoketest's duration: the median of its
+#     last QA_SMOKETEST_HISTORY_WINDOW runs on the cluster
+#     (or on any cluster, if it never ran on this one),
+#   - schedule the smoketests longest-first, so the slow
+#     ones (ALB provisioning, PVC binding) do not start last,
+#   - predict the total time of a run before it starts.
+#
+
+from contextlib import contextmanager
+from datetime import datetime
+import heapq
+import os
+import sqlite3
+import statistics
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from qa_libraries.logger import RUN_ID, log
+from qa_libraries.qa_paths import QA_CACHE_DIR
+
+HISTORY_DB = os.getenv('QA_SMOKETEST_HISTORY_DB', os.path.join(QA_CACHE_DIR, "smoketest_history.sqlite"))
+HISTORY_WINDOW = int(os.getenv('QA_SMOKETEST_HISTORY_WINDOW', '10'))
+
+# Assumed duration (in seconds) of a smoketest that never ran
+DEFAULT_DURATION = float(os.getenv('QA_SMOKETEST_DEFAULT_DURATION', '60'))
+
+OUTCOME_PASSED = "passed"
+OUTCOME_FAILED = "failed"
+OUTCOME_TIMEOUT = "timeout"
+# Skipped because a prerequisite failed; not recorded
+OUTCOME_BLOCKED = "blocked"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS smoketest_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    cluster TEXT NOT NULL,
+    script TEXT NOT NULL,
+    started TEXT NOT NULL,
+    duration REAL NOT NULL,
+    returncode INTEGER NOT NULL,
+    outcome TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS smoketest_runs_by_script ON smoketest_runs (script, cluster, id);
+"""
+
+
+@contextmanager
+def _connect(db_path: str = HISTORY_DB) -> Iterator[sqlite3.Connection]:
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    # Several runners (one per cluster) may write at the same time
+    connection = sqlite3.connect(db_path, timeout=30)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(_SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def record_runs(cluster_name: str, started: datetime, runs: List[Tuple[str, float, int, str]],
+                db_path: str = HISTORY_DB) -> None:
+    """
+    Record the smoketests of a run.
+    :param cluster_name: The cluster that was tested.
+    :param started: When the run started.
+    :param runs: (script, duration in seconds, return code, outcome) of each smoketest that ran.
+    :param db_path: The history database.
+    :return: None
+    """
+    try:
+        with _connect(db_path) as connection:
+            connection.executemany(
+                "INSERT INTO smoketest_runs (run_id, cluster, script, started, duration, returncode, outcome) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(RUN_ID, cluster_name, script, started.isoformat(), duration, returncode, outcome)
+                 for script, duration, returncode, outcome in runs])
+    except sqlite3.Error as e:
+        log.warning(f"Unable to record the smoketest history in '{db_path}': {e}")
+
+
+def _recent_durations(connection: sqlite3.Connection, script: str, cluster_name: Optional[str]) -> List[float]:
+    if cluster_name:
+        rows = connection.execute("SELECT duration FROM smoketest_runs WHERE script = ? AND cluster = ? "
+                                  "ORDER BY id DESC LIMIT ?", (script, cluster_name, HISTORY_WINDOW))
+    else:
+        rows = connection.execute("SELECT duration FROM smoketest_runs WHERE script = ? ORDER BY id DESC LIMIT ?",
+                                  (script, HISTORY_WINDOW))
+    return [duration for duration, in rows]
+
+
+def get_expected_durations(cluster_name: str, script_names: List[str],
+                           db_path: str = HISTORY_DB) -> Dict[str, Optional[float]]:
+    """
+    Estimate the duration of smoketests from their recent runs.
+    :param cluster_name: The cluster to test; its own runs are preferred over those on other clusters.
+    :param script_names: The smoketest scripts.
+    :param db_path: The history database.
+    :return: The median recent duration (in seconds) of each script, None for a script that never ran.
+    """
+    expected: Dict[str, Optional[float]] = {name: None for name in script_names}
+    if not os.path.exists(db_path):
+        return expected
+    try:
+        with _connect(db_path) as connection:
+            for name in script_names:
+                durations = _recent_durations(connection, name, cluster_name) or \
+                    _recent_durations(connection, name, None)
+                if durations:
+                    expected[name] = statistics.median(durations)
+    except sqlite3.Error as e:
+        log.warning(f"Unable to read the smoketest history in '{db_path}': {e}")
+    return expected
+
+
+def order_longest_first(script_names: List[str], durations: Dict[str, float]) -> List[str]:
+    """
+    :param script_names: The smoketest scripts.
+    :param durations: The expected duration of each script.
+    :return: The scripts, longest expected duration first (by name on a tie).
+    """
+    return sorted(script_names, key=lambda name: (-durations[name], name))
+
+
+def predict_makespan(durations: List[float], jobs: int) -> float:
+    """
+    Predict the wall time of running tasks longest-first on a pool of workers.
+    :param durations: The expected duration of each task.
+    :param jobs: The number of workers.
+    :return: The time until the last task finishes.
+    """
+    workers = [0.0] * max(1, min(jobs, len(durations)))
+    for duration in sorted(durations, reverse=True):
+        heapq.heapreplace(workers, workers[0] + duration)
+    return max(workers, default=0.0)
@@ -0,0 +1,408 @@
+###########################################################
+#
+# Parallel smoketest runner.
+#
+# Runs the 'scripts/smoketests/check*.sh' scripts against a
+# cluster like 'scripts/run_smoketest.sh', but:
+#
+#   - every cluster-wide resource list the checks need
+#     ('kubectl get <type> -A -o json') is fetched once, up
+#     front and concurrently, into a shared snapshot (lists
+#     read in the last QA_READ_CACHE_KUBE_TTL seconds are
+#     reused, see read_cache.py),
+#   - the checks run concurrently with a worker limit, each
+#     in its own temporary working directory (several checks
+#     write their manifests to the current directory),
+#   - a generated 'kubectl' shim first on the PATH of the
+#     checks serves those lists from the snapshot and passes
+#     every other command to the real kubectl,
+#   - the pod-log checks run on the concurrent log scanner
+#     (see pod_log_scan.py) and check_cluster_health.sh on
+#     the streaming health evaluator (see kube_checks.py)
+#     instead of their scripts,
+#   - the checks are started longest-first by their recorded
+#     durations, and the total time is predicted up front
+#     (see smoketest_history.py),
+#   - the networking prerequisites (kube-proxy, VPC CNI,
+#     CoreDNS) run first; when one fails, the checks that
+#     depend on them are skipped instead of timing out.
+#
+# The combined log has the same layout and the same
+# '<Date-Time>_..._on_<cluster>_PASSED|FAILED.log' name as
+# the log of run_smoketest.sh.
+#
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextvars
+from dataclasses import dataclass
+from datetime import datetime
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from qa_libraries.instrumentation import get_spans, span, write_spans_csv
+from qa_libraries.lazy_imports import lazy_import
+from qa_libraries.logger import log
+from qa_libraries.pod_log_scan import LOG_SCAN_CHECKS, format_namespace_aggregates, load_pods
+from qa_libraries.qa_paths import QA_CACHE_DIR, QA_DIR, QA_LOG_DIR
+from qa_libraries.read_cache import KUBE_READ_TTL, cached_read, kube_env, kube_scope
+from qa_libraries.smoketest_history import (
+    DEFAULT_DURATION,
+    OUTCOME_BLOCKED,
+    OUTCOME_FAILED,
+    OUTCOME_PASSED,
+    OUTCOME_TIMEOUT,
+    get_expected_durations,
+    order_longest_first,
+    predict_makespan,
+    record_runs,
+)
+
+# The Kubernetes API client (ssl, http.client) is only imported once a check runs on it
+kube_api = lazy_import("qa_libraries.kube_api")
+kube_checks = lazy_import("qa_libraries.kube_checks")
+
+SMOKETEST_DIR = os.path.join(QA_DIR, "scripts", "smoketests")
+SMOKETEST_WORK_DIR = os.path.join(QA_CACHE_DIR, "smoketests")
+
+# Resource types listed cluster-wide by the checks (see check_cluster_health.sh)
+SNAPSHOT_RESOURCE_TYPES = ("pods", "deployments", "statefulsets", "daemonsets", "jobs", "hpa", "nodes", "namespaces")
+# The ones still listed by a script when check_cluster_health.sh runs on the streaming evaluator
+API_CHECKS_SNAPSHOT_RESOURCE_TYPES = ("pods",)
+
+DEFAULT_JOBS = int(os.getenv('QA_SMOKETEST_JOBS', '4'))
+SMOKETEST_TIMEOUT = float(os.getenv('QA_SMOKETEST_TIMEOUT', '1800'))
+
+# Smoketests every other smoketest depends on: without cluster networking, the remaining checks can only fail
+PREREQUISITE_SMOKETESTS = tuple(os.getenv(
+    'QA_SMOKETEST_PREREQUISITES', "check_kubeproxy.sh check_vpccni.sh check_coredns.sh").split())
+
+LOG_SEPARATOR = "***************************************************"
+
+KUBECTL_SHIM = """#!/usr/bin/env bash
+# Generated by smoketest_runner.py: serves 'kubectl get <type> -A -o json' from the
+# shared resource snapshot and passes every other command to the real kubectl.
+SNAPSHOT_DIR="{snapshot_dir}"
+REAL_KUBECTL="{real_kubectl}"
+
+if [ "$1" == "get" ] && [ -n "$2" ] && [ -f "$SNAPSHOT_DIR/$2.json" ]; then
+  all_namespaces=false
+  json_output=false
+  other_args=0
+  for arg in "${{@:3}}"; do
+    case "$arg" in
+      -A|--all-namespaces) all_namespaces=true ;;
+      -ojson|--output=json) json_output=true ;;
+      -o|--output) ;;
+      json) json_output=true ;;
+      *) other_args=1 ;;
+    esac
+  done
+  if [ "$all_namespaces" == true ] && [ "$json_output" == true ] && [ "$other_args" -eq 0 ]; then
+    exec cat "$SNAPSHOT_DIR/$2.json"
+  fi
+fi
+
+exec "$REAL_KUBECTL" "$@"
+"""
+
+
+@dataclass
+class SmoketestResult:
+    name: str
+    returncode: int
+    duration: float
+    output: str
+    timed_out: bool = False
+    # The failed prerequisites this smoketest was skipped for
+    blocked_by: Optional[List[str]] = None
+
+    @property
+    def passed(self) -> bool:
+        return self.returncode == 0
+
+    @property
+    def outcome(self) -> str:
+        if self.blocked_by:
+            return OUTCOME_BLOCKED
+        if self.timed_out:
+            return OUTCOME_TIMEOUT
+        return OUTCOME_PASSED if self.passed else OUTCOME_FAILED
+
+
+def list_smoketests() -> List[str]:
+    """
+    List the available smoketest scripts.
+    :return: The script names, sorted like run_smoketest.sh sorts them.
+    """
+    return sorted(entry for entry in os.listdir(SMOKETEST_DIR)
+                  if entry.lower().startswith("check") and entry.lower().endswith(".sh")
+                  and os.path.isfile(os.path.join(SMOKETEST_DIR, entry)))
+
+
+def _list_resource_type(resource_type: str, snapshot_dir: str, scope: str) -> bool:
+    snapshot_file = os.path.join(snapshot_dir, f"{resource_type}.json")
+    with span(resource_type, "snapshot") as list_span:
+        listing = cached_read(f"kubectl get {resource_type} -A -o json", scope, KUBE_READ_TTL)
+        list_span.returncode = listing.returncode
+        list_span.stdout_bytes = len(listing.stdout)
+        list_span.attributes["cached"] = listing.hit
+        if listing.returncode != 0:
+            list_span.status = "failed"
+            log.warning(f"Unable to snapshot '{resource_type}' (checks will query it directly): "
+                        f"{listing.stderr.strip()}")
+            return False
+        with open(f"{snapshot_file}.tmp", 'wb') as file:
+            file.write(listing.stdout)
+        os.replace(f"{snapshot_file}.tmp", snapshot_file)
+        return True
+
+
+def take_resource_snapshot(snapshot_dir: str, resource_types=SNAPSHOT_RESOURCE_TYPES,
+                           jobs: int = DEFAULT_JOBS) -> str:
+    """
+    List each resource type once, cluster-wide, and serve the lists to the checks through a kubectl shim.
+    :param snapshot_dir: The directory to write the snapshot and the shim to.
+    :param resource_types: The resource types to list.
+    :param jobs: The maximum number of lists fetched at the same time.
+    :return: The directory containing the kubectl shim, to be put first on the PATH of the checks.
+    """
+    kubectl = shutil.which("kubectl")
+    if not kubectl:
+        log.error("kubectl is not installed or not in the system PATH.")
+        raise FileNotFoundError("kubectl is not installed or not in the system PATH.")
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    scope = kube_scope()
+    with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="qa-snapshot") as executor:
+        listed = list(executor.map(
+            lambda resource_type: contextvars.copy_context().run(_list_resource_type, resource_type,
+                                                                 snapshot_dir, scope),
+            resource_types))
+    log.info(f"Snapshot of {sum(listed)}/{len(resource_types)} resource types saved to '{snapshot_dir}'.")
+
+    shim_dir = os.path.join(snapshot_dir, "bin")
+    os.makedirs(shim_dir, exist_ok=True)
+    shim_path = os.path.join(shim_dir, "kubectl")
+    with open(shim_path, 'w') as file:
+        file.write(KUBECTL_SHIM.format(snapshot_dir=snapshot_dir, real_kubectl=kubectl))
+    os.chmod(shim_path, 0o755)
+    return shim_dir
+
+
+def _run_log_scan_check(script_name: str, shim_dir: Optional[str]) -> (int, bytes):
+    snapshot_dir = os.path.dirname(shim_dir) if shim_dir else None
+    try:
+        report = LOG_SCAN_CHECKS[script_name](load_pods(snapshot_dir))
+    except Exception as e:
+        return 1, f"FAIL: Unable to scan the pod logs: {e}\n".encode()
+    lines = report.lines + format_namespace_aggregates(report)
+    return (0 if report.passed else 1), ("\n".join(lines) + "\n").encode()
+
+
+def _run_api_check(script_name: str) -> (int, bytes):
+    try:
+        report = kube_checks.API_CHECKS[script_name](kube_api.get_client())
+    except kube_api.KubeApiError as e:
+        return 1, f"FAIL: Unable to reach the Kubernetes API: {e}\n".encode()
+    return (0 if report.passed else 1), ("\n".join(report.lines) + "\n").encode()
+
+
+def run_smoketest(script_name: str, cluster_name: str, work_root: str, shim_dir: Optional[str] = None,
+                  timeout: float = SMOKETEST_TIMEOUT, use_log_scan: bool = True,
+                  use_api_checks: bool = True) -> SmoketestResult:
+    """
+    Run one smoketest script in its own temporary working directory.
+    :param script_name: The smoketest script, e.g. 'check_coredns.sh'.
+    :param cluster_name: The cluster to test.
+    :param work_root: The directory the temporary working directory is created in.
+    :param shim_dir: The directory of the kubectl shim put first on the PATH, if any.
+    :param timeout: Seconds after which the script is killed.
+    :param use_log_scan: Run the pod-log smoketests with the concurrent log scanner (see pod_log_scan)
+                         instead of their scripts.
+    :param use_api_checks: Run the smoketests of kube_checks.API_CHECKS over the Kubernetes API instead of
+                           their scripts.
+    :return: The result of the smoketest.
+    """
+    if use_api_checks and script_name in kube_checks.API_CHECKS:
+        start_time = time.monotonic()
+        with span(script_name, "smoketest", cluster_name, engine="kube_api") as test_span:
+            returncode, output = _run_api_check(script_name)
+            test_span.returncode = returncode
+            test_span.stdout_bytes = len(output)
+            if returncode != 0:
+                test_span.status = "failed"
+        return SmoketestResult(script_name, returncode, time.monotonic() - start_time, output.decode())
+
+    if use_log_scan and script_name in LOG_SCAN_CHECKS:
+        start_time = time.monotonic()
+        with span(script_name, "smoketest", cluster_name, engine="pod_log_scan") as test_span:
+            returncode, output = _run_log_scan_check(script_name, shim_dir)
+            test_span.returncode = returncode
+            test_span.stdout_bytes = len(output)
+            if returncode != 0:
+                test_span.status = "failed"
+        return SmoketestResult(script_name, returncode, time.monotonic() - start_time, output.decode())
+
+    env = kube_env() or dict(os.environ)
+    if shim_dir:
+        env["PATH"] = f"{shim_dir}{os.pathsep}{env.get('PATH', '')}"
+    workdir = tempfile.mkdtemp(prefix=f"{os.path.splitext(script_name)[0]}-", dir=work_root)
+
+    start_time = time.monotonic()
+    with span(script_name, "smoketest", cluster_name) as test_span:
+        try:
+            completed = subprocess.run([os.path.join(SMOKETEST_DIR, script_name), cluster_name], cwd=workdir,
+                                       env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, timeout=timeout)
+            returncode, output, timed_out = completed.returncode, completed.stdout, False
+        except subprocess.TimeoutExpired as e:
+            output = (e.stdout or b"") + f"\nTimed out after {timeout:.0f}s\n".encode()
+            returncode, timed_out = 124, True
+        test_span.returncode = returncode
+        test_span.stdout_bytes = len(output)
+        if returncode != 0:
+            test_span.status = "timeout" if timed_out else "failed"
+
+    return SmoketestResult(script_name, returncode, time.monotonic() - start_time,
+                           output.decode(errors='replace'), timed_out)
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return f"{minutes}m{seconds:02d}s"
+
+
+def plan_smoketests(cluster_name: str, script_names: List[str], jobs: int = DEFAULT_JOBS,
+                    fail_fast: bool = True) -> Tuple[List[List[str]], float]:
+    """
+    Order smoketests into the phases they run in and predict the total time from their history.
+    :param cluster_name: The cluster to test.
+    :param script_names: The smoketest scripts to run.
+    :param jobs: The maximum number of smoketests run at the same time.
+    :param fail_fast: Run the prerequisite smoketests (PREREQUISITE_SMOKETESTS) as a first phase.
+    :return: The phases, each ordered longest-first, and the predicted total time in seconds.
+    """
+    expected = get_expected_durations(cluster_name, script_names)
+    durations = {name: DEFAULT_DURATION if duration is None else duration for name, duration in expected.items()}
+    prerequisites = [name for name in script_names if name in PREREQUISITE_SMOKETESTS] if fail_fast else []
+    # Prerequisites only gate the other smoketests; run alone, they form a single phase
+    if len(prerequisites) == len(script_names):
+        prerequisites = []
+    others = [name for name in script_names if name not in prerequisites]
+    phases = [order_longest_first(phase, durations) for phase in (prerequisites, others) if phase]
+    predicted = sum(predict_makespan([durations[name] for name in phase], jobs) for phase in phases)
+
+    known = sum(duration is not None for duration in expected.values())
+    log.info(f"[{cluster_name}] Predicted total time: {_format_duration(predicted)} with {jobs} workers "
+             f"(history for {known}/{len(script_names)} smoketests; "
+             f"longest: {', '.join(f'{name} {_format_duration(durations[name])}' for name in phases[-1][:3])}).")
+    return phases, predicted
+
+
+def run_smoketests(cluster_name: str, script_names: List[str], jobs: int = DEFAULT_JOBS,
+                   use_snapshot: bool = True, use_log_scan: bool = True, use_api_checks: bool = True,
+                   fail_fast: bool = True) -> List[SmoketestResult]:
+    """
+    Run smoketests concurrently against a cluster, longest-first, and record them in the run history.
+    :param cluster_name: The cluster to test.
+    :param script_names: The smoketest scripts to run.
+    :param jobs: The maximum number of smoketests run at the same time.
+    :param use_snapshot: Serve the cluster-wide resource lists from a shared snapshot.
+    :param use_log_scan: Run the pod-log smoketests with the concurrent log scanner.
+    :param use_api_checks: Run check_cluster_health.sh on the streaming health evaluator.
+    :param fail_fast: Run the prerequisite smoketests first and skip the others when one of them fails.
+    :return: The results, in the order the scripts were given.
+    """
+    if not script_names:
+        return []
+    phases, predicted = plan_smoketests(cluster_name, script_names, jobs, fail_fast)
+
+    # Inside the repository, as the checks locate the repository root from their working directory
+    os.makedirs(SMOKETEST_WORK_DIR, exist_ok=True)
+    work_root = tempfile.mkdtemp(prefix=f"{cluster_name}-", dir=SMOKETEST_WORK_DIR)
+    started, start_time = datetime.now(), time.monotonic()
+    results: Dict[str, SmoketestResult] = {}
+    try:
+        resource_types = API_CHECKS_SNAPSHOT_RESOURCE_TYPES if use_api_checks else SNAPSHOT_RESOURCE_TYPES
+        shim_dir = take_resource_snapshot(os.path.join(work_root, "snapshot"), resource_types,
+                                          jobs=jobs) if use_snapshot else None
+
+        failed_prerequisites: List[str] = []
+        with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="qa-smoketest") as executor:
+            for phase in phases:
+                if failed_prerequisites:
+                    for name in phase:
+                        results[name] = SmoketestResult(
+                            name, 1, 0.0, f"Skipped: the prerequisite smoketests "
+                                          f"{', '.join(failed_prerequisites)} failed.\n",
+                            blocked_by=failed_prerequisites)
+                    log.error(f"[{cluster_name}] Skipping {len(phase)} smoketests: the prerequisite smoketests "
+                              f"{', '.join(failed_prerequisites)} failed.")
+                    continue
+
+                # The pool starts the smoketests in submission order, i.e. longest-first
+                futures = {
+                    executor.submit(contextvars.copy_context().run, run_smoketest, name, cluster_name, work_root,
+                                    shim_dir, SMOKETEST_TIMEOUT, use_log_scan, use_api_checks): name
+                    for name in phase
+                }
+                for future in as_completed(futures):
+                    result = future.result()
+                    results[result.name] = result
+                    status = "PASSED" if result.passed else "FAILED"
+                    log.info(f"[{cluster_name}] {result.name} {status} after {result.duration:.0f}s")
+                failed_prerequisites = [name for name in phase
+                                        if name in PREREQUISITE_SMOKETESTS and not results[name].passed]
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+        record_runs(cluster_name, started, [(result.name, result.duration, result.returncode, result.outcome)
+                                            for result in results.values() if not result.blocked_by])
+
+    log.info(f"[{cluster_name}] Smoketests finished after {_format_duration(time.monotonic() - start_time)} "
+             f"(predicted: {_format_duration(predicted)}).")
+    return [results[name] for name in script_names]
+
+
+def write_smoketest_log(cluster_name: str, test_script: str, results: List[SmoketestResult],
+                        started: datetime, header: List[str], log_dir: str = QA_LOG_DIR) -> str:
+    """
+    Write the combined smoketest log with the same layout and file name as run_smoketest.sh.
+    :param cluster_name: The cluster that was tested.
+    :param test_script: 'all' or the name of the single smoketest that was run.
+    :param results: The smoketest results, in run order.
+    :param started: When the run started, used for the timestamp in the file name.
+    :param header: Extra header lines (e.g. the EKS cluster version).
+    :param log_dir: The directory to write the log to.
+    :return: The path to the log file.
+    """
+    timestamp = started.strftime("%Y%m%d%H%M%S")
+    failed = [result for result in results if not result.passed]
+
+    lines = [LOG_SEPARATOR, f"Script Execution Started at: {timestamp}", f"Target Cluster: {cluster_name}", *header,
+             f"Running Smoketest: {test_script}"]
+    for counter, result in enumerate(results, start=1):
+        lines += [LOG_SEPARATOR, f"Execute script-{counter}: {result.name}", result.output.rstrip("\n"),
+                  f"{'PASSED' if result.passed else 'FAILED'}: Proceeding to the next smoketest."]
+    lines.append(LOG_SEPARATOR)
+    lines.append("PASS: All smoketest scripts executed successfully" if not failed
+                 else f"FAIL: {len(failed)} smoketest scripts failed")
+
+    suffix = "_FAILED" if failed else "_PASSED"
+    if test_script == "all":
+        file_name = f"{timestamp}_run_all_smoketests_on_{cluster_name}{suffix}.log"
+    else:
+        file_name = f"{timestamp}_smoketest_{os.path.splitext(test_script)[0]}_on_{cluster_name}{suffix}.log"
+
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, file_name)
+    with open(log_file, 'w') as file:
+        file.write("\n".join(lines) + "\n")
+
+    smoketest_spans = [recorded for recorded in get_spans() if recorded.category == "smoketest"]
+    write_spans_csv(sorted(smoketest_spans, key=lambda recorded: recorded.start),
+                    f"{os.path.splitext(log_file)[0]}_timings.csv")
+    return log_file
@@ -0,0 +1,231 @@
+###########################################################
+#
+# Atomic, lock-protected Terraform state swaps with crash
+# recovery.
+#
+# - state_lock() takes an advisory flock on
+#   '<dir>/.qa_state.lock' so two invocations can never work
+#   on the same directory at the same time.
+# - swap_state_files() replaces the live state files as a
+#   transaction: the new files are staged next to the live
+#   ones and fsync'ed, a journal is written, then each file
+#   is swapped in with an atomic rename and the journal is
+#   removed. A journal found on the next start means the
+#   swap was interrupted after it was prepared; it is rolled
+#   forward. Staged files without a journal are rolled back
+#   (deleted), leaving the live state untouched.
+# - A session journal records which cluster a directory was
+#   switched away from, so an interrupted bringup/bringdown
+#   can switch it back on the next start.
+#
+
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+from qa_libraries.logger import log
+from qa_libraries.tfstate_store import STATE_FILE_NAMES, read_blob
+
+LOCK_FILE_NAME = ".qa_state.lock"
+SWAP_JOURNAL_NAME = ".qa_state_swap.json"
+SESSION_JOURNAL_NAME = ".qa_state_session.json"
+STAGED_SUFFIX = ".qa-staged"
+
+LOCK_TIMEOUT = float(os.getenv('QA_STATE_LOCK_TIMEOUT', '10'))
+
+_held_locks: Dict[str, list] = {}
+_held_locks_guard = threading.Lock()
+
+
+class StateLockedError(RuntimeError):
+    pass
+
+
+@contextmanager
+def state_lock(state_dir: str, timeout: float = LOCK_TIMEOUT) -> Iterator[None]:
+    """
+    Hold the advisory state lock of a directory. The lock is re-entrant within a process.
+    :param state_dir: The directory containing the Terraform state files.
+    :param timeout: Seconds to wait for another invocation to release the lock.
+    :raises StateLockedError: If the lock could not be acquired in time.
+    """
+    lock_path = os.path.join(os.path.realpath(state_dir), LOCK_FILE_NAME)
+    with _held_locks_guard:
+        held = _held_locks.setdefault(lock_path, [threading.RLock(), 0, None])
+    thread_lock = held[0]
+
+    if not thread_lock.acquire(timeout=timeout):
+        log.error(f"State directory '{state_dir}' is locked by another thread.")
+        raise StateLockedError(f"State directory '{state_dir}' is locked by another thread.")
+    try:
+        if held[1] == 0:
+            lock_file = open(lock_path, 'a+')
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        lock_file.close()
+                        log.error(f"State directory '{state_dir}' is locked by another QA invocation.")
+                        raise StateLockedError(f"State directory '{state_dir}' is locked by another QA invocation "
+                                               f"(lock file: {lock_path}).")
+                    time.sleep(0.2)
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(f"{os.getpid()}\n")
+            lock_file.flush()
+            held[2] = lock_file
+        held[1] += 1
+        try:
+            yield
+        finally:
+            held[1] -= 1
+            if held[1] == 0:
+                fcntl.flock(held[2], fcntl.LOCK_UN)
+                held[2].close()
+                held[2] = None
+    finally:
+        thread_lock.release()
+
+
+def _fsync_dir(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_journal(path: str, data: Dict) -> None:
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(data, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    _fsync_dir(os.path.dirname(path))
+
+
+def _read_journal(path: str) -> Optional[Dict]:
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError:
+        # A journal is written atomically, so a corrupt one was never committed
+        log.warning(f"Ignoring unreadable journal '{path}'.")
+        os.remove(path)
+        return None
+
+
+def _staged_path(state_dir: str, file_name: str) -> str:
+    return os.path.join(state_dir, f".{file_name}{STAGED_SUFFIX}")
+
+
+def _commit_swap(state_dir: str, journal: Dict) -> None:
+    for file_name in STATE_FILE_NAMES:
+        live_path = os.path.join(state_dir, file_name)
+        staged_path = _staged_path(state_dir, file_name)
+        if file_name in journal["files"]:
+            # Already renamed if the staged copy is gone (roll-forward after a crash)
+            if os.path.exists(staged_path):
+                os.replace(staged_path, live_path)
+        elif os.path.exists(live_path):
+            os.remove(live_path)
+    _fsync_dir(state_dir)
+    os.remove(os.path.join(state_dir, SWAP_JOURNAL_NAME))
+    _fsync_dir(state_dir)
+
+
+def recover_state_swap(state_dir: str) -> None:
+    """
+    Finish or undo a state swap that was interrupted. Must be called with the state lock held.
+    :param state_dir: The directory containing the Terraform state files.
+    """
+    journal = _read_journal(os.path.join(state_dir, SWAP_JOURNAL_NAME))
+    if journal:
+        log.warning(f"Rolling forward an interrupted state swap in '{state_dir}' "
+                    f"(cluster '{journal['cluster']}', snapshot {journal['snapshot_id']}).")
+        _commit_swap(state_dir, journal)
+        return
+
+    for file_name in STATE_FILE_NAMES:
+        staged_path = _staged_path(state_dir, file_name)
+        if os.path.exists(staged_path):
+            log.warning(f"Rolling back an interrupted state swap in '{state_dir}': removing {staged_path}")
+            os.remove(staged_path)
+
+
+def swap_state_files(state_dir: str, cluster_name: str, snapshot: Optional[Dict], store_dir: str) -> None:
+    """
+    Atomically replace the live state files of a directory with those of a snapshot.
+    :param state_dir: The directory containing the Terraform state files.
+    :param cluster_name: The cluster the snapshot belongs to.
+    :param snapshot: The snapshot entry to swap in, or None to remove the live state files.
+    :param store_dir: The state store holding the snapshot blobs.
+    """
+    files = snapshot["files"] if snapshot else {}
+    with state_lock(state_dir):
+        recover_state_swap(state_dir)
+
+        # 1. Stage the new files next to the live ones
+        for file_name, digest in files.items():
+            staged_path = _staged_path(state_dir, file_name)
+            read_blob(store_dir, digest, staged_path)
+            with open(staged_path, 'rb') as file:
+                os.fsync(file.fileno())
+
+        # 2. Write the journal: from here on the swap is rolled forward after a crash
+        _write_journal(os.path.join(state_dir, SWAP_JOURNAL_NAME), {
+            "cluster": cluster_name,
+            "snapshot_id": snapshot["id"] if snapshot else None,
+            "files": files,
+        })
+
+        # 3. Rename the staged files over the live ones and remove the journal
+        _commit_swap(state_dir, {"files": files})
+
+
+def read_session(state_dir: str) -> Optional[Dict]:
+    """
+    Read the session journal of a directory.
+    :param state_dir: The directory containing the Terraform state files.
+    :return: The session entry, or None if no session is in progress.
+    """
+    return _read_journal(os.path.join(state_dir, SESSION_JOURNAL_NAME))
+
+
+def begin_session(state_dir: str, target_cluster_name: str, previous_cluster_name: Optional[str],
+                  main_tf_cluster_setting: str) -> None:
+    """
+    Record that a directory is being switched to a cluster for the duration of a run.
+    :param state_dir: The directory containing the Terraform state files.
+    :param target_cluster_name: The cluster the directory is switched to.
+    :param previous_cluster_name: The cluster whose state was live before the switch, if any.
+    :param main_tf_cluster_setting: The cluster name main.tf had before the switch.
+    """
+    _write_journal(os.path.join(state_dir, SESSION_JOURNAL_NAME), {
+        "target": target_cluster_name,
+        "previous": previous_cluster_name,
+        "main_tf_cluster_setting": main_tf_cluster_setting,
+        "pid": os.getpid(),
+        "started": time.time(),
+    })
+
+
+def end_session(state_dir: str) -> None:
+    """
+    Record that a directory was switched back after a run.
+    :param state_dir: The directory containing the Terraform state files.
+    """
+    session_path = os.path.join(state_dir, SESSION_JOURNAL_NAME)
+    if os.path.exists(session_path):
+        os.remove(session_path)
+        _fsync_dir(state_dir)
@@ -28,16 +28,70 @@
 #
 
 import configparser
-from datetime import datetime
-from git import Repo, InvalidGitRepositoryError
-import json
 import os
-import shutil
-import subprocess
-import sys
-from typing import Optional
-
-from qa_libraries.logger import log
+from typing import Callable, List, Optional
+
+from qa_libraries.async_engine import Step, StepFailedError, run_step_sync, run_steps_sync
+from qa_libraries.command_runner import DEFAULT_TAIL_LINES
+from qa_libraries.drift_check import check_drift, forget_apply, log_drift, record_successful_apply
+from qa_libraries.eks_auth import PER_CLUSTER_KUBECONFIG, get_kubeconfig_command, remove_cluster_credentials, \
+    write_kubeconfig
+from qa_libraries.instrumentation import timed
+from qa_libraries.lazy_imports import lazy_import
+from qa_libraries.logger import drain_logs, log
+from qa_libraries.read_cache import AWS_READ_TTL, CachedRead, aws_scope, cached_read, invalidate, using_kubeconfig
+from qa_libraries.run_journal import RunJournal, current_journal, run_journal
+from qa_libraries.smoketest_runner import run_smoketests
+from qa_libraries.state_swap import (
+    begin_session,
+    end_session,
+    read_session,
+    recover_state_swap,
+    state_lock,
+    swap_state_files,
+)
+from qa_libraries.tf_init_cache import get_init_step, get_terraform_env
+from qa_libraries.tf_plan import (
+    PLAN_FILE,
+    ApplyOptions,
+    get_apply_command,
+    get_apply_targets,
+    get_plan_command,
+    log_plan_summary,
+    read_plan,
+    summarize_plan,
+)
+from qa_libraries.tfstate_index import StateParseError, get_state_index
+from qa_libraries.tfstate_store import (
+    find_snapshot,
+    get_state_store_dir,
+    import_legacy_backup,
+    list_snapshots,
+    snapshot_state_files,
+)
+
+# GitPython is only needed to locate and restore files of the repository
+git = lazy_import("git")
+
+AWS_REGION = "us-east-1"
+
+# Text output keeps the whole listing on a single line
+LIST_CLUSTERS_COMMAND = "aws eks list-clusters --query clusters --output text"
+
+# Steps that change the clusters, after which cached AWS/kubectl reads are stale
+MUTATING_STEPS = ("apply", "destroy")
+
+# Markers surrounding the cluster name setting in the target-cluster main.tf
+CLUSTER_NAME_START_MARKER = '  cluster_custom_name = "'
+CLUSTER_NAME_END_MARKER = '"'
+
+# Per-step timeouts (in seconds) for the cluster lifecycle steps
+STEP_TIMEOUTS = {
+    "init": int(os.getenv('QA_TIMEOUT_INIT', str(30 * 60))),
+    "apply": int(os.getenv('QA_TIMEOUT_APPLY', str(120 * 60))),
+    "destroy": int(os.getenv('QA_TIMEOUT_DESTROY', str(120 * 60))),
+    "aws": int(os.getenv('QA_TIMEOUT_AWS', str(5 * 60))),
+}
 
 
 def get_repo_root() -> str:
@@ -46,9 +100,9 @@ def get_repo_root() -> str:
     :return: The absolute path to the repository root.
     """
     try:
-        repo = Repo(os.getcwd(), search_parent_directories=True)
+        repo = git.Repo(os.getcwd(), search_parent_directories=True)
         return repo.git.rev_parse("--show-toplevel")
-    except InvalidGitRepositoryError as e:
+    except git.InvalidGitRepositoryError as e:
         log.error("Not a git repository.")
         raise Exception("Not a git repository.") from e
 
@@ -98,47 +152,27 @@ def extract_cluster_name(tf_state_file: str, cluster_dir: str) -> Optional[str]:
     """
     Extract the cluster name from a Terraform state file.
 
+    The name comes from the cached state index (see tfstate_index), so an unchanged state file
+    is only parsed once.
+
     :param tf_state_file: The path to the Terraform state file.
     :param cluster_dir: The directory containing the state file.
     :return: The cluster name associated with the state file, or None if not found.
     """
     full_path = os.path.join(cluster_dir, tf_state_file)
     try:
-        with open(full_path, 'r') as file:
-            state_data = json.load(file)
-
-            # Look for the cluster name in aws_eks_cluster and aws_ec2_tag resources
-            resources = state_data.get('resources', [])
-            for resource in resources:
-                if resource.get('type') == 'aws_eks_cluster':
-                    instances = resource.get('instances', [])
-                    for instance in instances:
-                        attributes = instance.get('attributes', {})
-
-                        # Check for 'name' attribute under aws_eks_cluster
-                        if 'name' in attributes:
-                            cluster_name = attributes['name']
-                            log.info(f"Cluster name '{cluster_name}' extracted from '{tf_state_file}'.")
-                            return cluster_name
-
-                elif resource.get('type') == 'aws_ec2_tag':
-                    instances = resource.get('instances', [])
-                    for instance in instances:
-                        attributes = instance.get('attributes', {})
-                        key = attributes.get('key', '')
-
-                        # Extract the cluster name from the key if it matches the pattern
-                        if key.startswith('kubernetes.io/cluster/'):
-                            cluster_name = key.split('/')[-1]
-                            log.info(f"Cluster name '{cluster_name}' extracted from '{tf_state_file}' via aws_ec2_tag.")
-                            return cluster_name
-
-    except (FileNotFoundError, json.JSONDecodeError):
+        state_index = get_state_index(full_path)
+    except (FileNotFoundError, StateParseError):
         log.error(f"Failed to read or parse '{tf_state_file}'.")
         return None
 
-    log.warning(f"No valid cluster name found in '{tf_state_file}'.")
-    return None
+    if state_index.cluster_name is None:
+        log.warning(f"No valid cluster name found in '{tf_state_file}'.")
+        return None
+
+    via = "" if state_index.cluster_name_source == 'aws_eks_cluster' else f" via {state_index.cluster_name_source}"
+    log.info(f"Cluster name '{state_index.cluster_name}' extracted from '{tf_state_file}'{via}.")
+    return state_index.cluster_name
 
 
 def validate_current_tfstate_cluster_name(state_files: list, cluster_dir: str) -> str:
@@ -174,106 +208,205 @@ def validate_current_tfstate_cluster_name(state_files: list, cluster_dir: str) -
     return validated_cluster_name
 
 
-def create_tf_state_subdir(current_tf_statefile_cluster_name: str, cluster_dir: str) -> str:
+@timed("tfstate_backup", "state", label_arg="cluster_name")
+def backup_tfstate_files(cluster_dir: str, store_dir: Optional[str] = None,
+                         cluster_name: Optional[str] = None) -> Optional[str]:
     """
-    Create a subdirectory named 'tf.state_<current_tf_statefile_cluster_name>' in the specified directory.
+    Back up existing Terraform state files in the specified directory as a snapshot in the state store.
 
-    :param current_tf_statefile_cluster_name: The cluster name extracted from the Terraform state file.
-    :param cluster_dir: The directory where the subdirectory will be created.
-    :return: The path to the created subdirectory.
+    Nothing is copied when the state is unchanged since the cluster's newest snapshot.
+
+    :param cluster_dir: The directory containing the Terraform files.
+    :param store_dir: The state store directory, defaults to '<cluster_dir>/tf.state_store'.
+    :param cluster_name: The cluster the state belongs to. Only needed when the state may no longer
+                         name its cluster (e.g. right after a destroy); otherwise it is read from the state.
+    :return: The name of the cluster whose state was backed up, or None if no state files were found.
     """
-    # Construct the subdirectory name
-    subdir_name = f"tf.state_{current_tf_statefile_cluster_name}"
-    subdir_path = os.path.join(cluster_dir, subdir_name)
+    with state_lock(cluster_dir):
+        recover_state_swap(cluster_dir)
 
-    # Create the subdirectory if it doesn't already exist
-    if not os.path.exists(subdir_path):
-        os.makedirs(subdir_path)
-        log.info(f"Created subdirectory: {subdir_path}")
-    else:
-        log.warning(f"Subdirectory already exists: {subdir_path}")
+        # Check if any Terraform state files exist
+        state_files = check_tf_state_files_exist(cluster_dir)
+        if not state_files:
+            log.info("No Terraform state files found; no backup needed.")
+            return None
 
-    return subdir_path
+        # Validate and extract the current cluster name from state files
+        try:
+            current_tfstate_cluster_name = validate_current_tfstate_cluster_name(state_files, cluster_dir)
+        except ValueError:
+            if not cluster_name:
+                raise
+            current_tfstate_cluster_name = cluster_name
+        if not current_tfstate_cluster_name:
+            log.error("Unable to determine cluster name from the state files. Backup aborted.")
+            raise RuntimeError("Failed to determine the cluster name from the state files.")
+        if cluster_name and current_tfstate_cluster_name != cluster_name:
+            log.error(f"State files belong to cluster '{current_tfstate_cluster_name}', expected '{cluster_name}'.")
+            raise RuntimeError(f"State files belong to cluster '{current_tfstate_cluster_name}', "
+                               f"expected '{cluster_name}'.")
+
+        store_dir = store_dir or get_state_store_dir(cluster_dir)
+        snapshot = snapshot_state_files(current_tfstate_cluster_name, state_files, store_dir)
+
+    log.info(f"Backed up Terraform state files of '{current_tfstate_cluster_name}' as snapshot {snapshot['id']}.")
+    return current_tfstate_cluster_name
+
+
+@timed("tfstate_restore", "state", label_arg="target_cluster_name")
+def restore_tfstate_files(target_cluster_name: str, cluster_dir: str, snapshot_id: Optional[str] = None,
+                          store_dir: Optional[str] = None, current_cluster_name: Optional[str] = None) -> Optional[str]:
+    """
+    Backup the current Terraform state files and restore the state of the target cluster from the state store.
 
+    A legacy 'tf.state_<cluster>' backup directory is imported into the store the first time it is needed.
+    If the target cluster has no saved state, the current state files are removed so Terraform starts
+    from an empty state.
 
-def backup_tfstate_files(cluster_dir: str) -> Optional[str]:
+    :param target_cluster_name: The cluster whose state is restored.
+    :param cluster_dir: The directory containing the Terraform files.
+    :param snapshot_id: The snapshot to restore (or a unique prefix of its id), defaults to the newest one.
+    :param store_dir: The state store directory, defaults to '<cluster_dir>/tf.state_store'.
+    :param current_cluster_name: The cluster the current state files belong to (see backup_tfstate_files).
+    :return: The name of the cluster whose state was backed up before the restore, or None if no backup was made.
     """
-    Back up existing Terraform state files in the specified directory.
+    store_dir = store_dir or get_state_store_dir(cluster_dir)
+    log.info(f"Attempting to restore state files of cluster '{target_cluster_name}' to {cluster_dir}")
 
-    :param cluster_dir: The directory containing the Terraform files.
-    :return: The name of the backup directory created, or None if no state files were found.
+    with state_lock(cluster_dir):
+        # First, perform a backup of the current state files
+        previous_cluster_name = backup_tfstate_files(cluster_dir, store_dir, current_cluster_name)
+        if not previous_cluster_name:
+            log.info("No current state files were found to backup.")
+
+        if not list_snapshots(target_cluster_name, store_dir):
+            import_legacy_backup(target_cluster_name, os.path.dirname(store_dir), store_dir)
+
+        snapshot = find_snapshot(target_cluster_name, store_dir, snapshot_id)
+        if snapshot is None:
+            log.warning(f"No saved state found for cluster '{target_cluster_name}'; starting from an empty state.")
+        swap_state_files(cluster_dir, target_cluster_name, snapshot, store_dir)
+
+    if snapshot:
+        log.info(f"Restored snapshot {snapshot['id']} (serial {snapshot['serial']}) of cluster "
+                 f"'{target_cluster_name}' to '{cluster_dir}'.")
+
+    return previous_cluster_name
+
+
+def get_live_cluster_name(cluster_dir: str) -> Optional[str]:
+    """
+    Get the cluster the live state files of a directory belong to.
+    :param cluster_dir: The directory containing the Terraform state files.
+    :return: The cluster name, or None if there is no state or it names no single cluster.
     """
-    # Check if any Terraform state files exist
     state_files = check_tf_state_files_exist(cluster_dir)
     if not state_files:
-        log.info("No Terraform state files found; no backup needed.")
+        return None
+    try:
+        return validate_current_tfstate_cluster_name(state_files, cluster_dir)
+    except ValueError:
         return None
 
-    # Validate and extract the current cluster name from state files
-    current_tfstate_cluster_name = validate_current_tfstate_cluster_name(state_files, cluster_dir)
-    if not current_tfstate_cluster_name:
-        log.error("Unable to determine cluster name from the state files. Backup aborted.")
-        raise RuntimeError("Failed to determine the cluster name from the state files.")
-
-    # Create a backup directory based on the current cluster name
-    backup_dir = create_tf_state_subdir(current_tfstate_cluster_name, cluster_dir)
 
-    for state_file in state_files:
-        src_file = os.path.join(cluster_dir, state_file)
-        dst_file = os.path.join(backup_dir, os.path.basename(state_file))
+def recover_interrupted_session(cluster_dir: str) -> None:
+    """
+    Switch a target-cluster directory back to its previous cluster after an interrupted bringup/bringdown.
 
-        if os.path.exists(dst_file):
-            os.remove(dst_file)
+    The state left behind by the interrupted run is snapshotted under the cluster it was running for,
+    main.tf is reverted and the state of the cluster that was live before the run is restored.
+    Must be called with the state lock held.
 
-        shutil.copy(src_file, dst_file)
+    :param cluster_dir: The target-cluster directory.
+    :return: None
+    """
+    session = read_session(cluster_dir)
+    if not session:
+        return
 
-    log.info(f"Backed up Terraform state files to {backup_dir}.")
-    return backup_dir
+    log.warning(f"Recovering from an interrupted run for cluster '{session['target']}' (pid {session['pid']}); "
+                f"switching '{cluster_dir}' back to '{session['previous']}'.")
+    revert_target_cluster(session['main_tf_cluster_setting'], cluster_dir)
 
+    # The live state normally belongs to the interrupted target, unless the run died before switching it
+    live_cluster_name = get_live_cluster_name(cluster_dir) or session['target']
+    if session['previous']:
+        restore_tfstate_files(session['previous'], cluster_dir, current_cluster_name=live_cluster_name)
+    else:
+        store_dir = get_state_store_dir(cluster_dir)
+        backup_tfstate_files(cluster_dir, store_dir, live_cluster_name)
+        swap_state_files(cluster_dir, session['target'], None, store_dir)
+    end_session(cluster_dir)
 
-def restore_tfstate_files(requested_tfstate_backup_dir: str, cluster_dir: str) -> Optional[str]:
-    """
-    Backup the current Terraform state files and restore from the requested backup directory.
 
-    :param requested_tfstate_backup_dir: The backup directory containing the requested state files.
-    :param cluster_dir: The directory containing the Terraform files.
-    :return: The path to the backup directory created before the restore, or None if no backup was made.
+def run_in_target_cluster_dir(target_cluster_name: str, run: Callable[[str], bool],
+                              snapshot_id: Optional[str] = None) -> bool:
     """
-    log.info(f"Attempting to restore state files from backup directory: {requested_tfstate_backup_dir} to {cluster_dir}")
+    Switch the shared target-cluster directory to a cluster, run a function and switch it back.
 
-    # First, perform a backup of the current state files
-    backup_dir = backup_tfstate_files(cluster_dir)
-    if not backup_dir:
-        log.info("No current state files were found to backup.")
+    The directory's state lock is held for the whole run, so a second invocation waits (or fails)
+    instead of swapping the state under a running terraform. A session journal records the switch,
+    so that if this process dies the next invocation switches the directory back first.
 
-    # Validate that the requested backup directory exists and contains state files
-    state_files = check_tf_state_files_exist(requested_tfstate_backup_dir)
-    if not state_files:
-        log.warning(f"No state files found in the requested backup directory '{requested_tfstate_backup_dir}'.")
-        return None
+    :param target_cluster_name: The name of the cluster to switch to.
+    :param run: Called with the cluster directory once it is switched; returns True on success.
+    :param snapshot_id: The state snapshot of the cluster to start from, defaults to the newest one.
+    :return: The result of the run.
+    """
+    cluster_dir = get_target_cluster_dir()
+    with state_lock(cluster_dir):
+        recover_state_swap(cluster_dir)
+        recover_interrupted_session(cluster_dir)
+
+        previous_cluster_name = get_live_cluster_name(cluster_dir)
+        initial_main_tf_cluster_setting, cluster_dir = set_target_cluster(target_cluster_name)
+        begin_session(cluster_dir, target_cluster_name, previous_cluster_name, initial_main_tf_cluster_setting)
+        try:
+            # Perform restoration of the appropriate state files for the target cluster
+            restored_from = restore_tfstate_files(target_cluster_name, cluster_dir, snapshot_id=snapshot_id,
+                                                  current_cluster_name=previous_cluster_name)
+            previous_cluster_name = restored_from or previous_cluster_name
+            return run(cluster_dir)
+        finally:
+            revert_target_cluster(initial_main_tf_cluster_setting, cluster_dir)
+            if previous_cluster_name and previous_cluster_name != target_cluster_name:
+                restore_tfstate_files(previous_cluster_name, cluster_dir,
+                                      current_cluster_name=get_live_cluster_name(cluster_dir) or target_cluster_name)
+            end_session(cluster_dir)
+
+
+def get_target_cluster_dir() -> str:
+    """
+    Get the target-cluster directory configured in setup.cfg.
+    :return: The absolute path to the target-cluster directory (i.e. the 'example' directory).
+    """
+    repo_root = get_repo_root()
+    config_path = os.path.join(repo_root, "qa_testing", "configs", "setup.cfg")
+    cluster_dir_name = read_config_value(config_path, "Target_Cluster_Dir")
+    return os.path.join(repo_root, cluster_dir_name)
 
-    # Remove existing state files in the current directory to avoid mismatches
-    existing_state_files = check_tf_state_files_exist(cluster_dir)
-    if existing_state_files:
-        for state_file in existing_state_files:
-            try:
-                os.remove(state_file)
-                log.info(f"Deleted existing state file: {state_file}")
-            except OSError as e:
-                log.error(f"Failed to delete state file '{state_file}': {e}")
-                raise RuntimeError(f"Failed to delete existing state file '{state_file}'. Restoration aborted.")
-
-    # Copy the state files from the requested backup directory to the main directory
-    for state_file in state_files:
-        src_file = os.path.join(requested_tfstate_backup_dir, state_file)
-        dst_file = os.path.join(cluster_dir, os.path.basename(state_file))
 
-        log.info(f"Copying '{src_file}'")
-        shutil.copy2(src_file, dst_file)
+def get_main_tf_cluster_name(data: str) -> str:
+    """
+    Get the cluster_custom_name value from the contents of a main.tf file.
+    :param data: The contents of the main.tf file.
+    :return: The cluster name currently set in the main.tf contents.
+    """
+    start_index = data.find(CLUSTER_NAME_START_MARKER) + len(CLUSTER_NAME_START_MARKER)
+    end_index = data.find(CLUSTER_NAME_END_MARKER, start_index)
+    return data[start_index:end_index]
 
-    log.info(f"Restored state files to '{cluster_dir}'.")
 
-    return backup_dir
+def set_main_tf_cluster_name(data: str, target_cluster_name: str) -> str:
+    """
+    Replace the cluster_custom_name value in the contents of a main.tf file.
+    :param data: The contents of the main.tf file.
+    :param target_cluster_name: The cluster name to set.
+    :return: The updated main.tf contents.
+    """
+    current_cluster_name = get_main_tf_cluster_name(data)
+    return data.replace(f'{CLUSTER_NAME_START_MARKER}{current_cluster_name}{CLUSTER_NAME_END_MARKER}',
+                        f'{CLUSTER_NAME_START_MARKER}{target_cluster_name}{CLUSTER_NAME_END_MARKER}')
 
 
 def set_target_cluster(target_cluster_name: str) -> (str, str):
@@ -286,10 +419,7 @@ def set_target_cluster(target_cluster_name: str) -> (str, str):
         log.error("Cluster name must be provided.")
         raise ValueError("Cluster name must be provided.")
 
-    repo_root = get_repo_root()
-    config_path = os.path.join(repo_root, "qa_testing", "configs", "setup.cfg")
-    cluster_dir_name = read_config_value(config_path, "Target_Cluster_Dir")
-    cluster_dir = os.path.join(repo_root, cluster_dir_name)
+    cluster_dir = get_target_cluster_dir()
     main_tf_file = os.path.join(cluster_dir, "main.tf")
 
     # Change directory to "Energon-Kube/cluster_dir"
@@ -301,22 +431,19 @@ def set_target_cluster(target_cluster_name: str) -> (str, str):
             data = file.read()
 
             # Extract the current cluster name from the file
-            start_marker = '  cluster_custom_name = "'
-            end_marker = '"'
-            start_index = data.find(start_marker) + len(start_marker)
-            end_index = data.find(end_marker, start_index)
-            initial_main_tf_cluster_setting = data[start_index:end_index]
+            initial_main_tf_cluster_setting = get_main_tf_cluster_name(data)
 
             # Prompt user if there is a mismatch
             if initial_main_tf_cluster_setting != target_cluster_name:
                 log.warning(f"Cluster mismatch: main.tf has '{initial_main_tf_cluster_setting}', but target is '{target_cluster_name}'.")
+                drain_logs()
                 response = input(f"Cluster mismatch: main.tf has '{initial_main_tf_cluster_setting}', but target is '{target_cluster_name}'. Do you want to change the main.tf to the target cluster '{target_cluster_name}'? (yes/no): ")
                 if response.lower() != 'yes':
                     log.info("Operation aborted by the user.")
                     raise SystemExit("Operation aborted by the user.")
 
                 # Replace the line with the new cluster name
-                data = data.replace(f'{start_marker}{initial_main_tf_cluster_setting}{end_marker}', f'{start_marker}{target_cluster_name}{end_marker}')
+                data = set_main_tf_cluster_name(data, target_cluster_name)
 
                 # Write updated data back to the file
                 file.seek(0)
@@ -350,7 +477,7 @@ def revert_target_cluster(initial_main_tf_cluster_setting: str, cluster_dir: str
         """
         try:
             # Locate the repository root
-            repo = Repo(os.getcwd(), search_parent_directories=True)
+            repo = git.Repo(os.getcwd(), search_parent_directories=True)
 
             # Revert the file to its last committed state
             repo.git.checkout('--', file_path)
@@ -363,70 +490,279 @@ def revert_target_cluster(initial_main_tf_cluster_setting: str, cluster_dir: str
     print(f"Cluster setting reverted to '{initial_main_tf_cluster_setting}' in the main.tf")
 
 
-def run_command(command: str) -> (str, str, int):
+def run_command(command: str, cwd: Optional[str] = None, label: Optional[str] = None,
+                tail_lines: int = DEFAULT_TAIL_LINES, timeout: Optional[float] = None) -> (str, str, int):
     """
-    Run a shell command and return the captured output and error separately.
+    Run a command and return the captured output and error separately.
+
+    The command is run by the async engine (no shell; the executable is resolved on PATH). Both
+    streams are drained concurrently and written in full to the rotating command log (see
+    command_runner); only the last `tail_lines` lines of each are returned.
+
     :param command: Command to run.
+    :param cwd: Directory to run the command in, defaults to the current working directory.
+    :param label: Optional label prefixed to each logged output line (e.g. the cluster name).
+    :param tail_lines: Number of trailing output lines per stream to return.
+    :param timeout: Seconds after which the command is killed, defaults to no timeout.
     :return: A tuple containing captured stdout, stderr, and the return code.
     """
-    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    result = run_step_sync(Step("command", command, timeout=timeout, cwd=cwd, label=label), tail_lines)
+    return result.stdout_tail, result.stderr_tail, result.returncode
+
+
+def run_cluster_steps(steps: List[Step]) -> bool:
+    """
+    Run the steps of a cluster lifecycle operation, stopping at the first failure.
+    When the operation is journaled (see run_journal), the steps completed by a previous run are
+    skipped and each step is recorded in the journal as it completes.
+
+    :param steps: The steps to run (see async_engine.run_steps).
+    :return: True if every step succeeded, False otherwise.
+    """
+    journal = current_journal()
+    if journal:
+        steps = journal.checkpoint(steps)
+    try:
+        run_steps_sync(steps)
+
+    except StepFailedError as e:
+        if journal:
+            journal.mark_failed(e.step.name, str(e))
+        log.error(str(e))
+        log.error(f"Output: {e.result.stdout_tail}")
+        log.error(f"Error: {e.result.stderr_tail}")
+        log.error(f"Full output in: {e.result.log_file}")
+        return False
+    except Exception as e:
+        log.error(f"An error occurred: {e}")
+        return False
+    finally:
+        # Even a failed apply/destroy may have changed the clusters
+        mutating = [step.name for step in steps if step.name in MUTATING_STEPS]
+        if mutating:
+            invalidate(f"terraform {'/'.join(mutating)}")
 
-    stdout_cache = ""
-    stderr_cache = ""
-    while True:
-        output = process.stdout.readline()
-        if output == "" and process.poll() is not None:
-            break
-        if output:
-            log.info(output.strip())
-            stdout_cache += output
+    return True
+
+
+def get_bringup_steps(target_cluster_name: str, cwd: Optional[str] = None, upgrade: bool = False,
+                      apply_command: Optional[str] = "terraform apply -auto-approve",
+                      init: bool = True) -> List[Step]:
+    """
+    Get the steps used to bring up a cluster.
 
-    stderr = process.communicate()[1]
-    if stderr:
-        log.error(stderr.strip())  # Using ERROR to log stderr messages
-        stderr_cache += stderr
+    'terraform init' is skipped when the directory is already initialized for its configuration
+    (see tf_init_cache). Updating the kubeconfig and verifying the cluster listing both only depend
+    on the apply, so they run concurrently.
 
-    return stdout_cache, stderr_cache, process.returncode
+    :param target_cluster_name: The name of the cluster to bring up.
+    :param cwd: The cluster's working directory, defaults to the current working directory.
+    :param upgrade: Run 'terraform init -upgrade' to update the providers and modules.
+    :param apply_command: The apply command (see tf_plan.get_apply_command), None when there is nothing to apply.
+    :param init: Include the 'terraform init' step (False when a plan step already initialized the directory).
+    :return: The list of steps to run.
+    """
+    steps = []
+    init_step = get_init_step(target_cluster_name, cwd=cwd, upgrade=upgrade, timeout=STEP_TIMEOUTS["init"]) \
+        if init else None
+    if init_step:
+        steps.append(init_step)
+    if apply_command:
+        steps.append(Step("apply", apply_command, after=[step.name for step in steps],
+                          timeout=STEP_TIMEOUTS["apply"], cwd=cwd, env=get_terraform_env(),
+                          label=target_cluster_name))
+    after = [step.name for step in steps[-1:]]
+
+    # The cluster may have been created (or re-created) by the apply, so its kubeconfig is rewritten
+    return steps + [
+        Step("kubeconfig", get_kubeconfig_command(target_cluster_name, AWS_REGION),
+             after=after, timeout=STEP_TIMEOUTS["aws"], cwd=cwd, label=target_cluster_name),
+        Step("verify", "aws eks list-clusters --query clusters", after=after,
+             timeout=STEP_TIMEOUTS["aws"], cwd=cwd, label=target_cluster_name),
+    ]
+
+
+def run_bringup_steps(target_cluster_name: str, cwd: Optional[str] = None, upgrade: bool = False,
+                      apply_options: Optional[ApplyOptions] = None) -> bool:
+    """
+    Run the bringup steps of a cluster, planning first when requested (see tf_plan).
 
+    Init and apply are skipped when nothing changed since the last successful apply of the cluster
+    in this directory and the cluster still exists (see drift_check). In plan-then-apply mode, a plan
+    without changes skips the apply, and otherwise only the modules/resources with pending changes
+    are applied.
 
-def bringup_cluster(target_cluster_name: str):
+    :param target_cluster_name: The name of the cluster to bring up.
+    :param cwd: The cluster's working directory, defaults to the current working directory.
+    :param upgrade: Run 'terraform init -upgrade' to update the providers and modules (never skipped).
+    :param apply_options: Plan-first mode, the drift check and the -refresh/-parallelism tuning,
+                          defaults to a full apply unless nothing changed.
+    :return: True if every step succeeded, False otherwise.
+    """
+    apply_options = apply_options or ApplyOptions()
+    workdir = cwd or os.getcwd()
+    journal = current_journal()
+    if journal and journal.is_done("apply"):
+        # Resuming after the apply: only the steps that follow it are left
+        succeeded = run_cluster_steps(get_bringup_steps(target_cluster_name, cwd=cwd, apply_command=None, init=False))
+        if succeeded:
+            record_successful_apply(target_cluster_name, workdir)
+        return succeeded
+
+    if apply_options.drift_check and not upgrade:
+        drift = check_drift(target_cluster_name, workdir)
+        if not drift.changed and not _cluster_listed(target_cluster_name):
+            drift.changed, drift.reason = True, "the cluster is not listed by AWS"
+        log_drift(drift, target_cluster_name)
+        if not drift.changed:
+            log.info(f"[{target_cluster_name}] Skipping terraform init and apply (use --force-apply to apply anyway).")
+            return run_cluster_steps(get_bringup_steps(target_cluster_name, cwd=cwd, apply_command=None, init=False))
+
+    # An apply failing halfway leaves the recorded fingerprint stale
+    forget_apply(target_cluster_name, workdir)
+    succeeded = _run_apply_steps(target_cluster_name, cwd, upgrade, apply_options)
+    if succeeded:
+        record_successful_apply(target_cluster_name, workdir)
+    return succeeded
+
+
+def _run_apply_steps(target_cluster_name: str, cwd: Optional[str], upgrade: bool,
+                     apply_options: ApplyOptions) -> bool:
+    if not apply_options.plan_first:
+        return run_cluster_steps(get_bringup_steps(target_cluster_name, cwd=cwd, upgrade=upgrade,
+                                                   apply_command=get_apply_command(apply_options)))
+
+    steps = []
+    init_step = get_init_step(target_cluster_name, cwd=cwd, upgrade=upgrade, timeout=STEP_TIMEOUTS["init"])
+    if init_step:
+        steps.append(init_step)
+    steps.append(Step("plan", get_plan_command(apply_options), after=[step.name for step in steps],
+                      timeout=STEP_TIMEOUTS["apply"], cwd=cwd, env=get_terraform_env(), label=target_cluster_name))
+
+    plan_file = os.path.join(cwd or os.getcwd(), PLAN_FILE)
+    try:
+        if not run_cluster_steps(steps):
+            return False
+        try:
+            summary = summarize_plan(read_plan(cwd or os.getcwd(), env=get_terraform_env(),
+                                               timeout=STEP_TIMEOUTS["init"], label=target_cluster_name))
+        except RuntimeError:
+            return False
+    finally:
+        # The saved plan may hold sensitive values
+        if os.path.exists(plan_file):
+            os.remove(plan_file)
+
+    log_plan_summary(summary, target_cluster_name)
+    targets = get_apply_targets(summary)
+    apply_command = get_apply_command(apply_options, targets) if targets != [] else None
+    return run_cluster_steps(get_bringup_steps(target_cluster_name, cwd=cwd, apply_command=apply_command,
+                                               init=False))
+
+
+def get_bringdown_steps(target_cluster_name: str, cwd: Optional[str] = None, upgrade: bool = False) -> List[Step]:
+    """
+    Get the steps used to bring down a cluster.
+
+    'terraform init' is skipped when the directory is already initialized for its configuration
+    (see tf_init_cache). Updating the kubeconfig runs concurrently with the init; the destroy
+    waits for both.
+
+    :param target_cluster_name: The name of the cluster to bring down.
+    :param cwd: The cluster's working directory, defaults to the current working directory.
+    :param upgrade: Run 'terraform init -upgrade' to update the providers and modules.
+    :return: The list of steps to run.
+    """
+    steps = [
+        Step("kubeconfig", get_kubeconfig_command(target_cluster_name, AWS_REGION, refresh=False),
+             timeout=STEP_TIMEOUTS["aws"], cwd=cwd, label=target_cluster_name),
+    ]
+    init_step = get_init_step(target_cluster_name, cwd=cwd, upgrade=upgrade, timeout=STEP_TIMEOUTS["init"])
+    if init_step:
+        steps.append(init_step)
+
+    return steps + [
+        Step("destroy", "terraform destroy -auto-approve", after=[step.name for step in steps],
+             timeout=STEP_TIMEOUTS["destroy"], cwd=cwd, env=get_terraform_env(), label=target_cluster_name,
+             on_success=lambda: remove_cluster_credentials(target_cluster_name)),
+        Step("verify", "aws eks list-clusters --query clusters", after=["destroy"],
+             timeout=STEP_TIMEOUTS["aws"], cwd=cwd, label=target_cluster_name),
+    ]
+
+
+@timed("bringup", "cluster", label_arg="target_cluster_name")
+def bringup_cluster(target_cluster_name: str, workdir: Optional[str] = None, upgrade: bool = False,
+                 snapshot_id: Optional[str] = None, apply_options: Optional[ApplyOptions] = None,
+                 resume: bool = False, smoketests: Optional[List[str]] = None) -> bool:
     """
     Bring up the cluster with the specified name.
+
+    Every completed stage is recorded in the cluster's run journal (see run_journal), so a failed
+    bringup can be resumed from its first stage that did not complete.
+
     :param target_cluster_name: The name of the cluster to bring up.
-    :return: None
+    :param workdir: An isolated working copy already prepared for the cluster (see cluster_orchestrator).
+                    When omitted, the shared target-cluster directory is switched to the cluster for the run.
+    :param upgrade: Run 'terraform init -upgrade' to update the providers and modules.
+    :param snapshot_id: The state snapshot of the cluster to start from, defaults to the newest one.
+                        Ignored with a workdir, whose state is prepared by the caller.
+    :param apply_options: Plan-first mode and the -refresh/-parallelism tuning (see tf_plan).
+    :param resume: Skip the stages completed by the previous bringup of the cluster if it failed.
+    :param smoketests: The smoketest scripts to run once the cluster is up, as the last stage.
+    :return: True if the cluster was brought up successfully, False otherwise.
     """
-    initial_main_tf_cluster_setting, cluster_dir = set_target_cluster(target_cluster_name)
+    def run(cluster_dir: str) -> bool:
+        with run_journal(target_cluster_name, "bringup", cluster_dir, resume=resume) as journal:
+            # The state was restored before the run (it always is: restoring it again is harmless)
+            journal.mark_done("state_restore")
+            if not run_bringup_steps(target_cluster_name, cwd=workdir, upgrade=upgrade, apply_options=apply_options):
+                return False
+            if smoketests and not run_smoketest_stage(target_cluster_name, smoketests, journal):
+                return False
+            journal.finish(True)
+            return True
 
-    # Perform restoration of the appropriate state files for the target cluster
-    requested_tfstate_backup_dir = os.path.join(cluster_dir, f"tf.state_{target_cluster_name}")
-    previous_tfstate_backup_dir = restore_tfstate_files(requested_tfstate_backup_dir, cluster_dir)
+    if workdir:
+        return run(workdir)
 
-    try:
-        commands = [
-            "terraform init",
-            "terraform apply -auto-approve",
-            f"aws eks update-kubeconfig --name {target_cluster_name} --region us-east-1",
-            "aws eks list-clusters --query clusters"
-        ]
-
-        stdout_stderr_cache = ""
-        for command in commands:
-            stdout, stderr, return_code = run_command(command)
-            stdout_stderr_cache += stdout + stderr
-            if return_code != 0:
-                raise subprocess.CalledProcessError(return_code, command, output=stdout, stderr=stderr)
-
-    except subprocess.CalledProcessError as e:
-        log.error(f"Command '{e.cmd}' failed with return code {e.returncode}")
-        log.error(f"Output: {e.output}")
-        log.error(f"Error: {e.stderr}")
-    except Exception as e:
-        log.error(f"An error occurred: {e}")
+    return run_in_target_cluster_dir(target_cluster_name, run, snapshot_id=snapshot_id)
 
-    revert_target_cluster(initial_main_tf_cluster_setting, cluster_dir)
 
-    if previous_tfstate_backup_dir:
-        restore_tfstate_files(previous_tfstate_backup_dir, cluster_dir)
+def run_smoketest_stage(target_cluster_name: str, script_names: List[str], journal: RunJournal) -> bool:
+    """
+    Run the smoketests of a bringup, skipping those that passed in the run being resumed.
+    :param target_cluster_name: The cluster to test.
+    :param script_names: The smoketest scripts to run.
+    :param journal: The journal of the bringup; each smoketest that passes is recorded in it.
+    :return: True if every smoketest passed, False otherwise.
+    """
+    remaining = [name for name in script_names if not journal.is_done(f"smoketest:{name}")]
+    if len(remaining) < len(script_names):
+        log.info(f"[{target_cluster_name}] Resuming: skipping {len(script_names) - len(remaining)} smoketests "
+                 f"that already passed.")
+    if not remaining:
+        return True
+
+    if PER_CLUSTER_KUBECONFIG:
+        # Clusters brought up concurrently each test through their own kubeconfig
+        try:
+            kubeconfig = write_kubeconfig(target_cluster_name, AWS_REGION)
+        except RuntimeError:
+            return False
+        with using_kubeconfig(kubeconfig):
+            results = run_smoketests(target_cluster_name, remaining)
+    else:
+        results = run_smoketests(target_cluster_name, remaining)
+    for result in results:
+        if result.passed:
+            journal.mark_done(f"smoketest:{result.name}")
+        else:
+            journal.mark_failed(f"smoketest:{result.name}", f"blocked by {', '.join(result.blocked_by)}"
+                                if result.blocked_by else f"return code {result.returncode}")
+    failed = [result.name for result in results if not result.passed]
+    if failed:
+        log.error(f"[{target_cluster_name}] {len(failed)} smoketests failed: {', '.join(failed)}")
+    return not failed
 
 
 def check_cluster_exists(cluster_name: str) -> bool:
@@ -435,70 +771,79 @@ def check_cluster_exists(cluster_name: str) -> bool:
     :param cluster_name: The name of the cluster to check.
     :return: True if the cluster exists, False otherwise.
     """
-    stdout, stderr, return_code = run_command("aws eks list-clusters --query clusters")
-    if return_code != 0:
-        log.error("Failed to retrieve the list of clusters.")
-        raise ValueError(f"Unable to list clusters from AWS: {stderr}")
+    listing = _read_cluster_list()
+    if cluster_name not in listing.text.split() and listing.hit:
+        # The cached listing may predate a cluster created outside the QA tools
+        listing = _read_cluster_list(refresh=True)
+    return cluster_name in listing.text.split()
 
+
+def _cluster_listed(cluster_name: str) -> bool:
     try:
-        clusters = json.loads(stdout)
-    except json.JSONDecodeError as e:
-        log.error(f"Failed to parse clusters JSON: {e}")
-        raise ValueError(f"Error parsing cluster data: {stderr}")
+        return check_cluster_exists(cluster_name)
+    except ValueError:
+        return False
+
 
-    return cluster_name in clusters
+def _read_cluster_list(refresh: bool = False) -> CachedRead:
+    listing = cached_read(LIST_CLUSTERS_COMMAND, aws_scope(), AWS_READ_TTL, refresh=refresh,
+                          timeout=STEP_TIMEOUTS["aws"])
+    if listing.returncode != 0:
+        log.error("Failed to retrieve the list of clusters.")
+        raise ValueError(f"Unable to list clusters from AWS: {listing.stderr}")
+    return listing
 
 
-def bringdown_cluster(target_cluster_name: str):
+def list_clusters(refresh: bool = False) -> List[str]:
+    """
+    List the EKS clusters of the current AWS account, reusing a recent listing (see read_cache).
+    :param refresh: Skip the cache and list the clusters live.
+    :return: The cluster names.
+    :raises ValueError: If the clusters cannot be listed.
+    """
+    return _read_cluster_list(refresh).text.split()
+
+
+@timed("bringdown", "cluster", label_arg="target_cluster_name")
+def bringdown_cluster(target_cluster_name: str, workdir: Optional[str] = None, upgrade: bool = False,
+                   snapshot_id: Optional[str] = None, resume: bool = False) -> bool:
     """
     Bring down the cluster with the specified name.
     :param target_cluster_name: The name of the cluster to bring down.
-    :return: None
+    :param workdir: An isolated working copy already prepared for the cluster (see cluster_orchestrator).
+                    When omitted, the shared target-cluster directory is switched to the cluster for the run.
+    :param upgrade: Run 'terraform init -upgrade' to update the providers and modules.
+    :param snapshot_id: The state snapshot of the cluster to start from, defaults to the newest one.
+                        Ignored with a workdir, whose state is prepared by the caller.
+    :param resume: Skip the stages completed by the previous bringdown of the cluster if it failed
+                   (see run_journal).
+    :return: True if the cluster was brought down (or did not exist), False otherwise.
     """
     if not check_cluster_exists(target_cluster_name):
         log.warning(f"Cluster: {target_cluster_name} not found, no cluster to bring down.")
-        available_clusters, _, return_code = run_command("aws eks list-clusters --query clusters --output text")
-        if return_code == 0:
+        try:
+            available_clusters = list_clusters()
+        except ValueError:
+            log.error("Failed to retrieve the list of available clusters.")
+        else:
             log.info("Available clusters in the current AWS account:")
-            for cluster in available_clusters.split():
+            for cluster in available_clusters:
                 log.info(f"  - {cluster}")
-        else:
-            log.error("Failed to retrieve the list of available clusters.")
-        return
-
-    initial_main_tf_cluster_setting, cluster_dir = set_target_cluster(target_cluster_name)
-
-    # Perform restoration of the appropriate state files for the target cluster
-    requested_tfstate_backup_dir = os.path.join(cluster_dir, f"tf.state_{target_cluster_name}")
-    previous_tfstate_backup_dir = restore_tfstate_files(requested_tfstate_backup_dir, cluster_dir)
-
-    # Only proceed with the terraform commands if state files were restored
-    if check_tf_state_files_exist(cluster_dir):
-        try:
-            commands = [
-                f"aws eks update-kubeconfig --name {target_cluster_name} --region us-east-1",
-                "terraform init -upgrade",  # Initialize Terraform to update cache before destroying
-                "terraform destroy -auto-approve",
-                "aws eks list-clusters --query clusters"
-            ]
-
-            stdout_stderr_cache = ""
-            for command in commands:
-                stdout, stderr, return_code = run_command(command)
-                stdout_stderr_cache += stdout + stderr
-                if return_code != 0:
-                    raise subprocess.CalledProcessError(return_code, command, output=stdout, stderr=stderr)
-
-        except subprocess.CalledProcessError as e:
-            log.error(f"Command '{e.cmd}' failed with return code {e.returncode}")
-            log.error(f"Output: {e.output}")
-            log.error(f"Error: {e.stderr}")
-        except Exception as e:
-            log.error(f"An error occurred: {e}")
-    else:
-        log.error("No restored Terraform state files found; aborting the cluster teardown.")
-
-    revert_target_cluster(initial_main_tf_cluster_setting, cluster_dir)
-
-    if previous_tfstate_backup_dir:
-        restore_tfstate_files(previous_tfstate_backup_dir, cluster_dir)
+        return True
+
+    def run(cluster_dir: str) -> bool:
+        # Only proceed with the terraform commands if state files were restored
+        if not check_tf_state_files_exist(cluster_dir):
+            log.error(f"No Terraform state files found in '{cluster_dir}'; aborting the cluster teardown.")
+            return False
+        forget_apply(target_cluster_name, cluster_dir)
+        with run_journal(target_cluster_name, "bringdown", cluster_dir, resume=resume) as journal:
+            journal.mark_done("state_restore")
+            succeeded = run_cluster_steps(get_bringdown_steps(target_cluster_name, cwd=workdir, upgrade=upgrade))
+            journal.finish(succeeded)
+            return succeeded
+
+    if workdir:
+        return run(workdir)
+
+    return run_in_target_cluster_dir(target_cluster_name, run, snapshot_id=snapshot_id)
@@ -0,0 +1,222 @@
+###########################################################
+#
+# Shared Terraform plugin/module cache and 'terraform init'
+# short-circuiting.
+#
+# - Providers are downloaded once into a plugin cache
+#   shared by every working directory (TF_PLUGIN_CACHE_DIR).
+# - Installed modules are kept in a module cache keyed by
+#   the module sources, and used to seed new working
+#   directories before their first init.
+# - After a successful init, a fingerprint of the lock file,
+#   required providers, module sources and backend
+#   configuration is stored in '.terraform'. While it still
+#   matches and the installed providers (and modules) are
+#   still there, init is skipped.
+#
+
+import hashlib
+import json
+import os
+import re
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+from qa_libraries.async_engine import Step
+from qa_libraries.logger import log
+from qa_libraries.qa_paths import QA_CACHE_DIR
+
+TERRAFORM_CACHE_DIR = os.getenv('QA_TERRAFORM_CACHE_DIR', os.path.join(QA_CACHE_DIR, "terraform"))
+PLUGIN_CACHE_DIR = os.path.join(TERRAFORM_CACHE_DIR, "plugin-cache")
+MODULE_CACHE_DIR = os.path.join(TERRAFORM_CACHE_DIR, "module-cache")
+
+INIT_FINGERPRINT_FILE = "qa_init_fingerprint.json"
+LOCK_FILE = ".terraform.lock.hcl"
+
+_BLOCK_START_PATTERN = re.compile(r'^\s*(module\s+"[^"]+"|backend\s+"[^"]+"|required_providers)\s*\{')
+_MODULE_SETTING_PATTERN = re.compile(r'^\s*(source|version)\s*=\s*(.+?)\s*$')
+
+
+def get_terraform_env() -> Dict[str, str]:
+    """
+    Get the environment variables that point Terraform at the shared plugin cache.
+    :return: The environment variables to add to every terraform command.
+    """
+    os.makedirs(PLUGIN_CACHE_DIR, exist_ok=True)
+    return {"TF_PLUGIN_CACHE_DIR": PLUGIN_CACHE_DIR}
+
+
+def _read_init_inputs(workdir: str) -> Tuple[Dict[str, List[str]], List[str], List[str]]:
+    """
+    Read the module sources/versions, backend blocks and required_providers blocks from the Terraform files of
+    a directory.
+    :param workdir: The Terraform working directory.
+    :return: A tuple of the module settings keyed by module block, the backend block lines and the
+             required_providers block lines.
+    """
+    modules = {}
+    backend_lines = []
+    provider_lines = []
+    for file_name in sorted(os.listdir(workdir)):
+        if not file_name.endswith(".tf"):
+            continue
+        with open(os.path.join(workdir, file_name), 'r') as file:
+            block, depth = None, 0
+            for line in file:
+                if block is None:
+                    match = _BLOCK_START_PATTERN.match(line)
+                    if not match:
+                        continue
+                    block, depth = match.group(1), 0
+                    if block.startswith("module"):
+                        modules[f"{file_name}:{block}"] = []
+
+                depth += line.count("{") - line.count("}")
+                if block.startswith("backend"):
+                    backend_lines.append(line.strip())
+                elif block == "required_providers":
+                    provider_lines.append(f"{file_name}:{line.strip()}")
+                elif depth == 1:
+                    setting = _MODULE_SETTING_PATTERN.match(line)
+                    if setting:
+                        modules[f"{file_name}:{block}"].append(f"{setting.group(1)}={setting.group(2)}")
+                if depth <= 0:
+                    block = None
+    return modules, backend_lines, provider_lines
+
+
+def compute_init_fingerprint(workdir: str) -> Dict[str, str]:
+    """
+    Compute the fingerprint of everything 'terraform init' depends on in a directory.
+    :param workdir: The Terraform working directory.
+    :return: The hashes of the lock file, required providers, module sources and backend configuration.
+    """
+    def digest(data: str) -> str:
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    lock_file = os.path.join(workdir, LOCK_FILE)
+    lock_data = ""
+    if os.path.exists(lock_file):
+        with open(lock_file, 'r') as file:
+            lock_data = file.read()
+
+    modules, backend_lines, provider_lines = _read_init_inputs(workdir)
+    for file_name in sorted(os.listdir(workdir)):
+        if file_name.endswith(".tfbackend"):
+            with open(os.path.join(workdir, file_name), 'r') as file:
+                backend_lines.append(f"{file_name}:{file.read()}")
+
+    return {
+        "lock_file": digest(lock_data),
+        "required_providers": digest("\n".join(provider_lines)),
+        "module_sources": digest(json.dumps(modules, sort_keys=True)),
+        "backend_config": digest("\n".join(backend_lines)),
+    }
+
+
+def _fingerprint_path(workdir: str) -> str:
+    return os.path.join(workdir, ".terraform", INIT_FINGERPRINT_FILE)
+
+
+def _installed_paths(workdir: str) -> List[str]:
+    # What init installs: the providers, and the modules manifest when the configuration calls modules
+    paths = [os.path.join(".terraform", "providers")]
+    if _read_init_inputs(workdir)[0]:
+        paths.append(os.path.join(".terraform", "modules", "modules.json"))
+    return paths
+
+
+def is_init_current(workdir: str) -> bool:
+    """
+    Check whether a directory is still initialized for its current configuration.
+    :param workdir: The Terraform working directory.
+    :return: True if the last successful init used the same lock file, required providers, module sources and
+             backend, and its providers and modules are still installed.
+    """
+    try:
+        with open(_fingerprint_path(workdir), 'r') as file:
+            recorded = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+
+    current = compute_init_fingerprint(workdir)
+    if recorded != current:
+        changed = [key for key in current if recorded.get(key) != current[key]]
+        log.info(f"Terraform init needed in '{workdir}', changed: {', '.join(changed)}")
+        return False
+
+    missing = [path for path in _installed_paths(workdir) if not os.path.exists(os.path.join(workdir, path))]
+    if missing:
+        log.info(f"Terraform init needed in '{workdir}', missing: {', '.join(missing)}")
+        return False
+    return True
+
+
+def _module_cache_path(workdir: str) -> str:
+    return os.path.join(MODULE_CACHE_DIR, compute_init_fingerprint(workdir)["module_sources"])
+
+
+def record_successful_init(workdir: str) -> None:
+    """
+    Record the init fingerprint of a directory and store its installed modules in the module cache.
+    :param workdir: The Terraform working directory that was just initialized.
+    :return: None
+    """
+    fingerprint_path = _fingerprint_path(workdir)
+    os.makedirs(os.path.dirname(fingerprint_path), exist_ok=True)
+    with open(fingerprint_path, 'w') as file:
+        json.dump(compute_init_fingerprint(workdir), file, indent=2)
+
+    installed_modules = os.path.join(workdir, ".terraform", "modules")
+    module_cache = _module_cache_path(workdir)
+    if os.path.isdir(installed_modules) and not os.path.isdir(module_cache):
+        staging_dir = f"{module_cache}.tmp-{os.getpid()}"
+        shutil.copytree(installed_modules, staging_dir, symlinks=True)
+        try:
+            os.rename(staging_dir, module_cache)
+        except OSError:
+            # Another run cached the same modules first
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def seed_modules_from_cache(workdir: str) -> bool:
+    """
+    Copy cached modules into a directory that has no installed modules yet.
+    :param workdir: The Terraform working directory.
+    :return: True if modules were seeded from the cache.
+    """
+    installed_modules = os.path.join(workdir, ".terraform", "modules")
+    module_cache = _module_cache_path(workdir)
+    if os.path.isdir(installed_modules) or not os.path.isdir(module_cache):
+        return False
+
+    try:
+        # Hardlinks make seeding a workspace nearly free; terraform never modifies installed module files
+        shutil.copytree(module_cache, installed_modules, symlinks=True, copy_function=os.link)
+    except (OSError, shutil.Error):
+        shutil.rmtree(installed_modules, ignore_errors=True)
+        shutil.copytree(module_cache, installed_modules, symlinks=True)
+    log.info(f"Seeded Terraform modules in '{workdir}' from the module cache.")
+    return True
+
+
+def get_init_step(target_cluster_name: str, cwd: Optional[str] = None, upgrade: bool = False,
+                  timeout: Optional[float] = None) -> Optional[Step]:
+    """
+    Get the 'terraform init' step for a directory, or None when init can be skipped.
+    :param target_cluster_name: The name of the cluster, used to label the output.
+    :param cwd: The Terraform working directory, defaults to the current working directory.
+    :param upgrade: Run 'terraform init -upgrade' (never skipped).
+    :param timeout: Seconds after which the init is killed.
+    :return: The init step, or None if the directory is already initialized for its configuration.
+    """
+    workdir = cwd or os.getcwd()
+    if not upgrade:
+        if is_init_current(workdir):
+            log.info(f"[{target_cluster_name}] Terraform init is up to date in '{workdir}', skipping init.")
+            return None
+        seed_modules_from_cache(workdir)
+
+    command = "terraform init -upgrade" if upgrade else "terraform init"
+    return Step("init", command, timeout=timeout, cwd=cwd, env=get_terraform_env(), label=target_cluster_name,
+                on_success=lambda: record_successful_init(workdir))
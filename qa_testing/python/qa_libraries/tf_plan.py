@@ -0,0 +1,204 @@
+###########################################################
+#
+# Plan-then-apply mode for the cluster bringup.
+#
+# Instead of one 'terraform apply' over the whole root module
+# (EKS, KMS, VPC, EFS, ALB, Route53 and the addons), which
+# refreshes every resource:
+#
+#   1. 'terraform plan -refresh=false -out=qa.tfplan' compares
+#      the configuration with the state without calling AWS,
+#   2. 'terraform show -json qa.tfplan' is parsed to find the
+#      modules and resources with pending changes,
+#   3. only those are applied, with one '-target' each, so
+#      only their part of the graph is refreshed and applied.
+#
+# A plan without changes skips the apply. A plan touching
+# more than QA_PLAN_MAX_TARGETS targets (e.g. the first
+# bringup of a cluster) falls back to a full apply.
+#
+
+from dataclasses import dataclass, field
+import json
+import os
+import re
+import shlex
+import subprocess
+from typing import Dict, List, Optional, Set
+
+from qa_libraries.instrumentation import span
+from qa_libraries.logger import log
+
+PLAN_FILE = "qa.tfplan"
+
+MAX_PLAN_TARGETS = int(os.getenv('QA_PLAN_MAX_TARGETS', '25'))
+
+# Plan actions that leave a resource as it is
+NO_CHANGE_ACTIONS = (["no-op"], ["read"])
+
+_MODULE_SEGMENT_PATTERN = re.compile(r'module\.[^.\[]+(?:\[[^\]]*\])?')
+
+
+@dataclass
+class ApplyOptions:
+    # Plan first and only apply the modules/resources with pending changes
+    plan_first: bool = False
+    # Pass -refresh=false to the apply (the discovery plan never refreshes)
+    refresh: bool = True
+    # Pass -parallelism=N to terraform plan/apply
+    parallelism: Optional[int] = None
+    # Skip init and apply when nothing changed since the last successful apply (see drift_check)
+    drift_check: bool = True
+
+    def terraform_args(self, refresh: Optional[bool] = None) -> List[str]:
+        """
+        :param refresh: Overrides the refresh setting, e.g. False for the discovery plan.
+        :return: The tuning arguments for terraform plan/apply.
+        """
+        args = []
+        if not (self.refresh if refresh is None else refresh):
+            args.append("-refresh=false")
+        if self.parallelism:
+            args.append(f"-parallelism={self.parallelism}")
+        return args
+
+
+@dataclass
+class PlanSummary:
+    resource_count: int = 0
+    # Pending actions per apply target, e.g. {'module.main-eks.module.eks_addons': {'update'}}
+    changes: Dict[str, Set[str]] = field(default_factory=dict)
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.changes)
+
+
+def get_plan_command(options: ApplyOptions) -> str:
+    """
+    :param options: The apply options.
+    :return: The discovery plan command, saving the plan to PLAN_FILE.
+    """
+    return " ".join(["terraform plan -input=false", *options.terraform_args(refresh=False), f"-out={PLAN_FILE}"])
+
+
+def get_apply_command(options: Optional[ApplyOptions] = None, targets: Optional[List[str]] = None) -> str:
+    """
+    :param options: The apply options.
+    :param targets: The resource/module addresses to apply, defaults to the whole configuration.
+    :return: The apply command.
+    """
+    args = ["terraform apply -auto-approve", *(options.terraform_args() if options else [])]
+    args += [shlex.quote(f"-target={target}") for target in targets or []]
+    return " ".join(args)
+
+
+def _module_path(module_address: Optional[str]) -> List[str]:
+    return _MODULE_SEGMENT_PATTERN.findall(module_address or "")
+
+
+def _resource_address(change: Dict) -> str:
+    """
+    The address of a resource without its instance key, so the target covers every instance.
+    """
+    prefix = f"{change['module_address']}." if change.get("module_address") else ""
+    mode = "data." if change.get("mode") == "data" else ""
+    return f"{prefix}{mode}{change['type']}.{change['name']}"
+
+
+def summarize_plan(plan: Dict) -> PlanSummary:
+    """
+    Find the apply targets with pending changes in a JSON plan ('terraform show -json').
+
+    Modules shared by every resource (e.g. the 'main-eks' wrapper module of a target-cluster
+    directory) are looked through: a change inside a nested module targets that nested module,
+    a change to a resource directly inside the wrapper targets the resource.
+
+    :param plan: The JSON plan.
+    :return: The summary of the plan.
+    """
+    resource_changes = plan.get("resource_changes") or []
+    module_paths = [_module_path(change.get("module_address")) for change in resource_changes]
+
+    common_depth = 0
+    if module_paths:
+        shortest = min(module_paths, key=len)
+        while common_depth < len(shortest) and all(path[common_depth] == shortest[common_depth]
+                                                   for path in module_paths):
+            common_depth += 1
+
+    summary = PlanSummary(resource_count=len(resource_changes))
+    for change, path in zip(resource_changes, module_paths):
+        actions = change.get("change", {}).get("actions", ["no-op"])
+        if actions in NO_CHANGE_ACTIONS:
+            continue
+        target = ".".join(path[:common_depth + 1]) if len(path) > common_depth else _resource_address(change)
+        summary.changes.setdefault(target, set()).update(actions)
+    return summary
+
+
+def read_plan(workdir: str, env: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+              label: Optional[str] = None) -> Dict:
+    """
+    Read the saved plan of a working directory as JSON.
+    :param workdir: The Terraform working directory containing PLAN_FILE.
+    :param env: Extra environment variables for terraform.
+    :param timeout: Seconds after which 'terraform show' is killed.
+    :param label: Optional label of the timing span, normally the cluster name.
+    :return: The JSON plan.
+    :raises RuntimeError: If the plan cannot be read.
+    """
+    with span("show", "command", label, command=f"terraform show -json {PLAN_FILE}") as show_span:
+        try:
+            completed = subprocess.run(["terraform", "show", "-json", PLAN_FILE], cwd=workdir,
+                                       env={**os.environ, **(env or {})}, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, stdin=subprocess.DEVNULL, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            show_span.status = "timeout"
+            log.error(f"'terraform show -json {PLAN_FILE}' timed out after {timeout}s.")
+            raise RuntimeError(f"'terraform show -json {PLAN_FILE}' timed out after {timeout}s.")
+        show_span.returncode = completed.returncode
+        show_span.stdout_bytes = len(completed.stdout)
+        if completed.returncode != 0:
+            show_span.status = "failed"
+            log.error(f"Unable to read the plan: {completed.stderr.decode(errors='replace').strip()}")
+            raise RuntimeError(f"Unable to read the plan: {completed.stderr.decode(errors='replace').strip()}")
+
+    try:
+        return json.loads(completed.stdout)
+    except json.JSONDecodeError as e:
+        log.error(f"The plan is not valid JSON: {e}")
+        raise RuntimeError(f"The plan is not valid JSON: {e}") from e
+
+
+def get_apply_targets(summary: PlanSummary, max_targets: int = MAX_PLAN_TARGETS) -> Optional[List[str]]:
+    """
+    Choose what to apply for a plan.
+    :param summary: The summary of the plan.
+    :param max_targets: Above this many targets the whole configuration is applied.
+    :return: The targets to apply, an empty list if there is nothing to apply, or None for a full apply.
+    """
+    if not summary.has_changes:
+        return []
+    if len(summary.changes) > max_targets:
+        log.info(f"The plan changes {len(summary.changes)} modules/resources (more than {max_targets}); "
+                 f"applying the whole configuration.")
+        return None
+    return sorted(summary.changes)
+
+
+def log_plan_summary(summary: PlanSummary, label: Optional[str] = None) -> None:
+    """
+    Log the pending changes of a plan per apply target.
+    :param summary: The summary of the plan.
+    :param label: Optional prefix, normally the cluster name.
+    :return: None
+    """
+    prefix = f"[{label}] " if label else ""
+    if not summary.has_changes:
+        log.info(f"{prefix}The plan has no changes ({summary.resource_count} resources up to date).")
+        return
+    log.info(f"{prefix}The plan changes {len(summary.changes)} of the modules/resources "
+             f"({summary.resource_count} resources planned):")
+    for target, actions in sorted(summary.changes.items()):
+        log.info(f"{prefix}  {target}: {', '.join(sorted(actions))}")
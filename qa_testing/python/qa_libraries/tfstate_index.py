@@ -0,0 +1,288 @@
+###########################################################
+#
+# Indexed, streaming Terraform state reader.
+#
+# State files are parsed incrementally: top-level values are
+# decoded one at a time and the 'resources' array one
+# resource at a time, so a multi-MB state is never held in
+# memory as a whole. Each parse produces a small index:
+#
+#   serial, lineage, terraform_version, cluster_name,
+#   resources: { resource type -> [instance addresses] }
+#
+# Indexes are cached in memory and on disk, keyed by the
+# file's mtime/size (and content hash when those change),
+# so repeated lookups of an unchanged file cost one stat().
+#
+
+import codecs
+from dataclasses import asdict, dataclass, field
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from qa_libraries.logger import log
+from qa_libraries.qa_paths import QA_CACHE_DIR
+
+INDEX_CACHE_DIR = os.getenv('QA_TFSTATE_INDEX_DIR', os.path.join(QA_CACHE_DIR, "tfstate_index"))
+INDEX_FORMAT_VERSION = 1
+
+READ_CHUNK_SIZE = 256 * 1024
+CLUSTER_TAG_PREFIX = 'kubernetes.io/cluster/'
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+_memory_cache: Dict[str, Tuple[int, int, "StateIndex"]] = {}
+_memory_cache_lock = threading.Lock()
+
+
+@dataclass
+class StateIndex:
+    path: str
+    mtime_ns: int
+    size: int
+    sha256: str
+    serial: Optional[int] = None
+    lineage: Optional[str] = None
+    terraform_version: Optional[str] = None
+    cluster_name: Optional[str] = None
+    cluster_name_source: Optional[str] = None
+    resources: Dict[str, List[str]] = field(default_factory=dict)
+
+    @property
+    def resource_count(self) -> int:
+        return sum(len(addresses) for addresses in self.resources.values())
+
+
+class StateParseError(ValueError):
+    pass
+
+
+class _StreamingReader:
+    """
+    Decodes JSON values one at a time from a file read in chunks.
+    """
+
+    def __init__(self, file, hasher):
+        self.file = file
+        self.hasher = hasher
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.file.read(READ_CHUNK_SIZE)
+        self.hasher.update(chunk)
+        # Drop the consumed part of the buffer before appending
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            self.eof = True
+        self.pos = 0
+        return bool(chunk)
+
+    def peek(self) -> str:
+        """
+        :return: The next non-whitespace character, or '' at the end of the file.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise StateParseError(f"Expected '{char}' in state file, found '{self.peek()}'")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """
+        Decode the next complete JSON value, reading more of the file as needed.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # A value ending exactly at the end of the buffer may be a truncated number/literal
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                pass
+            if not self._fill():
+                raise StateParseError("Unexpected end of state file")
+
+    def drain(self) -> None:
+        """
+        Read the rest of the file so the content hash covers all of it.
+        """
+        while self._fill():
+            self.pos = len(self.buffer)
+
+
+def iter_state_items(file, hasher) -> Iterator[Tuple[str, Any]]:
+    """
+    Iterate over the top-level items of a state file, yielding each resource separately.
+    :param file: The state file opened in binary mode.
+    :param hasher: A hashlib object updated with the raw file content.
+    :return: An iterator of (key, value) pairs; each entry of 'resources' is yielded as ('resource', value).
+    """
+    reader = _StreamingReader(file, hasher)
+    reader.expect('{')
+    while reader.peek() != '}':
+        key = reader.value()
+        reader.expect(':')
+        if key == 'resources' and reader.peek() == '[':
+            reader.expect('[')
+            while reader.peek() != ']':
+                yield 'resource', reader.value()
+                if reader.peek() == ',':
+                    reader.expect(',')
+            reader.expect(']')
+        else:
+            yield key, reader.value()
+        if reader.peek() == ',':
+            reader.expect(',')
+    reader.expect('}')
+    reader.drain()
+
+
+def _resource_address(resource: Dict[str, Any], instance: Dict[str, Any]) -> str:
+    address = f"{resource.get('type')}.{resource.get('name')}"
+    if resource.get('mode') == 'data':
+        address = f"data.{address}"
+    if resource.get('module'):
+        address = f"{resource['module']}.{address}"
+    if 'index_key' in instance:
+        address += f"[{json.dumps(instance['index_key'])}]"
+    return address
+
+
+def _cluster_name_from_resource(resource: Dict[str, Any]) -> Optional[str]:
+    """
+    Get the cluster name recorded by an aws_eks_cluster or a kubernetes.io/cluster/ aws_ec2_tag resource.
+    """
+    for instance in resource.get('instances', []):
+        attributes = instance.get('attributes', {})
+        if resource.get('type') == 'aws_eks_cluster' and 'name' in attributes:
+            return attributes['name']
+        if resource.get('type') == 'aws_ec2_tag':
+            key = attributes.get('key', '')
+            if key.startswith(CLUSTER_TAG_PREFIX):
+                return key.split('/')[-1]
+    return None
+
+
+def build_state_index(path: str) -> StateIndex:
+    """
+    Stream-parse a state file and build its index.
+    :param path: The path to the state file.
+    :return: The index of the state file.
+    :raises StateParseError: If the file is not a valid state file.
+    """
+    stat = os.stat(path)
+    index = StateIndex(path=path, mtime_ns=stat.st_mtime_ns, size=stat.st_size, sha256="")
+    with open(path, 'rb') as file:
+        return index_state_stream(file, index)
+
+
+def index_state_stream(file, index: StateIndex) -> StateIndex:
+    """
+    Stream-parse an open state file (e.g. a decompressed store blob) into an index.
+    :param file: The state file opened in binary mode.
+    :param index: The index to fill, with its path/mtime/size already set.
+    :return: The filled index.
+    :raises StateParseError: If the file is not a valid state file.
+    """
+    hasher = hashlib.sha256()
+    for key, value in iter_state_items(file, hasher):
+        if key == 'resource':
+            for instance in value.get('instances', []):
+                index.resources.setdefault(value.get('type'), []).append(_resource_address(value, instance))
+            if index.cluster_name is None:
+                index.cluster_name = _cluster_name_from_resource(value)
+                if index.cluster_name is not None:
+                    index.cluster_name_source = value.get('type')
+        elif key in ('serial', 'lineage', 'terraform_version'):
+            setattr(index, key, value)
+
+    index.sha256 = hasher.hexdigest()
+    return index
+
+
+def _disk_cache_path(path: str) -> str:
+    return os.path.join(INDEX_CACHE_DIR, hashlib.sha1(os.path.realpath(path).encode()).hexdigest() + ".json")
+
+
+def _load_disk_index(path: str) -> Optional[StateIndex]:
+    try:
+        with open(_disk_cache_path(path), 'r') as file:
+            data = json.load(file)
+        if data.pop('format_version', None) != INDEX_FORMAT_VERSION:
+            return None
+        return StateIndex(**data)
+    except (FileNotFoundError, json.JSONDecodeError, TypeError):
+        return None
+
+
+def _save_disk_index(index: StateIndex) -> None:
+    os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+    cache_path = _disk_cache_path(index.path)
+    temp_path = f"{cache_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(temp_path, 'w') as file:
+        json.dump({'format_version': INDEX_FORMAT_VERSION, **asdict(index)}, file)
+    os.replace(temp_path, cache_path)
+
+
+def _file_sha256(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(READ_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def get_state_index(path: str) -> StateIndex:
+    """
+    Get the index of a state file, parsing it only if it changed since it was last indexed.
+    :param path: The path to the state file.
+    :return: The index of the state file.
+    :raises FileNotFoundError: If the state file does not exist.
+    :raises StateParseError: If the file is not a valid state file.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    with _memory_cache_lock:
+        cached = _memory_cache.get(path)
+    if cached and cached[:2] == key:
+        return cached[2]
+
+    index = _load_disk_index(path)
+    if index and (index.mtime_ns, index.size) != key:
+        # The file was touched or copied: reuse the index only if the content is unchanged
+        if index.size == stat.st_size and index.sha256 == _file_sha256(path):
+            index.mtime_ns = stat.st_mtime_ns
+            _save_disk_index(index)
+        else:
+            index = None
+
+    if index is None:
+        index = build_state_index(path)
+        try:
+            _save_disk_index(index)
+        except OSError as e:
+            log.warning(f"Unable to cache the state index of '{path}': {e}")
+
+    with _memory_cache_lock:
+        _memory_cache[path] = (index.mtime_ns, index.size, index)
+    return index
@@ -0,0 +1,315 @@
+###########################################################
+#
+# Content-addressed, deduplicated Terraform state snapshots.
+#
+# Layout of the store (by default '<cluster_dir>/tf.state_store'):
+#
+#   blobs/<sha256[:2]>/<sha256>.gz   compressed state files
+#   manifests/<cluster>.json         snapshots of one cluster,
+#                                    oldest first
+#
+# A snapshot records the serial, lineage and timestamp of the
+# state and the blob hash of each state file. A state that is
+# already stored is never compressed or copied again, any past
+# snapshot can be restored, and old snapshots are pruned by a
+# retention policy (keep the last N, drop older than D days).
+# Blobs are only created, reused and deleted under a file
+# lock on the store, shared by every process using it.
+#
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import fcntl
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from qa_libraries.logger import log
+from qa_libraries.tfstate_index import get_state_index
+
+STATE_FILE_NAMES = ("terraform.tfstate", "terraform.tfstate.backup")
+STORE_DIR_NAME = "tf.state_store"
+LEGACY_BACKUP_DIR_PREFIX = "tf.state_"
+
+# Retention policy: the newest KEEP_LAST snapshots are always kept, older ones
+# are pruned once they are more than MAX_AGE_DAYS old
+KEEP_LAST = int(os.getenv('QA_STATE_KEEP_LAST', '10'))
+MAX_AGE_DAYS = float(os.getenv('QA_STATE_MAX_AGE_DAYS', '30'))
+
+# Unreferenced blobs younger than this (or reused by put_blob since) are left alone, as a snapshot may be
+# about to reference them
+BLOB_GC_GRACE_SECONDS = 3600
+
+_manifest_lock = threading.Lock()
+
+
+def get_state_store_dir(cluster_dir: str) -> str:
+    """
+    Get the default state store directory of a target-cluster directory.
+    :param cluster_dir: The target-cluster directory.
+    :return: The path to the state store.
+    """
+    return os.path.join(cluster_dir, STORE_DIR_NAME)
+
+
+def _blob_path(store_dir: str, digest: str) -> str:
+    return os.path.join(store_dir, "blobs", digest[:2], f"{digest}.gz")
+
+
+def _manifest_path(store_dir: str, cluster_name: str) -> str:
+    return os.path.join(store_dir, "manifests", f"{cluster_name}.json")
+
+
+@contextmanager
+def _store_lock(store_dir: str) -> Iterator[None]:
+    # Across processes (and threads, each opening its own lock file): put_blob vs. gc_blobs
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, ".lock"), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_json_atomically(path: str, data) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(temp_path, 'w') as file:
+        json.dump(data, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def list_snapshots(cluster_name: str, store_dir: str) -> List[Dict]:
+    """
+    List the snapshots stored for a cluster.
+    :param cluster_name: The name of the cluster.
+    :param store_dir: The state store directory.
+    :return: The snapshots of the cluster, oldest first.
+    """
+    try:
+        with open(_manifest_path(store_dir, cluster_name), 'r') as file:
+            return json.load(file)["snapshots"]
+    except FileNotFoundError:
+        return []
+
+
+def list_stored_clusters(store_dir: str) -> List[str]:
+    """
+    List the clusters that have snapshots in the store.
+    :param store_dir: The state store directory.
+    :return: The cluster names, sorted.
+    """
+    manifests_dir = os.path.join(store_dir, "manifests")
+    if not os.path.isdir(manifests_dir):
+        return []
+    return sorted(name[:-len(".json")] for name in os.listdir(manifests_dir) if name.endswith(".json"))
+
+
+def put_blob(store_dir: str, file_path: str, digest: str) -> bool:
+    """
+    Store a state file as a compressed blob unless a blob with the same content already exists.
+    :param store_dir: The state store directory.
+    :param file_path: The state file to store.
+    :param digest: The sha256 of the state file content.
+    :return: True if a new blob was written, False if the content was already stored.
+    """
+    blob_path = _blob_path(store_dir, digest)
+    with _store_lock(store_dir):
+        if os.path.exists(blob_path):
+            # A reused blob is as good as new: gc_blobs leaves it alone for the grace period
+            os.utime(blob_path)
+            return False
+
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    temp_path = f"{blob_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(file_path, 'rb') as src, gzip.open(temp_path, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    with _store_lock(store_dir):
+        os.replace(temp_path, blob_path)
+    return True
+
+
+def read_blob(store_dir: str, digest: str, dst_path: str) -> None:
+    """
+    Decompress a blob into a file.
+    :param store_dir: The state store directory.
+    :param digest: The sha256 of the blob content.
+    :param dst_path: The file to write.
+    """
+    with gzip.open(_blob_path(store_dir, digest), 'rb') as src, open(dst_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def open_blob(store_dir: str, digest: str):
+    """
+    Open a blob for streaming.
+    :param store_dir: The state store directory.
+    :param digest: The sha256 of the blob content.
+    :return: The decompressed blob, opened in binary mode.
+    """
+    return gzip.open(_blob_path(store_dir, digest), 'rb')
+
+
+def get_blob_size(store_dir: str, digest: str) -> int:
+    """
+    :param store_dir: The state store directory.
+    :param digest: The sha256 of the blob content.
+    :return: The compressed size of the blob in bytes.
+    """
+    return os.path.getsize(_blob_path(store_dir, digest))
+
+
+def snapshot_state_files(cluster_name: str, state_files: List[str], store_dir: str) -> Dict:
+    """
+    Record the given state files as a snapshot of a cluster.
+
+    If the newest snapshot of the cluster already has exactly the same content, it is returned
+    as is and nothing is copied.
+
+    :param cluster_name: The name of the cluster the state belongs to.
+    :param state_files: The state files to snapshot (terraform.tfstate and/or its backup).
+    :param store_dir: The state store directory.
+    :return: The snapshot entry.
+    """
+    files = {}
+    primary_index = None
+    for state_file in state_files:
+        state_index = get_state_index(state_file)
+        files[os.path.basename(state_file)] = state_index.sha256
+        if primary_index is None or os.path.basename(state_file) == "terraform.tfstate":
+            primary_index = state_index
+
+    with _manifest_lock:
+        snapshots = list_snapshots(cluster_name, store_dir)
+        if snapshots and snapshots[-1]["files"] == files:
+            log.info(f"State of cluster '{cluster_name}' unchanged since snapshot {snapshots[-1]['id']}; "
+                     f"nothing to back up.")
+            return snapshots[-1]
+
+        new_blobs = sum(put_blob(store_dir, state_file, files[os.path.basename(state_file)])
+                        for state_file in state_files)
+
+        timestamp = datetime.now(timezone.utc)
+        snapshot = {
+            "id": f"{timestamp.strftime('%Y%m%dT%H%M%S%fZ')}-{primary_index.sha256[:8]}",
+            "timestamp": timestamp.isoformat(),
+            "serial": primary_index.serial,
+            "lineage": primary_index.lineage,
+            "files": files,
+        }
+        snapshots.append(snapshot)
+        _write_json_atomically(_manifest_path(store_dir, cluster_name),
+                               {"cluster": cluster_name, "snapshots": snapshots})
+
+    log.info(f"Created snapshot {snapshot['id']} of cluster '{cluster_name}' "
+             f"(serial {snapshot['serial']}, {new_blobs} new blobs).")
+    prune_snapshots(cluster_name, store_dir)
+    return snapshot
+
+
+def find_snapshot(cluster_name: str, store_dir: str, snapshot_id: Optional[str] = None) -> Optional[Dict]:
+    """
+    Find a snapshot of a cluster.
+    :param cluster_name: The name of the cluster.
+    :param store_dir: The state store directory.
+    :param snapshot_id: The snapshot id (or a unique prefix of it), defaults to the newest snapshot.
+    :return: The snapshot entry, or None if the cluster has no snapshots.
+    :raises ValueError: If the requested snapshot id does not match exactly one snapshot.
+    """
+    snapshots = list_snapshots(cluster_name, store_dir)
+    if not snapshot_id:
+        return snapshots[-1] if snapshots else None
+
+    matches = [snapshot for snapshot in snapshots if snapshot["id"].startswith(snapshot_id)]
+    if len(matches) != 1:
+        log.error(f"Snapshot '{snapshot_id}' matches {len(matches)} snapshots of cluster '{cluster_name}'.")
+        raise ValueError(f"Snapshot '{snapshot_id}' matches {len(matches)} snapshots of cluster '{cluster_name}'.")
+    return matches[0]
+
+
+def import_legacy_backup(cluster_name: str, cluster_dir: str, store_dir: str) -> Optional[Dict]:
+    """
+    Import a legacy 'tf.state_<cluster>' backup directory into the store, if there is one.
+    :param cluster_name: The name of the cluster.
+    :param cluster_dir: The target-cluster directory containing the legacy backup directory.
+    :param store_dir: The state store directory.
+    :return: The snapshot entry of the imported state, or None if there was no legacy backup.
+    """
+    legacy_dir = os.path.join(cluster_dir, f"{LEGACY_BACKUP_DIR_PREFIX}{cluster_name}")
+    state_files = [os.path.join(legacy_dir, name) for name in STATE_FILE_NAMES
+                   if os.path.exists(os.path.join(legacy_dir, name))]
+    if not state_files:
+        return None
+
+    log.info(f"Importing legacy state backup '{legacy_dir}' into the state store.")
+    return snapshot_state_files(cluster_name, state_files, store_dir)
+
+
+def prune_snapshots(cluster_name: str, store_dir: str, keep_last: int = KEEP_LAST,
+                    max_age_days: float = MAX_AGE_DAYS) -> List[Dict]:
+    """
+    Apply the retention policy to the snapshots of a cluster.
+    :param cluster_name: The name of the cluster.
+    :param store_dir: The state store directory.
+    :param keep_last: The number of newest snapshots that are always kept.
+    :param max_age_days: Older snapshots are pruned once they are more than this many days old.
+    :return: The pruned snapshot entries.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=max_age_days)
+    with _manifest_lock:
+        snapshots = list_snapshots(cluster_name, store_dir)
+        keep_from = max(0, len(snapshots) - max(1, keep_last))
+        pruned = [snapshot for snapshot in snapshots[:keep_from]
+                  if datetime.fromisoformat(snapshot["timestamp"]) < cutoff]
+        if not pruned:
+            return []
+        kept = [snapshot for snapshot in snapshots if snapshot not in pruned]
+        _write_json_atomically(_manifest_path(store_dir, cluster_name), {"cluster": cluster_name, "snapshots": kept})
+
+    log.info(f"Pruned {len(pruned)} snapshots of cluster '{cluster_name}' older than {max_age_days:g} days.")
+    gc_blobs(store_dir)
+    return pruned
+
+
+def gc_blobs(store_dir: str) -> int:
+    """
+    Delete blobs that are no longer referenced by any snapshot.
+    :param store_dir: The state store directory.
+    :return: The number of deleted blobs.
+    """
+    deleted = 0
+    blobs_dir = os.path.join(store_dir, "blobs")
+    # Manifests are replaced atomically, so they are read without _manifest_lock (which put_blob runs under);
+    # a snapshot written after this read only references blobs put_blob created or touched within the grace period
+    with _store_lock(store_dir):
+        referenced = {
+            digest
+            for cluster_name in list_stored_clusters(store_dir)
+            for snapshot in list_snapshots(cluster_name, store_dir)
+            for digest in snapshot["files"].values()
+        }
+        now = time.time()
+        for root, _, file_names in os.walk(blobs_dir):
+            for file_name in file_names:
+                blob_path = os.path.join(root, file_name)
+                digest = file_name.split(".", 1)[0]
+                if digest in referenced:
+                    continue
+                try:
+                    if now - os.path.getmtime(blob_path) < BLOB_GC_GRACE_SECONDS:
+                        continue
+                    os.remove(blob_path)
+                except FileNotFoundError:
+                    # e.g. a temporary blob another process just renamed
+                    continue
+                deleted += 1
+    if deleted:
+        log.info(f"Deleted {deleted} unreferenced state blobs.")
+    return deleted
@@ -0,0 +1,187 @@
+###########################################################
+#
+# Readiness-driven waiting.
+#
+# Instead of sleeping for a fixed time, a wait polls a
+# predicate and returns the moment it reports ready:
+#
+#   wait_for()        polls with exponential backoff and
+#                     jitter until a deadline
+#   wait_for_watch()  follows a watch stream (e.g. 'kubectl
+#                     get ... --watch' or 'kubectl rollout
+#                     status') and returns on the first
+#                     line that shows the resource is ready
+#
+# Progress is shown on a single console line redrawn at most
+# PROGRESS_REDRAWS_PER_SECOND times per second, and only when
+# the console is a terminal.
+#
+
+from dataclasses import dataclass
+import random
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Type
+
+from qa_libraries.instrumentation import span
+from qa_libraries.logger import log
+
+PROGRESS_REDRAWS_PER_SECOND = 4
+
+
+class WaitTimeoutError(TimeoutError):
+    pass
+
+
+@dataclass
+class Backoff:
+    initial: float = 1.0
+    factor: float = 2.0
+    maximum: float = 30.0
+    # Fraction of each delay that is randomized, so concurrent waiters do not poll in lockstep
+    jitter: float = 0.2
+
+    def delays(self) -> Iterator[float]:
+        """
+        :return: The delays between polls: exponentially growing up to the maximum, each with jitter applied.
+        """
+        delay = self.initial
+        while True:
+            yield delay * (1 - self.jitter * random.random())
+            delay = min(self.maximum, delay * self.factor)
+
+
+class ProgressLine:
+    """
+    A single console line showing the progress of a wait, redrawn at a limited rate.
+    """
+
+    def __init__(self, description: str, timeout: float, stream=sys.stderr,
+                 redraws_per_second: float = PROGRESS_REDRAWS_PER_SECOND):
+        self.description = description
+        self.timeout = timeout
+        self.stream = stream
+        self.interval = 1.0 / redraws_per_second
+        self.enabled = hasattr(stream, "isatty") and stream.isatty()
+        self._start = time.monotonic()
+        self._last_draw = 0.0
+        self._drawn = False
+
+    def update(self, status: str = "") -> None:
+        """
+        Redraw the line, unless it was redrawn less than one redraw interval ago.
+        :param status: Extra status shown after the elapsed time, e.g. the attempt number.
+        """
+        now = time.monotonic()
+        if not self.enabled or now - self._last_draw < self.interval:
+            return
+        self._last_draw = now
+        self._drawn = True
+        elapsed = now - self._start
+        self.stream.write(f"\r[*] Waiting for {self.description}: {elapsed:.0f}s / {self.timeout:.0f}s"
+                          f"{' - ' + status if status else ''}\033[K")
+        self.stream.flush()
+
+    def close(self) -> None:
+        if self._drawn:
+            self.stream.write("\r\033[K")
+            self.stream.flush()
+
+
+def _sleep_until(deadline: float, delay: float, progress: ProgressLine, status: str) -> None:
+    """
+    Sleep for the delay (or until the deadline), waking up only to redraw the progress line.
+    """
+    wake_at = min(deadline, time.monotonic() + delay)
+    while True:
+        remaining = wake_at - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(remaining, progress.interval) if progress.enabled else remaining)
+        progress.update(status)
+
+
+def wait_for(predicate: Callable[[], Any], timeout: float, description: str, backoff: Optional[Backoff] = None,
+             ignore_exceptions: Tuple[Type[BaseException], ...] = ()) -> Any:
+    """
+    Poll a predicate until it returns a truthy value.
+    :param predicate: Called on every poll; a truthy return value means ready.
+    :param timeout: Seconds after which the wait fails.
+    :param description: What is waited for, e.g. "deployment 'app-deployment' to be available".
+    :param backoff: The delays between polls, defaults to Backoff().
+    :param ignore_exceptions: Exceptions raised by the predicate that count as 'not ready yet'.
+    :return: The truthy value returned by the predicate.
+    :raises WaitTimeoutError: If the predicate is not ready before the deadline.
+    """
+    deadline = time.monotonic() + timeout
+    progress = ProgressLine(description, timeout)
+    delays = (backoff or Backoff()).delays()
+    attempt, last_error = 0, None
+
+    with span("wait_for", "wait", description) as wait_span:
+        try:
+            while True:
+                attempt += 1
+                try:
+                    value = predicate()
+                except ignore_exceptions as e:
+                    value, last_error = None, e
+                if value:
+                    wait_span.attributes["attempts"] = attempt
+                    return value
+                if time.monotonic() >= deadline:
+                    break
+                _sleep_until(deadline, next(delays), progress, f"attempt {attempt}")
+        finally:
+            progress.close()
+
+        wait_span.attributes["attempts"] = attempt
+        wait_span.status = "timeout"
+        reason = f" (last error: {last_error})" if last_error else ""
+        log.error(f"Timed out after {timeout:g}s ({attempt} attempts) waiting for {description}{reason}.")
+        raise WaitTimeoutError(f"Timed out after {timeout:g}s waiting for {description}{reason}.")
+
+
+def wait_for_watch(command: List[str], is_ready: Callable[[str], bool], timeout: float, description: str) -> str:
+    """
+    Follow a watch stream until a line shows the resource is ready.
+    :param command: The watching command, e.g. ['kubectl', 'get', 'pods', '-n', 'ns', '--watch', '-o', 'name'].
+    :param is_ready: Called with every output line; returning True ends the wait.
+    :param timeout: Seconds after which the wait fails.
+    :param description: What is waited for.
+    :return: The line that showed the resource is ready.
+    :raises WaitTimeoutError: If no line showed the resource ready before the deadline or the stream ended.
+    """
+    progress = ProgressLine(description, timeout)
+    with span("wait_for_watch", "wait", description, command=" ".join(command)) as wait_span:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                   stdin=subprocess.DEVNULL)
+        timed_out = threading.Event()
+
+        def stop_on_timeout():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, stop_on_timeout)
+        timer.start()
+        try:
+            for raw_line in process.stdout:
+                line = raw_line.decode(errors='replace').rstrip("\n")
+                progress.update()
+                if is_ready(line):
+                    return line
+        finally:
+            timer.cancel()
+            progress.close()
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+
+        wait_span.status = "timeout" if timed_out.is_set() else "failed"
+        reason = f"timed out after {timeout:g}s" if timed_out.is_set() else \
+            f"ended with return code {process.returncode}"
+        log.error(f"Watch of {description} {reason} before the resource became ready.")
+        raise WaitTimeoutError(f"Watch of {description} {reason} before the resource became ready.")
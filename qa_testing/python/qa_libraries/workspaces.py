@@ -0,0 +1,275 @@
+###########################################################
+#
+# Per-cluster Terraform workspaces.
+#
+# Instead of rewriting the shared main.tf and shuffling the
+# state files of the target-cluster directory, every cluster
+# gets its own lightweight workspace under
+# '<cluster_dir>/.qa_workdirs/<cluster>':
+#
+#   *.tf / *.tfvars / *.hcl   symlinks to the shared files, so
+#                             local edits are picked up as is
+#                             (the provider lock file is copied)
+#   qa_workspace_override.tf  generated Terraform override that
+#                             sets cluster_custom_name
+#   .terraform/               kept between runs (init is skipped
+#                             while its fingerprint matches)
+#   terraform.tfstate         the cluster's live state, saved to
+#                             the shared state store after a run
+#
+# Reusing a workspace only re-checks the symlinks and the
+# override file. Workspaces unused for QA_WORKSPACE_MAX_AGE_DAYS
+# are snapshotted into the state store and deleted.
+#
+
+from datetime import datetime, timezone
+import json
+import os
+import re
+import shutil
+from typing import List, Optional
+
+from qa_libraries.instrumentation import timed
+from qa_libraries.logger import log
+from qa_libraries.state_swap import StateLockedError, recover_state_swap, state_lock, swap_state_files
+from qa_libraries.tf_cluster_commands import (
+    backup_tfstate_files,
+    check_tf_state_files_exist,
+    get_live_cluster_name,
+    recover_interrupted_session,
+    restore_tfstate_files,
+)
+from qa_libraries.tf_init_cache import LOCK_FILE
+from qa_libraries.tfstate_index import get_state_index
+from qa_libraries.tfstate_store import find_snapshot, get_state_store_dir
+
+WORKSPACES_DIR_NAME = ".qa_workdirs"
+WORKSPACE_OVERRIDE_FILE = "qa_workspace_override.tf"
+WORKSPACE_METADATA_FILE = ".qa_workspace.json"
+
+# Files linked from the target-cluster directory into each workspace
+WORKSPACE_FILE_SUFFIXES = (".tf", ".tfvars", ".hcl")
+
+WORKSPACE_MAX_AGE_DAYS = float(os.getenv('QA_WORKSPACE_MAX_AGE_DAYS', '14'))
+
+_CLUSTER_MODULE_PATTERN = re.compile(r'module\s+"([^"]+)"\s*\{[^{}]*?\bcluster_custom_name\s*=', re.S)
+
+
+def get_workspace_dir(target_cluster_name: str, cluster_dir: str) -> str:
+    """
+    Get the workspace directory of a cluster.
+    :param target_cluster_name: The name of the cluster.
+    :param cluster_dir: The shared target-cluster directory.
+    :return: The path to the workspace.
+    """
+    return os.path.join(cluster_dir, WORKSPACES_DIR_NAME, target_cluster_name)
+
+
+def get_cluster_module_name(data: str) -> str:
+    """
+    Get the name of the module block that sets cluster_custom_name in a main.tf file.
+    :param data: The contents of the main.tf file.
+    :return: The module name, e.g. 'main-eks'.
+    :raises ValueError: If no module block sets cluster_custom_name.
+    """
+    match = _CLUSTER_MODULE_PATTERN.search(data)
+    if not match:
+        log.error("No module block setting 'cluster_custom_name' found in main.tf.")
+        raise ValueError("No module block setting 'cluster_custom_name' found in main.tf.")
+    return match.group(1)
+
+
+def _write_if_changed(path: str, data: str) -> bool:
+    try:
+        with open(path, 'r') as file:
+            if file.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    temp_path = f"{path}.tmp-{os.getpid()}"
+    with open(temp_path, 'w') as file:
+        file.write(data)
+    os.replace(temp_path, path)
+    return True
+
+
+def _link_config_files(workspace_dir: str, cluster_dir: str) -> None:
+    """
+    Point the workspace at the current configuration files of the target-cluster directory.
+    """
+    wanted = {
+        entry for entry in os.listdir(cluster_dir)
+        if entry.endswith(WORKSPACE_FILE_SUFFIXES) and entry != LOCK_FILE
+        and os.path.isfile(os.path.join(cluster_dir, entry))
+    }
+
+    # terraform init replaces the lock file rather than writing through a link, so each workspace owns a copy
+    shared_lock_file = os.path.join(cluster_dir, LOCK_FILE)
+    if os.path.exists(shared_lock_file) and not os.path.exists(os.path.join(workspace_dir, LOCK_FILE)):
+        shutil.copy2(shared_lock_file, os.path.join(workspace_dir, LOCK_FILE))
+
+    for entry in wanted:
+        link_path = os.path.join(workspace_dir, entry)
+        link_target = os.path.relpath(os.path.join(cluster_dir, entry), workspace_dir)
+        if os.path.islink(link_path) and os.readlink(link_path) == link_target:
+            continue
+        if os.path.lexists(link_path):
+            os.remove(link_path)
+        try:
+            os.symlink(link_target, link_path)
+        except OSError:
+            # Filesystems without symlink support get a copy, refreshed on every run
+            shutil.copy2(os.path.join(cluster_dir, entry), link_path)
+
+    # Drop links to files that were removed from the target-cluster directory
+    for entry in os.listdir(workspace_dir):
+        link_path = os.path.join(workspace_dir, entry)
+        if entry not in wanted and entry != WORKSPACE_OVERRIDE_FILE and entry.endswith(WORKSPACE_FILE_SUFFIXES) \
+                and os.path.islink(link_path):
+            os.remove(link_path)
+
+
+def _write_override(workspace_dir: str, cluster_dir: str, target_cluster_name: str) -> None:
+    """
+    Generate the Terraform override file that sets the cluster name of the workspace.
+    """
+    main_tf_file = os.path.join(cluster_dir, "main.tf")
+    try:
+        with open(main_tf_file, 'r') as file:
+            module_name = get_cluster_module_name(file.read())
+    except FileNotFoundError:
+        log.error(f"File '{main_tf_file}' not found.")
+        raise FileNotFoundError(f"File '{main_tf_file}' not found.")
+
+    _write_if_changed(os.path.join(workspace_dir, WORKSPACE_OVERRIDE_FILE),
+                      f"# Generated by the QA workspace manager for cluster '{target_cluster_name}'; do not edit.\n"
+                      f"module \"{module_name}\" {{\n"
+                      f"  cluster_custom_name = \"{target_cluster_name}\"\n"
+                      f"}}\n")
+
+
+def _touch_workspace(workspace_dir: str, target_cluster_name: str) -> None:
+    _write_if_changed(os.path.join(workspace_dir, WORKSPACE_METADATA_FILE), json.dumps({
+        "cluster": target_cluster_name,
+        "last_used": datetime.now(timezone.utc).isoformat(),
+    }, indent=2))
+
+
+def _adopt_shared_state(target_cluster_name: str, cluster_dir: str) -> None:
+    """
+    Move live state of the cluster left in the shared target-cluster directory into the state store,
+    so the workspace starts from it and the shared copy cannot go stale.
+    """
+    with state_lock(cluster_dir):
+        recover_state_swap(cluster_dir)
+        recover_interrupted_session(cluster_dir)
+        if get_live_cluster_name(cluster_dir) != target_cluster_name:
+            return
+
+        store_dir = get_state_store_dir(cluster_dir)
+        log.info(f"Moving the live state of cluster '{target_cluster_name}' from '{cluster_dir}' into the state store.")
+        backup_tfstate_files(cluster_dir, store_dir, target_cluster_name)
+        swap_state_files(cluster_dir, target_cluster_name, None, store_dir)
+
+
+def _state_matches_snapshot(workspace_dir: str, snapshot: Optional[dict]) -> bool:
+    state_files = check_tf_state_files_exist(workspace_dir)
+    if not snapshot:
+        return not state_files
+    current = {os.path.basename(state_file): get_state_index(state_file).sha256 for state_file in state_files}
+    return current == snapshot["files"]
+
+
+@timed("workspace_materialize", "workspace", label_arg="target_cluster_name")
+def materialize_workspace(target_cluster_name: str, cluster_dir: str, snapshot_id: Optional[str] = None) -> str:
+    """
+    Create or refresh the workspace of a cluster and bring its state up to date with the state store.
+
+    Must be called with the state lock of the workspace held.
+
+    :param target_cluster_name: The name of the cluster.
+    :param cluster_dir: The shared target-cluster directory.
+    :param snapshot_id: The state snapshot to start from, defaults to the cluster's newest snapshot.
+    :return: The path to the workspace.
+    """
+    workspace_dir = get_workspace_dir(target_cluster_name, cluster_dir)
+    os.makedirs(workspace_dir, exist_ok=True)
+
+    _link_config_files(workspace_dir, cluster_dir)
+    _write_override(workspace_dir, cluster_dir, target_cluster_name)
+    _adopt_shared_state(target_cluster_name, cluster_dir)
+
+    # The workspace state is saved to the store after every run, so it is normally already current
+    store_dir = get_state_store_dir(cluster_dir)
+    if snapshot_id or not _state_matches_snapshot(workspace_dir, find_snapshot(target_cluster_name, store_dir)):
+        restore_tfstate_files(target_cluster_name, workspace_dir, snapshot_id=snapshot_id,
+                              store_dir=store_dir, current_cluster_name=target_cluster_name)
+
+    _touch_workspace(workspace_dir, target_cluster_name)
+    log.info(f"Workspace for cluster '{target_cluster_name}' ready: {workspace_dir}")
+    return workspace_dir
+
+
+@timed("workspace_save_state", "workspace", label_arg="target_cluster_name")
+def save_workspace_state(target_cluster_name: str, cluster_dir: str) -> None:
+    """
+    Snapshot the state files of a workspace into the state store of the target-cluster directory.
+    :param target_cluster_name: The name of the cluster.
+    :param cluster_dir: The shared target-cluster directory holding the state store.
+    :return: None
+    """
+    backup_tfstate_files(get_workspace_dir(target_cluster_name, cluster_dir), get_state_store_dir(cluster_dir),
+                         cluster_name=target_cluster_name)
+
+
+def list_workspaces(cluster_dir: str) -> List[str]:
+    """
+    List the clusters that have a workspace.
+    :param cluster_dir: The shared target-cluster directory.
+    :return: The cluster names, sorted.
+    """
+    workspaces_dir = os.path.join(cluster_dir, WORKSPACES_DIR_NAME)
+    if not os.path.isdir(workspaces_dir):
+        return []
+    return sorted(entry for entry in os.listdir(workspaces_dir)
+                  if os.path.isdir(os.path.join(workspaces_dir, entry)))
+
+
+def _last_used(workspace_dir: str) -> datetime:
+    try:
+        with open(os.path.join(workspace_dir, WORKSPACE_METADATA_FILE), 'r') as file:
+            return datetime.fromisoformat(json.load(file)["last_used"])
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, ValueError):
+        return datetime.fromtimestamp(os.path.getmtime(workspace_dir), timezone.utc)
+
+
+def gc_workspaces(cluster_dir: str, max_age_days: float = WORKSPACE_MAX_AGE_DAYS,
+                  exclude: Optional[List[str]] = None) -> List[str]:
+    """
+    Delete workspaces that were not used for a while, after saving their state to the state store.
+
+    Workspaces that are in use by another invocation are skipped.
+
+    :param cluster_dir: The shared target-cluster directory.
+    :param max_age_days: Workspaces unused for more than this many days are deleted.
+    :param exclude: Clusters whose workspaces are kept regardless of age.
+    :return: The clusters whose workspaces were deleted.
+    """
+    now = datetime.now(timezone.utc)
+    deleted = []
+    for cluster_name in list_workspaces(cluster_dir):
+        workspace_dir = get_workspace_dir(cluster_name, cluster_dir)
+        if cluster_name in (exclude or []) or (now - _last_used(workspace_dir)).total_seconds() < max_age_days * 86400:
+            continue
+        try:
+            with state_lock(workspace_dir, timeout=0):
+                save_workspace_state(cluster_name, cluster_dir)
+                shutil.rmtree(workspace_dir)
+        except StateLockedError:
+            log.info(f"Workspace of cluster '{cluster_name}' is in use; not deleting it.")
+            continue
+        deleted.append(cluster_name)
+
+    if deleted:
+        log.info(f"Deleted {len(deleted)} stale workspaces: {', '.join(deleted)}")
+    return deleted
@@ -0,0 +1,121 @@
+import argparse
+from datetime import datetime
+import os
+import sys
+from qa_libraries.change_impact import analyze_changes
+from qa_libraries.eks_auth import PER_CLUSTER_KUBECONFIG, write_kubeconfig
+from qa_libraries.instrumentation import run_report
+from qa_libraries.read_cache import AWS_READ_TTL, IDENTITY_READ_TTL, aws_scope, cached_read
+from qa_libraries.smoketest_runner import DEFAULT_JOBS, list_smoketests, run_smoketests, write_smoketest_log
+from qa_libraries.tf_cluster_commands import AWS_REGION, check_cluster_exists, run_command
+from qa_libraries.logger import drain_logs, log
+
+
+def check_prerequisites(cluster_name: str) -> bool:
+    """
+    Verify the cluster, the AWS credentials and the kubeconfig context like run_smoketest.sh does.
+
+    With per-cluster kubeconfigs (see eks_auth), the cluster's own kubeconfig is selected for the
+    rest of the run instead of checking the context of the shared one.
+
+    :param cluster_name: The cluster to test.
+    :return: True if the smoketests can run against the cluster.
+    """
+    if not check_cluster_exists(cluster_name):
+        log.error(f"No matching EKS cluster found for '{cluster_name}'.")
+        return False
+
+    identity = cached_read("aws sts get-caller-identity --query Account --output text", aws_scope(), IDENTITY_READ_TTL)
+    if identity.returncode != 0:
+        log.error("Unable to access AWS. Please ensure your credentials are valid and properly configured.")
+        return False
+
+    if PER_CLUSTER_KUBECONFIG:
+        try:
+            os.environ["KUBECONFIG"] = write_kubeconfig(cluster_name, AWS_REGION)
+        except RuntimeError:
+            return False
+        return True
+
+    current_context, _, _ = run_command("kubectl config current-context")
+    expected_context = f"arn:aws:eks:{AWS_REGION}:{identity.text.strip()}:cluster/{cluster_name}"
+    if current_context.strip() != expected_context:
+        log.warning(f"Current kubeconfig context '{current_context.strip()}' does not match the target cluster "
+                    f"context '{expected_context}'.")
+        drain_logs()
+        response = input("Do you want to switch to the target cluster context? (yes/no): ")
+        if response.lower() != 'yes':
+            log.error("Aborting as the kubeconfig context was not switched.")
+            return False
+        _, _, return_code = run_command(f"aws eks update-kubeconfig --name {cluster_name} --region {AWS_REGION}")
+        if return_code != 0:
+            log.error("Failed to switch to the target cluster context.")
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    smoketests = list_smoketests()
+
+    parser = argparse.ArgumentParser(description="Run the smoketests against an EKS cluster concurrently")
+    parser.add_argument("-t", "--target", required=True, help="Target cluster name")
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument("-s", "--smoketest", default="all", choices=["all"] + smoketests,
+                           help="The smoketest script to run (default: all)")
+    selection.add_argument("--changed-since", metavar="REF",
+                           help="Only run the smoketests impacted by the changes since this ref (e.g. origin/main), "
+                                "see change_impact.py")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_JOBS,
+                        help=f"Maximum number of smoketests run at the same time (default: {DEFAULT_JOBS})")
+    parser.add_argument("--no-snapshot", action="store_true",
+                        help="Let every smoketest query the cluster itself instead of sharing a resource snapshot")
+    parser.add_argument("--shell-log-checks", action="store_true",
+                        help="Run the pod-log smoketests with their scripts instead of the concurrent log scanner")
+    parser.add_argument("--shell-health-check", action="store_true",
+                        help="Run check_cluster_health.sh with its script instead of the streaming health evaluator")
+    parser.add_argument("--no-fail-fast", action="store_true",
+                        help="Run every smoketest even when a networking prerequisite (kube-proxy, VPC CNI, CoreDNS) "
+                             "fails")
+
+    args = parser.parse_args()
+
+    with run_report("run_smoketests"):
+        test_script, header = args.smoketest, []
+        script_names = smoketests if args.smoketest == "all" else [args.smoketest]
+        if args.changed_since:
+            try:
+                report = analyze_changes(args.changed_since)
+            except (FileNotFoundError, ValueError) as e:
+                log.error(f"Unable to analyze the impact of the changes: {e}")
+                sys.exit(1)
+            script_names = report.selected(smoketests)
+            if report.run_all:
+                log.info(f"All smoketests are impacted: {'; '.join(report.run_all)}")
+            else:
+                test_script = "impacted"
+                header = [f"Impacted by the changes since: {args.changed_since} ({report.base[:12]})"]
+            if not script_names:
+                log.info(f"No smoketest is impacted by the changes since {args.changed_since}.")
+                sys.exit(0)
+
+        if not check_prerequisites(args.target):
+            sys.exit(1)
+
+        started = datetime.now()
+        version = cached_read(f"aws eks describe-cluster --name {args.target} --query cluster.version --output text",
+                              aws_scope(), AWS_READ_TTL).text
+        log.info(f"Running {len(script_names)} smoketests against '{args.target}' with {args.jobs} workers.")
+
+        results = run_smoketests(args.target, script_names, jobs=args.jobs, use_snapshot=not args.no_snapshot,
+                                 use_log_scan=not args.shell_log_checks, use_api_checks=not args.shell_health_check,
+                                 fail_fast=not args.no_fail_fast)
+        log_file = write_smoketest_log(args.target, test_script, results, started,
+                                       [f"EKS Cluster Version: {version.strip()}", *header])
+
+        failed = [result.name for result in results if not result.passed]
+        if failed:
+            log.error(f"FAIL: {len(failed)} smoketest scripts failed: {', '.join(failed)}")
+        else:
+            log.info("PASS: All smoketest scripts executed successfully")
+        log.info(f"Smoketest logs saved to: {log_file}")
+        sys.exit(1 if failed else 0)
@@ -0,0 +1,39 @@
+import argparse
+import re
+import sys
+from qa_libraries.instrumentation import run_report
+from qa_libraries.pod_log_scan import (
+    DEFAULT_JOBS,
+    ERROR_PATTERN,
+    check_pods_triggering_errors,
+    check_pods_without_logs,
+    format_namespace_aggregates,
+    load_pods,
+)
+from qa_libraries.logger import log
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan the pod logs of the current cluster concurrently")
+    parser.add_argument("check", choices=["errors", "no-logs"],
+                        help="'errors': pods whose last log lines contain errors; "
+                             "'no-logs': crashing pods that do not generate logs")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_JOBS,
+                        help=f"Maximum number of pod logs streamed at the same time (default: {DEFAULT_JOBS})")
+    parser.add_argument("--tail", type=int, default=4, help="Trailing log lines inspected per pod ('errors' only)")
+    parser.add_argument("--pattern", default=ERROR_PATTERN.pattern,
+                        help="Case-insensitive pattern of an error line ('errors' only, default: 'error')")
+
+    args = parser.parse_args()
+
+    with run_report("scan_pod_logs"):
+        pods = load_pods()
+        if args.check == "errors":
+            report = check_pods_triggering_errors(pods, jobs=args.jobs, tail=args.tail,
+                                                  pattern=re.compile(args.pattern, re.IGNORECASE))
+        else:
+            report = check_pods_without_logs(pods, jobs=args.jobs)
+
+        print("\n".join(report.lines))
+        for line in format_namespace_aggregates(report):
+            log.info(line)
+        sys.exit(0 if report.passed else 1)
@@ -0,0 +1,51 @@
+import argparse
+import os
+from qa_libraries.state_swap import state_lock
+from qa_libraries.tf_cluster_commands import get_target_cluster_dir
+from qa_libraries.tfstate_store import gc_blobs, get_state_store_dir, list_snapshots, list_stored_clusters, prune_snapshots
+from qa_libraries.logger import log
+from qa_libraries.workspaces import get_workspace_dir, materialize_workspace
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the Terraform state snapshots of the target-cluster directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="List the snapshots of one or all clusters")
+    list_parser.add_argument("-t", "--target", help="Target cluster name (default: all clusters)")
+
+    restore_parser = subparsers.add_parser("restore", help="Restore a snapshot into the cluster's workspace")
+    restore_parser.add_argument("-t", "--target", required=True, help="Target cluster name")
+    restore_parser.add_argument("-s", "--snapshot", help="Snapshot id or unique prefix (default: newest)")
+
+    prune_parser = subparsers.add_parser("prune", help="Apply the retention policy to the snapshots")
+    prune_parser.add_argument("-t", "--target", help="Target cluster name (default: all clusters)")
+    prune_parser.add_argument("--keep-last", type=int, default=None, help="Number of newest snapshots always kept")
+    prune_parser.add_argument("--max-age-days", type=float, default=None, help="Prune older snapshots past this age")
+
+    args = parser.parse_args()
+
+    cluster_dir = get_target_cluster_dir()
+    store_dir = get_state_store_dir(cluster_dir)
+
+    if args.command == "list":
+        for cluster_name in [args.target] if args.target else list_stored_clusters(store_dir):
+            log.info(f"Cluster: {cluster_name}")
+            for snapshot in reversed(list_snapshots(cluster_name, store_dir)):
+                log.info(f"  {snapshot['id']}  serial={snapshot['serial']}  lineage={snapshot['lineage']}  "
+                         f"files={', '.join(snapshot['files'])}")
+
+    elif args.command == "restore":
+        workspace_dir = get_workspace_dir(args.target, cluster_dir)
+        os.makedirs(workspace_dir, exist_ok=True)
+        with state_lock(workspace_dir):
+            materialize_workspace(args.target, cluster_dir, snapshot_id=args.snapshot)
+
+    elif args.command == "prune":
+        retention = {}
+        if args.keep_last is not None:
+            retention["keep_last"] = args.keep_last
+        if args.max_age_days is not None:
+            retention["max_age_days"] = args.max_age_days
+        for cluster_name in [args.target] if args.target else list_stored_clusters(store_dir):
+            prune_snapshots(cluster_name, store_dir, **retention)
+        gc_blobs(store_dir)
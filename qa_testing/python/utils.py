@@ -1,26 +1,19 @@
 # Import standard Python libraries (No need to check for their presence as they are built-in)
 import datetime
+import hashlib
+import importlib.util
 import os
 import platform
 import re
 import sys
+import sysconfig
 import time
-from typing import List
+from typing import Any, Callable, List
 
-# Check for missing required packages and attempt to import them
-missing_packages = []
-
-# Check for third-party packages
-try:
-    import pkg_resources
-    from pkg_resources import DistributionNotFound, VersionConflict
-except ModuleNotFoundError:
-    missing_packages.append("pkg_resources")
-
-try:
-    from progress.bar import IncrementalBar
-except ModuleNotFoundError:
-    missing_packages.append("progress.bar")
+# Check for missing required packages without importing them: pkg_resources scans every installed
+# distribution when imported, so it is only imported when the requirements actually have to be checked
+missing_packages = [package for package in ("pkg_resources", "progress")
+                    if importlib.util.find_spec(package) is None]
 
 if missing_packages:
     print("Missing required Python packages:")
@@ -31,6 +24,13 @@ if missing_packages:
     sys.exit(1)
 
 
+# Progress bar redraws per second while waiting
+WAIT_REDRAWS_PER_SECOND = 4
+
+# Stamp of the last successful requirements check, kept in the virtual environment
+REQUIREMENTS_STAMP_FILE = ".qa_requirements_stamp"
+
+
 def color_list(text_list: List[str], color_codes: List[str]) -> List[str]:
     colored_list = []
     for text in text_list:
@@ -189,15 +189,44 @@ def wait(sec: int, message: str = '', start_time: datetime.datetime = None) -> N
     reason = message + ' ' if message else ''
     status_message(f"Waiting {color_text(f'{sec}', ['t_l_purple'])} seconds {reason}to continue...", 'warning')
 
-    updates = int(sec * 100)
+    from progress.bar import IncrementalBar
+
+    updates = max(1, int(sec * WAIT_REDRAWS_PER_SECOND))
+    started = time.monotonic()
 
     with IncrementalBar('   ', max=updates, suffix='%(percent).1f%% - %(eta)ds') as bar:
-        for i in range(updates):
-            time.sleep(sec / updates)
+        for i in range(1, updates + 1):
+            # Sleep until the next redraw is due, so the time spent drawing does not add up
+            time.sleep(max(0.0, started + sec * i / updates - time.monotonic()))
             bar.next()
     return
 
 
+def wait_until(condition: Callable[[], Any], timeout: int, message: str = '',
+               start_time: datetime.datetime = None) -> bool:
+    """
+    Wait until a condition is met, polling it with backoff, instead of sleeping for a fixed time.
+    :param condition: Called on every poll; a truthy return value ends the wait.
+    :param timeout: Seconds after which the wait gives up.
+    :param message: What is waited for, e.g. 'for the ALB to be provisioned'.
+    :param start_time: Script start time, to print the time status.
+    :return: True as soon as the condition is met, False if the timeout expired first.
+    """
+    from qa_libraries.waiting import WaitTimeoutError, wait_for
+
+    if start_time:
+        print_time_status(start_time)
+
+    reason = message + ' ' if message else ''
+    status_message(f"Waiting up to {color_text(f'{timeout}', ['t_l_purple'])} seconds {reason}to continue...",
+                   'warning')
+    try:
+        wait_for(condition, timeout, message or 'the condition')
+    except WaitTimeoutError:
+        return False
+    return True
+
+
 def quit_now(message: str = '', start_time: datetime.datetime = None):
     if message:
         status_message(message, 'error', start_time)
@@ -221,8 +250,33 @@ def get_os_environment_variable(env_key_label: str, verbose: bool = False) -> st
         return env_value
 
 
+def get_requirements_stamp(requirements_file: str) -> str:
+    """
+    Key of a requirements check: the hash of the requirements file and the mtime of the
+    site-packages directory, which changes whenever a package is installed, upgraded or removed.
+    The same key is written by scripts/run_qa_py_venv.sh after installing the requirements.
+    """
+    with open(requirements_file, 'rb') as f:
+        requirements_hash = hashlib.sha256(f.read()).hexdigest()
+    site_packages_mtime = int(os.stat(sysconfig.get_paths()["purelib"]).st_mtime)
+    return f"{requirements_hash} {site_packages_mtime}"
+
+
 def verify_requirements(requirements_file: str = os.path.dirname(os.path.abspath(__file__)) +
                                                  '/requirements.txt') -> bool:
+    # The result is only cached inside a virtual environment, next to the packages it describes
+    stamp_file = os.path.join(sys.prefix, REQUIREMENTS_STAMP_FILE) if sys.prefix != sys.base_prefix else None
+    stamp = get_requirements_stamp(requirements_file)
+    if stamp_file and os.path.exists(stamp_file):
+        with open(stamp_file, 'r') as f:
+            if f.read().strip() == stamp:
+                status_message(f"All python module requirements are met (unchanged since the last check). "
+                               f"Proceed with script execution.", 'success')
+                return True
+
+    import pkg_resources
+    from pkg_resources import DistributionNotFound, VersionConflict
+
     try:
         with open(requirements_file, 'r') as f:
             requirements = f.read().splitlines()
@@ -230,6 +284,12 @@ def verify_requirements(requirements_file: str = os.path.dirname(os.path.abspath
         # Check if the installed packages meet the requirements
         pkg_resources.require(requirements)
         status_message(f"All python module requirements are met. Proceed with script execution.", 'success')
+        if stamp_file:
+            try:
+                with open(stamp_file, 'w') as f:
+                    f.write(f"{stamp}\n")
+            except OSError:
+                pass
         return True
     except (DistributionNotFound, VersionConflict) as e:
         cf_pip_cmd = color_text('pip download -r scripts/requirements.txt -d scripts/packages', ['t_l_yellow'])
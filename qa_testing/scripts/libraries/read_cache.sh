@@ -0,0 +1,76 @@
+#!/usr/bin/env bash
+
+###########################################################
+# Shell access to the read cache of the QA Python tools
+# (see python/qa_libraries/read_cache.py), so scripts reuse
+# the output of read-only aws/kubectl calls the Python tools
+# made recently, and the other way round.
+#
+# Usage: qa_cached_read <ttl-seconds> <scope> <command...>
+#
+# Prints the stdout of the command. Successful outputs are
+# spooled with the same key and format as the Python tools.
+
+# ShellCheck directive to suppress unused variable warnings
+# shellcheck disable=SC2034
+
+QA_READ_CACHE_DIR="${QA_READ_CACHE_DIR:-$(cd -- "$(dirname -- "$(readlink -f -- "${BASH_SOURCE[0]}")")/../.." &> /dev/null && pwd)/.cache/reads}"
+QA_READ_CACHE_TTL="${QA_READ_CACHE_TTL:-300}"
+QA_READ_CACHE_IDENTITY_TTL="${QA_READ_CACHE_IDENTITY_TTL:-3600}"
+
+# Cache scope of AWS reads: the profile, region and access key the aws CLI would use
+qa_aws_read_scope() {
+  local region
+  region="$(printenv AWS_REGION || printenv AWS_DEFAULT_REGION)"
+  printf "aws:%s:%s:%s" "${AWS_PROFILE:-default}" "$region" "$(printenv AWS_ACCESS_KEY_ID)"
+}
+
+qa_read_cache_key() {
+  if command -v sha256sum >/dev/null 2>&1; then
+    printf "%s\n%s" "$1" "$2" | sha256sum | cut -d' ' -f1
+  else
+    printf "%s\n%s" "$1" "$2" | shasum -a 256 | cut -d' ' -f1
+  fi
+}
+
+qa_cached_read() {
+  local ttl="$1" scope="$2"
+  shift 2
+  local command="$*"
+
+  if [ "${QA_READ_CACHE:-1}" == "0" ]; then
+    "$@"
+    return
+  fi
+
+  local key entry generation now entry_generation created output rc
+  key="$(qa_read_cache_key "$scope" "$command")"
+  entry="${QA_READ_CACHE_DIR}/entries/${key}"
+  generation="$(cat "${QA_READ_CACHE_DIR}/generation" 2>/dev/null)"
+  generation="${generation:-0}"
+  now="${EPOCHREALTIME:-$(date +%s)}"
+
+  if [ -f "${entry}.meta" ] && [ -f "${entry}.out" ]; then
+    read -r entry_generation created < "${entry}.meta"
+    if [ "$entry_generation" == "$generation" ] && \
+       awk -v now="$now" -v created="$created" -v ttl="$ttl" 'BEGIN { exit !(now - created < ttl) }'; then
+      cat "${entry}.out"
+      return 0
+    fi
+  fi
+
+  output="$("$@")"
+  rc=$?
+  if [ $rc -ne 0 ]; then
+    [ -n "$output" ] && printf "%s\n" "$output"
+    return $rc
+  fi
+  printf "%s\n" "$output"
+
+  # Same write order as the Python tools: the output first, then its meta line
+  mkdir -p "${QA_READ_CACHE_DIR}/entries" && \
+    printf "%s\n" "$output" > "${entry}.out.tmp-$$" && mv -f "${entry}.out.tmp-$$" "${entry}.out" && \
+    printf "%s %s\n%s\n%s\n" "$generation" "$now" "$scope" "$command" > "${entry}.meta.tmp-$$" && \
+    mv -f "${entry}.meta.tmp-$$" "${entry}.meta"
+  return 0
+}
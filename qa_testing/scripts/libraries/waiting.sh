@@ -0,0 +1,44 @@
+#!/usr/bin/env bash
+
+###########################################################
+# Readiness-driven waiting for the QA scripts (the shell
+# counterpart of python/qa_libraries/waiting.py).
+#
+# Usage: wait_for <timeout-seconds> <command...>
+#
+# Runs the command until it succeeds, sleeping between
+# attempts with exponential backoff (1s doubling up to
+# QA_WAIT_MAX_DELAY seconds, minus up to 20% jitter), and
+# returns 0 the moment it succeeds, or 1 once the timeout
+# has expired.
+
+QA_WAIT_MAX_DELAY="${QA_WAIT_MAX_DELAY:-15}"
+
+wait_for() {
+  local timeout="$1"
+  shift
+  local deadline=$((SECONDS + timeout))
+  local delay_ms=1000
+  local max_delay_ms=$((QA_WAIT_MAX_DELAY * 1000))
+  local sleep_ms remaining_ms
+
+  while true; do
+    "$@" && return 0
+
+    remaining_ms=$(((deadline - SECONDS) * 1000))
+    if [ "$remaining_ms" -le 0 ]; then
+      return 1
+    fi
+
+    sleep_ms=$((delay_ms - RANDOM % (delay_ms / 5 + 1)))
+    if [ "$sleep_ms" -gt "$remaining_ms" ]; then
+      sleep_ms=$remaining_ms
+    fi
+    sleep "$((sleep_ms / 1000)).$(printf '%03d' $((sleep_ms % 1000)))"
+
+    delay_ms=$((delay_ms * 2))
+    if [ "$delay_ms" -gt "$max_delay_ms" ]; then
+      delay_ms=$max_delay_ms
+    fi
+  done
+}
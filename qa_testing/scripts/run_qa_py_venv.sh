@@ -12,6 +12,7 @@ load_run_qa_py_venv() {
   local CALLER_DIR
   local VENV_NAME
   local VENV_PATH
+  local REQUIREMENTS_STAMP
 
   SCRIPT_LOCATION=$(cd -- "$(dirname -- "$(readlink -f -- "${BASH_SOURCE[0]:-$0}")")" &> /dev/null && pwd)
   CALLER_DIR=$(pwd)
@@ -24,6 +25,10 @@ load_run_qa_py_venv() {
   VENV_NAME=".venv_qa_testing"
   VENV_PATH="${QA_DIR}/${VENV_NAME}"
 
+  # Stamp of the last successful requirements install (see
+  # get_requirements_stamp); pip is skipped while it matches
+  REQUIREMENTS_STAMP="${VENV_PATH}/.qa_requirements_stamp"
+
   # Function to display help message
   usage_run_qa_py_venv() {
       printf "Usage: %s [OPTION]... [SCRIPT] [SCRIPT_ARGS]...\n\n" "$(get_this_python_script_name)"
@@ -44,6 +49,26 @@ load_run_qa_py_venv() {
       exit 0
   }
 
+  # Function to compute the key of an installed set of
+  # requirements: the hash of requirements.txt and the mtime
+  # of the venv site-packages directory, which changes
+  # whenever a package is installed, upgraded or removed
+  # (same format as get_requirements_stamp in utils.py)
+  get_requirements_stamp() {
+    local requirements_hash
+    local site_packages
+    local site_packages_mtime
+
+    if command -v sha256sum >/dev/null 2>&1; then
+      requirements_hash=$(sha256sum "${QA_PYTHON_DIR}/requirements.txt" | cut -d' ' -f1)
+    else
+      requirements_hash=$(shasum -a 256 "${QA_PYTHON_DIR}/requirements.txt" | cut -d' ' -f1)
+    fi
+    site_packages=$(ls -d "${VENV_PATH}"/lib/python3*/site-packages 2>/dev/null | head -n 1)
+    site_packages_mtime=$(stat -c %Y "${site_packages}" 2>/dev/null || stat -f %m "${site_packages}" 2>/dev/null)
+    echo "${requirements_hash} ${site_packages_mtime}"
+  }
+
   # Function to check if the virtual environment already
   # exists and that all the modules have been installed
   # that are in the requirements.txt
@@ -52,6 +77,9 @@ load_run_qa_py_venv() {
     if [ ! -d "${VENV_PATH}" ]; then
       MSG_WARN "Virtual environment: ${VENV_NAME} not found..."
       setup_venv
+    elif [ "$(cat "${REQUIREMENTS_STAMP}" 2>/dev/null)" == "$(get_requirements_stamp)" ]; then
+      # Nothing changed since the requirements were last installed
+      MSG_SUCS "Virtual environment ${VENV_NAME} is up to date."
     else
       # Ensure the virtual environment is using the correct packages
       MSG_EXEC "Virtual environment ${VENV_NAME} found, updating..."
@@ -59,7 +87,11 @@ load_run_qa_py_venv() {
       # Ensure pip is up to date and suppress already satisfied messages
       pip install --upgrade pip | grep -v 'Requirement already satisfied'
       pip install -r "${QA_PYTHON_DIR}/requirements.txt" | grep -v 'Requirement already satisfied'
+      local status=${PIPESTATUS[0]}
       deactivate
+      if [ "$status" -eq 0 ]; then
+        get_requirements_stamp > "${REQUIREMENTS_STAMP}"
+      fi
     fi
   }
 
@@ -92,6 +124,7 @@ load_run_qa_py_venv() {
     python3 -m pip install --upgrade pip
     python3 -m pip install -r "${QA_PYTHON_DIR}/requirements.txt" || { MSG_ERRR "Failed to install dependencies"; exit 1; }
     deactivate
+    get_requirements_stamp > "${REQUIREMENTS_STAMP}"
     is_deactivated_venv
     cd "${CALLER_DIR}" || { MSG_ERRR "Failed to return to the original directory"; exit 1; }
     MSG_SUCS "QA Testing Python Scripts: Successfully configured with all dependencies in virtual environment: ${VENV_NAME}"
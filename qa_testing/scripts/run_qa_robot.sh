@@ -74,9 +74,11 @@ kubelibrary_prerelease_testcases() {
         exit 1
       fi
 
-      # Run the Robot Framework tests from the robot directory
+      # Run the Robot Framework tests from the robot directory;
+      # qa_testing/python is on the path for the qa_libraries
+      # keyword libraries (e.g. qa_libraries.kube_checks)
       MSG_EXEC "Running Robot Framework tests $(txt_hotpink "${test_file}")..."
-      (cd "${QA_ROBOT_DIR}" && robot -P "$QA_THIRD_PARTY_DIR" "${test_file}")
+      (cd "${QA_ROBOT_DIR}" && robot -P "$QA_THIRD_PARTY_DIR" -P "$QA_PYTHON_DIR" "${test_file}")
       status=$?
     fi
     deactivate
@@ -39,6 +39,13 @@ LOG_FILE="${SCRIPT_LOCATION}/../logs/run_smoketest_temp.log"
 # Clear previous log file
 : > "$LOG_FILE"
 
+# Per-smoketest timings (same columns as the Python timing reports)
+TIMING_FILE="${SCRIPT_LOCATION}/../logs/run_smoketest_timings_temp.csv"
+echo "span_id,parent_id,name,category,label,start,end,duration,status,returncode,stdout_bytes,stderr_bytes,attributes" > "$TIMING_FILE"
+
+# Reuse the output of read-only aws calls made recently by the QA tools
+source "${SCRIPT_LOCATION}/libraries/read_cache.sh"
+
 # Get a list of all valid scripts in the smoketests subdirectory
 SMOKETEST_DIR="${SCRIPT_LOCATION}/smoketests"
 
@@ -78,15 +85,21 @@ if ! command -v aws >/dev/null 2>&1; then
 fi
 
 # Verify if the provided cluster name matches an accessible EKS cluster
-CLUSTERS=$(aws eks list-clusters --query clusters --output text)
-
-cluster_found=false
-for cluster in $CLUSTERS; do
+find_cluster() {
+  CLUSTERS=$(qa_cached_read "$1" "$(qa_aws_read_scope)" aws eks list-clusters --query clusters --output text)
+  for cluster in $CLUSTERS; do
     if [ "$cluster" == "$CLUSTER_NAME" ]; then
-        cluster_found=true
-        break
+      return 0
     fi
-done
+  done
+  return 1
+}
+
+cluster_found=false
+# A cached listing may predate the cluster, so a miss is confirmed with a live listing
+if find_cluster "$QA_READ_CACHE_TTL" || find_cluster 0; then
+  cluster_found=true
+fi
 
 if [ "$cluster_found" = false ]; then
     echo "Error: No matching EKS cluster found for '$CLUSTER_NAME'."
@@ -102,38 +115,48 @@ if ! curl -s --connect-timeout 5 https://eks.${AWS_REGION}.amazonaws.com >/dev/n
 fi
 
 # Validate access to AWS account
-if ! aws sts get-caller-identity >/dev/null 2>&1; then
+if ! ACCOUNT_ID=$(qa_cached_read "$QA_READ_CACHE_IDENTITY_TTL" "$(qa_aws_read_scope)" aws sts get-caller-identity --query Account --output text 2>/dev/null); then
   echo "Error: Unable to access AWS. Please ensure your credentials are valid and properly configured."
   exit 1
 fi
 
-# Check the current kubeconfig context
-CURRENT_CONTEXT=$(kubectl config current-context)
-
-# Determine the expected context name based on the cluster name
-ACCOUNT_ID=$(aws sts get-caller-identity --query Account --output text)
-EXPECTED_CONTEXT="arn:aws:eks:${AWS_REGION}:${ACCOUNT_ID}:cluster/${CLUSTER_NAME}"
-
-# If the current context doesn't match the expected context, prompt the user
-if [ "$CURRENT_CONTEXT" != "$EXPECTED_CONTEXT" ]; then
-  echo "Current kubeconfig context does not match the target cluster."
-  echo "Current context: $CURRENT_CONTEXT"
-  echo "Target cluster context: $EXPECTED_CONTEXT"
-  read -p "Do you want to switch to the target cluster context? (yes/no): " RESPONSE
-  if [ "$RESPONSE" == "yes" ]; then
-    aws eks update-kubeconfig --name "${CLUSTER_NAME}" --region "${AWS_REGION}"
-    echo "Switched to the target cluster context."
-  else
-    echo "Aborting script as the kubeconfig context was not switched."
+# Test through the cluster's own kubeconfig (written once and reused, see
+# python/qa_libraries/eks_auth.py) instead of switching the shared
+# ~/.kube/config; its credential helper caches the EKS token
+if [ "${QA_PER_CLUSTER_KUBECONFIG:-1}" != "0" ]; then
+  if ! KUBECONFIG=$(python3 "${SCRIPT_LOCATION}/../python/eks_kubeconfig.py" -t "${CLUSTER_NAME}" --region "${AWS_REGION}"); then
+    echo "Error: Unable to write the kubeconfig of the cluster."
     exit 1
   fi
+  export KUBECONFIG
+else
+  # Check the current kubeconfig context
+  CURRENT_CONTEXT=$(kubectl config current-context)
+
+  # Determine the expected context name based on the cluster name
+  EXPECTED_CONTEXT="arn:aws:eks:${AWS_REGION}:${ACCOUNT_ID}:cluster/${CLUSTER_NAME}"
+
+  # If the current context doesn't match the expected context, prompt the user
+  if [ "$CURRENT_CONTEXT" != "$EXPECTED_CONTEXT" ]; then
+    echo "Current kubeconfig context does not match the target cluster."
+    echo "Current context: $CURRENT_CONTEXT"
+    echo "Target cluster context: $EXPECTED_CONTEXT"
+    read -p "Do you want to switch to the target cluster context? (yes/no): " RESPONSE
+    if [ "$RESPONSE" == "yes" ]; then
+      aws eks update-kubeconfig --name "${CLUSTER_NAME}" --region "${AWS_REGION}"
+      echo "Switched to the target cluster context."
+    else
+      echo "Aborting script as the kubeconfig context was not switched."
+      exit 1
+    fi
+  fi
 fi
 
 # Log header information
 echo "***************************************************" | tee -a "$LOG_FILE"
 echo "Script Execution Started at: ${TIMESTAMP}" | tee -a "$LOG_FILE"
 echo "Target Cluster: $CLUSTER_NAME" | tee -a "$LOG_FILE"
-EKS_CLUSTER_VERSION=$(aws eks describe-cluster --name "$CLUSTER_NAME" --query cluster.version --output text)
+EKS_CLUSTER_VERSION=$(qa_cached_read "$QA_READ_CACHE_TTL" "$(qa_aws_read_scope)" aws eks describe-cluster --name "$CLUSTER_NAME" --query cluster.version --output text)
 echo "EKS Cluster Version: $EKS_CLUSTER_VERSION" | tee -a "$LOG_FILE"
 
 # Display the smoketest being run
@@ -153,13 +176,23 @@ run_test_script() {
   echo "Execute script-${SCRIPT_COUNTER}: $script_name" | tee -a "$LOG_FILE"
 
   # Execute the command and log both stdout and stderr
-  if ! "$script_path" "$@" >> "$LOG_FILE" 2>&1; then
+  local start_time end_time return_code status
+  start_time=$EPOCHREALTIME
+  "$script_path" "$@" >> "$LOG_FILE" 2>&1
+  return_code=$?
+  end_time=$EPOCHREALTIME
+
+  if [ $return_code -ne 0 ]; then
+    status="failed"
     echo "FAILED: Proceeding to the next smoketest." | tee -a "$LOG_FILE"
     FAIL_COUNT=$((FAIL_COUNT + 1))
   else
+    status="ok"
     echo "PASSED: Proceeding to the next smoketest." | tee -a "$LOG_FILE"
   fi
 
+  echo "${SCRIPT_COUNTER},,${script_name},smoketest,${CLUSTER_NAME},${start_time},${end_time},$(awk -v s="$start_time" -v e="$end_time" 'BEGIN { printf "%.3f", e - s }'),${status},${return_code},,," >> "$TIMING_FILE"
+
   # Increment the counter
   SCRIPT_COUNTER=$((SCRIPT_COUNTER + 1))
 }
@@ -202,8 +235,12 @@ NEW_LOG_FILE=$(realpath "$NEW_LOG_FILE")
 # Rename the log file adding date and time and the suffix based on pass/fail condition
 mv "$LOG_FILE" "$NEW_LOG_FILE"
 
+# Save the timings next to the log file
+mv "$TIMING_FILE" "${NEW_LOG_FILE%.log}_timings.csv"
+
 # Output the final log file name
 echo "Smoketest logs saved to: $NEW_LOG_FILE"
+echo "Smoketest timings saved to: ${NEW_LOG_FILE%.log}_timings.csv"
 
 # Exit with the correct return status
 [ $FAIL_COUNT -eq 0 ]
\ No newline at end of file
@@ -15,6 +15,10 @@
 #   7. Ensures all Nodes are in a Ready state.
 #   8. Confirms all Namespaces are in an Active phase.
 #
+# run_smoketests.py runs the same checks on a streaming evaluator
+# (check_cluster_health in qa_testing/python/qa_libraries/
+# kube_checks.py) with identical output; keep the two in sync.
+#
 #######################################################################
 
 # Load common utilities and variables
@@ -20,6 +20,11 @@ fi
 
 CLUSTER_NAME="$1"
 
+# Seconds to wait for a log stream to show up
+LOG_STREAM_TIMEOUT=20
+
+source "$(dirname "${BASH_SOURCE[0]}")/../libraries/waiting.sh"
+
 # Derive log group name from cluster name
 LOG_GROUP_NAME="/aws/containerinsights/$CLUSTER_NAME/application"
 
@@ -46,9 +51,7 @@ fi
 
 # Step 2: Verify that log streams exist and retrieve the most recent one
 # If no logs are found, it could indicate low activity rather than a configuration issue
-retry_count=0
-max_retries=3
-while [ $retry_count -le $max_retries ]; do
+log_streams_found() {
     LOG_STREAMS=$(aws logs describe-log-streams \
       --log-group-name "$LOG_GROUP_NAME" \
       --order-by "LastEventTime" \
@@ -56,15 +59,11 @@ while [ $retry_count -le $max_retries ]; do
       --limit 1 \
       --query 'logStreams[*].logStreamName' \
       --output text)
+    [ -n "$LOG_STREAMS" ]
+}
 
-    if [ -n "$LOG_STREAMS" ]; then
-        break
-    fi
-
-    retry_count=$((retry_count + 1))
-    echo "Retrying log stream check... Attempt $retry_count of $max_retries."
-    sleep 5  # Wait a few seconds before retrying
-done
+# Poll with backoff, returning as soon as a log stream shows up
+wait_for "$LOG_STREAM_TIMEOUT" log_streams_found
 
 if [ -z "$LOG_STREAMS" ]; then
     echo "FAIL: No log streams found for cluster '$CLUSTER_NAME' in log group '$LOG_GROUP_NAME'."
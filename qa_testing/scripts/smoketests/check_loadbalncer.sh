@@ -25,6 +25,12 @@ fi
 CLUSTER_NAME=$1
 LOADBALANCER_NAME=$CLUSTER_NAME-captain
 
+# Seconds to wait for the deployment to roll out and for the app to answer
+ROLLOUT_TIMEOUT=180
+ENDPOINT_TIMEOUT=100
+
+source "$(dirname "${BASH_SOURCE[0]}")/../libraries/waiting.sh"
+
 # Define YAML files for the deployment, service, and ingress resources
 cat <<EOF > app-deployment.yaml
 apiVersion: apps/v1
@@ -96,13 +102,13 @@ spec:
               number: 80
 EOF
 
-sleep 5
-
 # Apply the YAML files to deploy the resources
 kubectl apply -f app-deployment.yaml > /dev/null 2>&1
 kubectl apply -f app-service.yaml > /dev/null 2>&1
 kubectl apply -f app-ingress.yaml > /dev/null 2>&1
-sleep 5
+
+# Watch the rollout, which returns as soon as the pods are available
+kubectl rollout status deployment/app-deployment --timeout="${ROLLOUT_TIMEOUT}s" > /dev/null 2>&1
 
 # Get the POD_NAME, NODE_NAME, NODE_IP, and PORT
 POD_NAME=$(kubectl get pods -l app=app-label -o jsonpath='{.items[0].metadata.name}')
@@ -110,24 +116,17 @@ NODE_NAME=$(kubectl get pod "$POD_NAME" -o jsonpath='{.spec.nodeName}')
 NODE_IP=$(kubectl get node "$NODE_NAME" -o jsonpath='{.status.addresses[?(@.type=="InternalIP")].address}')
 PORT=$(kubectl get svc app-service -o jsonpath='{.spec.ports[0].nodePort}')
 
-# Retry logic for curl to access the NGINX app
-max_retries=10
-retry_interval=10
-retry_count=0
+# Poll the NGINX app with backoff until it answers
+endpoint_ready() {
+  curl -s --connect-timeout 5 "http://$NODE_IP:$PORT" | grep -q "Welcome to nginx"
+}
 
-while [ $retry_count -lt $max_retries ]; do
-  #echo "Testing the endpoint (Attempt $((retry_count + 1))/$max_retries)..."
-  response=$(curl -s http://$NODE_IP:$PORT)
-
-  if echo "$response" | grep -q "Welcome to nginx"; then
-    echo "Successfully received 'Welcome to nginx' message."
-    break
-  fi
-
-  echo "Response did not match. Retrying in $retry_interval seconds..."
-  sleep $retry_interval
-  retry_count=$((retry_count + 1))
-done
+if wait_for "$ENDPOINT_TIMEOUT" endpoint_ready; then
+  endpoint_found=true
+  echo "Successfully received 'Welcome to nginx' message."
+else
+  endpoint_found=false
+fi
 
 # Clean up YAML files and resources
 kubectl delete -f app-deployment.yaml > /dev/null 2>&1
@@ -136,8 +135,8 @@ kubectl delete -f app-ingress.yaml > /dev/null 2>&1
 rm app-deployment.yaml app-service.yaml app-ingress.yaml > /dev/null 2>&1
 
 # Handle failure cases after retries
-if [ $retry_count -eq $max_retries ]; then
-  echo "FAIL: Could not get 'Welcome to nginx' message after $max_retries attempts."
+if [ "$endpoint_found" = false ]; then
+  echo "FAIL: Could not get 'Welcome to nginx' message within $ENDPOINT_TIMEOUT seconds."
   exit 1
 fi
 